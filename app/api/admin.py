@@ -0,0 +1,66 @@
+"""
+Admin API
+Operational endpoints: response cache and purchase retry statistics, the slow-query log and profiling.
+"""
+from fastapi import APIRouter
+
+from app.cache import response_cache
+from app.metrics import slow_query_log
+from app.profiling import profiler
+from app.api import purchase
+
+router = APIRouter()
+
+# ============================================================================================
+# GET /admin/cache
+# Purpose: Report the response cache configuration, size and hit/miss counters per route.
+# ============================================================================================
+@router.get("/cache")
+def get_cache_stats():
+    """
+    Report response cache statistics.
+    Returns: Enabled routes, TTL, entry counts and hits/misses per route
+    """
+    return response_cache.stats()
+
+
+# ============================================================================================
+# GET /admin/purchases
+# Purpose: Report completed purchases, retried write conflicts, failed purchases and group commit batches.
+# ============================================================================================
+@router.get("/purchases")
+def get_purchase_stats():
+    """
+    Report purchase retry statistics, and group commit statistics when the single-writer mode is enabled.
+    Returns: Purchase, retry and failure counts, the retries per purchase attempt and the writer's batches
+    """
+    stats = purchase.purchase_stats.stats()
+    if purchase.purchase_writer is not None:
+        stats["writer"] = purchase.purchase_writer.stats()
+    return stats
+
+
+# ============================================================================================
+# GET /admin/slow_queries
+# Purpose: Show the most recent statements over SLOW_QUERY_MS with their route, parameter types and query plan.
+# ============================================================================================
+@router.get("/slow_queries")
+def get_slow_queries():
+    """
+    Report the slow-query log, most recent first.
+    Returns: Threshold, capacity, number of statements logged so far and the records kept in the ring buffer
+    """
+    return slow_query_log.stats()
+
+
+# ============================================================================================
+# GET /admin/profiling
+# Purpose: Report the profiling configuration and how many requests were profiled.
+# ============================================================================================
+@router.get("/profiling")
+def get_profiling_stats():
+    """
+    Report per-request profiling settings and counters.
+    Returns: Whether profiling is enabled, sample rate, trigger header, artifact directory and profile counts
+    """
+    return profiler.stats()
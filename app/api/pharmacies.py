@@ -2,25 +2,72 @@
 Pharmacies API
 Provides pharmacy query, mask query, and filter functions.
 """
-from fastapi import APIRouter, Query, Depends, Path, HTTPException
+from fastapi import APIRouter, Query, Depends, Path, HTTPException, Request, Response
 from datetime import datetime
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from decimal import ROUND_CEILING, ROUND_FLOOR
+from typing import Optional
+from sqlalchemy.orm import Session, contains_eager, selectinload
+from sqlalchemy import func, and_, or_, tuple_
 
-from app.db import SessionLocal
-from app.models import Pharmacy, OpeningHour, PharmacyMask, Mask
+from app.config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from app.db import get_read_db
+from app.cache import versioned_response, CATALOG, BALANCES
+from app.models import Pharmacy, OpeningInterval, PharmacyMask, Mask
+from app.utils.money import to_cents, from_cents
+from app.utils.pagination import Page, decode_cursor, split_page
+from app.utils.time_parser import minute_of_week, MINUTES_PER_DAY, MINUTES_PER_WEEK
 
 router = APIRouter()
 
-def get_db():
+
+def parse_minute_of_week(weekday: str, time_str: str) -> int:
     """
-    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
+    Convert a weekday and an HH:MM time into minutes since Monday 00:00, or raise a 400 error.
     """
-    db = SessionLocal()
     try:
-        yield db
-    finally:
-        db.close()
+        query_time = datetime.strptime(time_str, "%H:%M").time()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid time format. Use HH:MM.")
+    try:
+        return minute_of_week(weekday, query_time)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Invalid weekday. Use Mon, Tue, ..., Sun.")
+
+
+def open_during(start_minute: int, end_minute: int):
+    """
+    Condition matching opening intervals that overlap the closed range [start_minute, end_minute].
+    Intervals never exceed a day, so the condition is a bounded range seek on the start_minute index.
+    """
+    return and_(
+        OpeningInterval.start_minute > start_minute - MINUTES_PER_DAY,
+        OpeningInterval.start_minute <= end_minute,
+        OpeningInterval.end_minute > start_minute
+    )
+
+
+def pharmacies_open_during(db: Session, ranges: list, limit: int, after, include_total: bool):
+    """
+    Query one page of the distinct pharmacies with an opening interval overlapping any of the minute-of-week
+    ranges, in id order. The page is a primary key seek past the cursor's pharmacy id.
+    - after: (pharmacy_id,) of the last pharmacy of the previous page, or None
+    Returns: Page of pharmacies
+    """
+    open_ids = db.query(OpeningInterval.pharmacy_id).filter(
+        or_(*[open_during(start_minute, end_minute) for start_minute, end_minute in ranges])
+    )
+    pharmacies = db.query(Pharmacy).filter(Pharmacy.id.in_(open_ids))
+    total = pharmacies.count() if include_total else None
+    if after is not None:
+        pharmacies = pharmacies.filter(Pharmacy.id > after[0])
+    pharmacies, next_cursor = split_page(
+        pharmacies.order_by(Pharmacy.id).limit(limit + 1).all(), limit, lambda pharmacy: [pharmacy.id]
+    )
+
+    return Page([
+        {"pharmacy_id": pharmacy.id, "pharmacy_name": pharmacy.name, "cash_balance": from_cents(pharmacy.cash_balance_cents)}
+        for pharmacy in pharmacies
+    ], next_cursor, total)
 
 
 # ============================================================================================
@@ -28,52 +75,104 @@ def get_db():
 # Purpose: List all pharmacies open at a specific time and on a day of the week.
 # ============================================================================================  
 @router.get("/open")
-def get_open_pharmacies(
+async def get_open_pharmacies(
+    request: Request,
+    response: Response,
     weekday: str = Query("Mon", description="Weekday (Mon, Tue, ..., etc.)"),
     time_str: str = Query("08:30", description="Time (HH:MM, 24-hour format, e.g., 08:30)"),
-    db: Session = Depends(get_db)
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of matching items as X-Total-Count"),
+    db: Session = Depends(get_read_db)
 ):
     """
-    Query pharmacies open at a specific weekday and time.
+    Query pharmacies open at a specific weekday and time, including overnight hours
+    that started the previous day (e.g. 'Mon 20:00 - 02:00' is open on Tue 01:00).
     - weekday: Day of week (Mon, Tue, ..., etc.)
     - time_str: Time (HH:MM, 24-hour format, e.g., 08:30)
+    - limit, cursor, include_total: Page size, X-Next-Cursor of the previous page, send X-Total-Count
     - db: Database session (auto-injected)
-    Returns: List of pharmacies matching the criteria
+    Returns: One page of the pharmacies matching the criteria, in id order
     """
-    try:
-        query_time = datetime.strptime(time_str, "%H:%M").time()
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid time format. Use HH:MM.")
+    query_minute = parse_minute_of_week(weekday, time_str)
+    after = decode_cursor(cursor, (int,))
+    return await versioned_response(
+        request, response, db, "pharmacies_open", (CATALOG, BALANCES),
+        pharmacies_open_during, [(query_minute, query_minute)], limit, after, include_total
+    )
 
-    pharmacies = db.query(Pharmacy).join(OpeningHour).filter(
-        OpeningHour.day_of_week == weekday,
-        ((OpeningHour.start_time <= OpeningHour.end_time) &
-         (OpeningHour.start_time <= query_time) &
-         (OpeningHour.end_time > query_time))
-        |
-        ((OpeningHour.start_time > OpeningHour.end_time) &
-         ((query_time >= OpeningHour.start_time) | (query_time < OpeningHour.end_time)))
-    ).all()
+# ============================================================================================
+# GET /pharmacies/open_between
+# Purpose: List all pharmacies open at any point within a weekly time range.
+# ============================================================================================
+@router.get("/open_between")
+async def get_pharmacies_open_between(
+    request: Request,
+    response: Response,
+    start_weekday: str = Query(..., description="Range start weekday (Mon, Tue, ..., etc.)"),
+    start_time: str = Query(..., description="Range start time (HH:MM, 24-hour format)"),
+    end_weekday: str = Query(..., description="Range end weekday (Mon, Tue, ..., etc.)"),
+    end_time: str = Query(..., description="Range end time (HH:MM, 24-hour format)"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of matching items as X-Total-Count"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Query pharmacies open at any point between two weekly times (both inclusive).
+    A range ending before it starts wraps around the end of the week (e.g. Sun 22:00 - Mon 02:00).
+    - start_weekday, start_time: Range start
+    - end_weekday, end_time: Range end
+    - limit, cursor, include_total: Page size, X-Next-Cursor of the previous page, send X-Total-Count
+    Returns: One page of the pharmacies matching the criteria, in id order
+    """
+    start_minute = parse_minute_of_week(start_weekday, start_time)
+    end_minute = parse_minute_of_week(end_weekday, end_time)
+    after = decode_cursor(cursor, (int,))
 
-    return [
-        {"pharmacy_id": pharmacy.id, "pharmacy_name": pharmacy.name, "cash_balance": pharmacy.cash_balance} for pharmacy in pharmacies
-    ]
+    if start_minute <= end_minute:
+        ranges = [(start_minute, end_minute)]
+    else:
+        ranges = [(start_minute, MINUTES_PER_WEEK - 1), (0, end_minute)]
+    return await versioned_response(
+        request, response, db, "pharmacies_open_between", (CATALOG, BALANCES),
+        pharmacies_open_during, ranges, limit, after, include_total
+    )
 
 # ============================================================================================
 # GET /pharmacies/{pharmacy_name}/masks
 # Purpose: Query masks sold by a specific pharmacy, sorted by name or price.
 # ============================================================================================
 @router.get("/{pharmacy_name}/masks")
-def get_pharmacy_masks_by_pharmacy_name(
+async def get_pharmacy_masks_by_pharmacy_name(
+    request: Request,
+    response: Response,
     pharmacy_name: str = Path(..., description="Pharymacy Name"),
     sort_by: str = Query("name", enum=["name", "price"]),
-    db: Session = Depends(get_db)
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of matching items as X-Total-Count"),
+    db: Session = Depends(get_read_db)
 ):
     """
     Query masks sold by a specific pharmacy, sorted by name or price.
     - pharmacy_name: Pharmacy name
     - sort_by: Sort by ('name' or 'price')
-    Returns: List of masks
+    - limit, cursor, include_total: Page size, X-Next-Cursor of the previous page, send X-Total-Count
+    Returns: One page of masks
+    """
+    after = decode_cursor(cursor, (str if sort_by == "name" else int, int))
+    return await versioned_response(
+        request, response, db, "pharmacy_masks", (CATALOG,),
+        list_pharmacy_masks, pharmacy_name, sort_by, limit, after, include_total
+    )
+
+
+def list_pharmacy_masks(db: Session, pharmacy_name: str, sort_by: str, limit: int, after, include_total: bool):
+    """
+    Query one page of the masks sold by a specific pharmacy (sync part of get_pharmacy_masks_by_pharmacy_name).
+    Masks are ordered by (name or price, pharmacy mask id) and a page seeks past the cursor's key.
+    - after: Sort key of the last mask of the previous page, or None
     """
     # Look up the pharmacy by name
     pharmacy = db.query(Pharmacy).filter_by(name=pharmacy_name).first()
@@ -81,44 +180,56 @@ def get_pharmacy_masks_by_pharmacy_name(
         raise HTTPException(status_code=404, detail="Pharmacy not found")
     
     # Query masks for that pharmacy
-    pharmacy_masks = db.query(PharmacyMask).join(Mask).filter(
+    pharmacy_masks = db.query(PharmacyMask).join(Mask).options(contains_eager(PharmacyMask.mask)).filter(
         PharmacyMask.pharmacy == pharmacy
     )
 
     if sort_by == "name":
-        pharmacy_masks = pharmacy_masks.order_by(Mask.name)
-    elif sort_by == "price":
-        pharmacy_masks = pharmacy_masks.order_by(PharmacyMask.price)
-    
-    results = pharmacy_masks.all()
+        sort_column, sort_value = Mask.name, lambda pharmacy_mask: pharmacy_mask.mask.name
+    else:
+        sort_column, sort_value = PharmacyMask.price_cents, lambda pharmacy_mask: pharmacy_mask.price_cents
 
-    return [
+    total = pharmacy_masks.count() if include_total else None
+    if after is not None:
+        pharmacy_masks = pharmacy_masks.filter(tuple_(sort_column, PharmacyMask.id) > tuple_(*after))
+    results, next_cursor = split_page(
+        pharmacy_masks.order_by(sort_column, PharmacyMask.id).limit(limit + 1).all(), limit,
+        lambda pharmacy_mask: [sort_value(pharmacy_mask), pharmacy_mask.id]
+    )
+
+    return Page([
         {
             "mask_id": pharmacyMask.id,
             "mask_name": pharmacyMask.mask.name,
-            "price": pharmacyMask.price
+            "price": from_cents(pharmacyMask.price_cents)
         }
         for pharmacyMask in results
-    ]
+    ], next_cursor, total)
 
 # ============================================================================================
 # GET /pharmacies/filter_by_mask_count
 # Purpose: List all pharmacies with more or less than x mask products within a price range.
 # ============================================================================================
 @router.get("/filter_by_mask_count_within_price_range")
-def filter_pharmacies_by_mask_count(
+async def filter_pharmacies_by_mask_count(
+    request: Request,
+    response: Response,
     min_price: float = Query(..., ge=0),
     max_price: float = Query(..., ge=0),
     count: int = Query(..., ge=0),
     comparison: str = Query(..., enum=["more", "fewer"]),
-    db: Session = Depends(get_db)
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of matching items as X-Total-Count"),
+    db: Session = Depends(get_read_db)
 ):
     """
     Filter pharmacies by mask price range and count condition.
     - min_price, max_price: Price range
     - count: Mask count threshold
     - comparison: 'more' or 'fewer'
-    Returns: Pharmacies and their masks matching the condition
+    - limit, cursor, include_total: Page size, X-Next-Cursor of the previous page, send X-Total-Count
+    Returns: One page of the pharmacies matching the condition (in id order) and their masks
     """
     # Handle unexcepted error
     if min_price > max_price:
@@ -127,14 +238,29 @@ def filter_pharmacies_by_mask_count(
         raise HTTPException(status_code=400, detail="comparison must be 'more' or 'fewer'")
     if count < 0:
         raise HTTPException(status_code=400, detail="count must be >= 0")
-    
+    after = decode_cursor(cursor, (int,))
+
+    return await versioned_response(
+        request, response, db, "pharmacies_filter", (CATALOG,),
+        list_pharmacies_by_mask_count, to_cents(min_price, ROUND_CEILING), to_cents(max_price, ROUND_FLOOR),
+        count, comparison, limit, after, include_total
+    )
+
+
+def list_pharmacies_by_mask_count(db: Session, min_price_cents: int, max_price_cents: int, count: int, comparison: str,
+                                  limit: int, after, include_total: bool):
+    """
+    Query one page of pharmacies by mask price range (in cents) and count condition, in id order
+    (sync part of filter_pharmacies_by_mask_count).
+    - after: (pharmacy_id,) of the last pharmacy of the previous page, or None
+    """
     # Build a subquery that counts qualifying masks per pharmacy
     mask_count_subquery = (
         db.query(
             PharmacyMask.pharmacy_id,
             func.count(PharmacyMask.id).label("mask_count")
         )
-        .filter(PharmacyMask.price >= min_price, PharmacyMask.price <= max_price)
+        .filter(PharmacyMask.price_cents >= min_price_cents, PharmacyMask.price_cents <= max_price_cents)
         .group_by(PharmacyMask.pharmacy_id)
         .subquery()
     )
@@ -145,12 +271,22 @@ def filter_pharmacies_by_mask_count(
     else:
         filter_condition = mask_count_subquery.c.mask_count <= count
 
-    # Get pharmacies matching condition
+    # Get one page of the pharmacies matching condition
     matched_pharmacies = (
         db.query(Pharmacy)
         .join(mask_count_subquery, Pharmacy.id == mask_count_subquery.c.pharmacy_id)
         .filter(filter_condition)
-        .all()
+    )
+    total = matched_pharmacies.count() if include_total else None
+    if after is not None:
+        matched_pharmacies = matched_pharmacies.filter(Pharmacy.id > after[0])
+    matched_pharmacies, next_cursor = split_page(
+        matched_pharmacies
+        .options(selectinload(Pharmacy.masks).joinedload(PharmacyMask.mask))
+        .order_by(Pharmacy.id)
+        .limit(limit + 1)
+        .all(),
+        limit, lambda pharmacy: [pharmacy.id]
     )
 
     # For each matched pharmacy, get its masks in the price range
@@ -160,10 +296,10 @@ def filter_pharmacies_by_mask_count(
             {
                 "mask_id": pharmacy_mask.id,
                 "mask_name": pharmacy_mask.mask.name,
-                "price": pharmacy_mask.price
+                "price": from_cents(pharmacy_mask.price_cents)
             }
             for pharmacy_mask in pharmacy.masks
-            if min_price <= pharmacy_mask.price <= max_price
+            if min_price_cents <= pharmacy_mask.price_cents <= max_price_cents
         ]
         result.append({
             "pharmacy_id": pharmacy.id,
@@ -172,12 +308,12 @@ def filter_pharmacies_by_mask_count(
         })
 
     if not result:
-        return {
+        return Page({
             "message": "No pharmacies matched the condition.",
             "data": []
-        }
+        }, next_cursor, total)
     else:
-        return {
+        return Page({
             "message": "Filtered pharmacies retrieved successfully.",
             "data": result
-        }
+        }, next_cursor, total)
@@ -1,26 +1,29 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import bindparam, insert, select, tuple_, update
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 from pydantic import BaseModel
 from typing import List
 from datetime import datetime, timezone
 
-from app.db import SessionLocal
+from app.config import (
+    PURCHASE_RETRIES, PURCHASE_RETRY_BACKOFF_MS, PURCHASE_WRITER, PURCHASE_BATCH_SIZE, PURCHASE_BATCH_WAIT_MS
+)
+from app.db import get_db, run_db, SessionLocal
 from app.models import User, Pharmacy, Mask, PharmacyMask, Transaction
+from app.cache import bump_versions, data_versions, BALANCES, SALES
+from app.rollups import record_daily_sales, record_user_spend
+from app.utils.money import from_cents
 
 router = APIRouter()
 
-# Dependency
-def get_db():
-    """
-    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
-    """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
 # ---------------------------
 # Pydantic input model
@@ -38,84 +41,416 @@ class PurchaseRequest(BaseModel):
     items: List[PurchaseItem]
 
 
+def no_db():
+    """
+    Stand-in for get_db when purchases go through the writer, which opens its own sessions: the route then holds
+    no pooled connection next to the writer's.
+    """
+    return None
+
+
+def purchase_db_dependency(writer_enabled: bool):
+    return no_db if writer_enabled else get_db
+
+
 # ==============================================================================================
 # POST /purchase
 # Purpose: Handle mask purchase request, check balance, record transaction, and deduct funds.
 # ===============================================================================================
 @router.post("")
-def purchase_masks(
+async def purchase_masks(
     data: PurchaseRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(purchase_db_dependency(PURCHASE_WRITER))
 ):
     """
     Handle mask purchase request, check balance, record transaction, and deduct funds.
     - data: Purchase request data
-    - db: Database session
+    - db: Database session (None when PURCHASE_WRITER is on)
     Returns: Purchase result message
     """
+    if purchase_writer is not None:
+        return await purchase_writer.purchase(data)
+    # Retry here rather than in process_purchase, so the backoff is awaited instead of blocking a worker
+    # thread or, with an AsyncSession, the event loop
+    for attempt in range(PURCHASE_RETRIES + 1):
+        result, delay = await run_db(db, attempt_purchase, data, attempt)
+        if delay is None:
+            return result
+        await asyncio.sleep(delay)
+
+
+class PurchaseStats:
+    """
+    Thread-safe counters of completed purchases, retried conflicts and purchases that failed after retrying.
+    """
+    def __init__(self):
+        self.purchases = 0
+        self.retries = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def record(self, retries: int, failed: bool = False):
+        with self.lock:
+            self.retries += retries
+            if failed:
+                self.failures += 1
+            else:
+                self.purchases += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            attempts = self.purchases + self.failures
+            return {
+                "purchases": self.purchases,
+                "retries": self.retries,
+                "failures": self.failures,
+                "retry_rate": self.retries / attempts if attempts else 0.0,
+            }
+
+
+purchase_stats = PurchaseStats()
+
+
+def is_write_conflict(error: OperationalError) -> bool:
+    """
+    Tell whether a database error is a transient conflict with a concurrent writer, worth retrying.
+    Covers SQLite busy/locked errors and PostgreSQL serialization failures and deadlocks.
+    """
+    orig = error.orig
+    if getattr(orig, "sqlite_errorcode", None) is not None:
+        return orig.sqlite_errorcode & 0xFF in (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED and their extended codes
+    if getattr(orig, "pgcode", None) in ("40001", "40P01"):
+        return True
+    return "database is locked" in str(orig)
+
+
+def process_purchase(db: Session, data: PurchaseRequest):
+    """
+    Apply a purchase, retrying it up to PURCHASE_RETRIES times with jittered exponential backoff
+    when it conflicts with a concurrent write (blocking variant, for the purchase writer thread).
+    """
+    for attempt in range(PURCHASE_RETRIES + 1):
+        result, delay = attempt_purchase(db, data, attempt)
+        if delay is None:
+            return result
+        time.sleep(delay)
+
+
+def attempt_purchase(db: Session, data: PurchaseRequest, attempt: int):
+    """
+    Make attempt number `attempt` (from 0) at applying a purchase.
+    Returns: (result, None) on success, or (None, backoff seconds) after a write conflict worth retrying;
+    other errors are raised as HTTPException
+    """
+    try:
+        result = apply_purchase(db, data)
+    except HTTPException:
+        db.rollback()
+        raise
+    except OperationalError as e:
+        db.rollback()
+        if attempt < PURCHASE_RETRIES and is_write_conflict(e):
+            return None, random.random() * PURCHASE_RETRY_BACKOFF_MS * 2 ** attempt / 1000
+        purchase_stats.record(attempt, failed=True)
+        raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+    except SQLAlchemyError as e:
+        db.rollback()
+        purchase_stats.record(attempt, failed=True)
+        raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+    purchase_stats.record(attempt)
+    return result, None
+
+
+def apply_purchase(db: Session, data: PurchaseRequest):
+    """
+    Validate and apply a purchase in one database transaction.
+    """
+    result = stage_purchase(db, data)
+    if data.items:
+        bump_versions(db, BALANCES, SALES)
+    db.commit()
+    if data.items:
+        data_versions.invalidate()
+    return result
+
+
+def stage_purchase(db: Session, data: PurchaseRequest):
+    """
+    Validate a purchase and write it in the current transaction, without committing.
+    Every validation error (HTTPException) is raised before the purchase writes anything, so a failed
+    purchase leaves the transaction as it was and other purchases can share it.
+    Balances are changed with conditional, relative UPDATEs, so concurrent purchases can neither
+    overdraw a wallet nor overwrite each other's credits. An empty cart writes nothing.
+    """
     # Step 1: Validate user
     user = db.query(User).filter_by(name=data.user_name).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    total_cost = 0.0
+    total_cost_cents = 0
     transactions = []
 
-    try:
-        # Step 2: Validate each item and calculate cost
-        for item in data.items:
-            pharmacy = db.query(Pharmacy).filter_by(name=item.pharmacy_name).first()
-            if not pharmacy:
-                raise HTTPException(status_code=404, detail=f"Pharmacy '{item.pharmacy_name}' not found")
-            
-            mask = db.query(Mask).filter_by(name=item.mask_name).first()
-            if not mask:
-                raise HTTPException(status_code=404, detail=f"Mask '{item.mask_name}' not found")
-            
-            pharmacy_mask = db.query(PharmacyMask).filter_by(pharmacy_id=pharmacy.id, mask_id=mask.id).first()
-            if not pharmacy_mask:
-                raise HTTPException(status_code=404, detail=f"Mask '{mask.name}' not sold by '{pharmacy.name}'")
-            
-            cost = item.quantity * pharmacy_mask.price
-            total_cost += cost
-
-            transactions.append({
-                "user_id": user.id,
-                "pharmacy_id": pharmacy.id,
-                "mask_id": mask.id,
-                "transaction_amount": cost
-            })
+    # Step 2: Validate each item and calculate cost, resolving all names with a fixed number of queries
+    pharmacies, masks, pharmacy_masks = resolve_items(db, data.items)
+    for item in data.items:
+        pharmacy = pharmacies.get(item.pharmacy_name)
+        if not pharmacy:
+            raise HTTPException(status_code=404, detail=f"Pharmacy '{item.pharmacy_name}' not found")
         
-        # Step 3: Check user balance
-        if total_cost > user.cash_balance:
-            raise HTTPException(status_code=400, detail="Insufficient balance")
+        mask = masks.get(item.mask_name)
+        if not mask:
+            raise HTTPException(status_code=404, detail=f"Mask '{item.mask_name}' not found")
         
-        # Step 4: Process purchase (atomic)
-        user.cash_balance -= total_cost
-        for transaction in transactions:
-            # Add money to the pharmacy
-            pharmacy = db.get(Pharmacy, transaction["pharmacy_id"])
-            pharmacy.cash_balance += transaction["transaction_amount"]
-
-            # Record the transaction
-            transaction_data = Transaction(
-                user_id=transaction["user_id"],
-                pharmacy_id=transaction["pharmacy_id"],
-                mask_id=transaction["mask_id"],
-                transaction_amount=transaction["transaction_amount"],
-                transaction_date=datetime.now(timezone.utc)
-            )
-            db.add(transaction_data)
+        pharmacy_mask = pharmacy_masks.get((pharmacy.id, mask.id))
+        if not pharmacy_mask:
+            raise HTTPException(status_code=404, detail=f"Mask '{mask.name}' not sold by '{pharmacy.name}'")
         
-        db.commit()
+        cost_cents = item.quantity * pharmacy_mask.price_cents
+        total_cost_cents += cost_cents
 
-        return {
+        transactions.append({
             "user_id": user.id,
-            "user_name": user.name,
-            "total_amount": round(total_cost, 2),
-            "message": "Purchase completed susccessfully"
-        }
+            "pharmacy_id": pharmacy.id,
+            "mask_id": mask.id,
+            "quantity": item.quantity,
+            "unit_price_cents": pharmacy_mask.price_cents,
+            "transaction_amount_cents": cost_cents
+        })
     
-    except SQLAlchemyError as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+    if not transactions:
+        return purchase_result(user, 0)
+
+    # Step 3: Check user balance
+    if total_cost_cents > user.cash_balance_cents:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    
+    # Step 4: Process purchase (atomic). The debit only applies while the balance still covers the cost,
+    # which a concurrent purchase may have changed since it was read.
+    users = User.__table__
+    debited = db.execute(
+        update(users)
+        .where(users.c.id == user.id, users.c.cash_balance_cents >= total_cost_cents)
+        .values(cash_balance_cents=users.c.cash_balance_cents - total_cost_cents)
+    )
+    if debited.rowcount != 1:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+
+    # Add money to each pharmacy once, with the total of its items
+    credits = {}
+    for transaction in transactions:
+        pharmacy_id = transaction["pharmacy_id"]
+        credits[pharmacy_id] = credits.get(pharmacy_id, 0) + transaction["transaction_amount_cents"]
+    pharmacies_table = Pharmacy.__table__
+    db.execute(
+        update(pharmacies_table)
+        .where(pharmacies_table.c.id == bindparam("b_id"))
+        .values(cash_balance_cents=pharmacies_table.c.cash_balance_cents + bindparam("b_amount_cents")),
+        [{"b_id": pharmacy_id, "b_amount_cents": amount_cents} for pharmacy_id, amount_cents in credits.items()]
+    )
+
+    # Record the transactions with a single executemany
+    transaction_date = datetime.now(timezone.utc)
+    db.execute(insert(Transaction), [
+        {**transaction, "transaction_date": transaction_date} for transaction in transactions
+    ])
+
+    # Update the daily sales and user spend rollups in the same database transaction
+    record_daily_sales(db, [
+        {
+            "day": transaction_date.date(),
+            "pharmacy_id": transaction["pharmacy_id"],
+            "mask_id": transaction["mask_id"],
+            "quantity": transaction["quantity"],
+            "total_value_cents": transaction["transaction_amount_cents"]
+        }
+        for transaction in transactions
+    ])
+    record_user_spend(db, transaction_date.date(), user.id, total_cost_cents)
+
+    return purchase_result(user, total_cost_cents)
+
+
+def purchase_result(user: User, total_cost_cents: int) -> dict:
+    return {
+        "user_id": user.id,
+        "user_name": user.name,
+        "total_amount": from_cents(total_cost_cents),
+        "message": "Purchase completed susccessfully"
+    }
+
+
+def resolve_items(db: Session, items: List[PurchaseItem]):
+    """
+    Look up the pharmacies, masks and pharmacy-mask prices of all items with one IN-list query each.
+    Returns: (pharmacies by name, masks by name, pharmacy masks by (pharmacy_id, mask_id))
+    """
+    pharmacy_names = {item.pharmacy_name for item in items}
+    mask_names = {item.mask_name for item in items}
+    if not pharmacy_names:
+        return {}, {}, {}
+
+    pharmacies = {
+        pharmacy.name: pharmacy
+        for pharmacy in db.scalars(select(Pharmacy).where(Pharmacy.name.in_(pharmacy_names)))
+    }
+    masks = {mask.name: mask for mask in db.scalars(select(Mask).where(Mask.name.in_(mask_names)))}
+
+    pairs = {
+        (pharmacies[item.pharmacy_name].id, masks[item.mask_name].id)
+        for item in items if item.pharmacy_name in pharmacies and item.mask_name in masks
+    }
+    pharmacy_masks = {}
+    if pairs:
+        pharmacy_masks = {
+            (pharmacy_mask.pharmacy_id, pharmacy_mask.mask_id): pharmacy_mask
+            for pharmacy_mask in db.scalars(
+                select(PharmacyMask).where(tuple_(PharmacyMask.pharmacy_id, PharmacyMask.mask_id).in_(pairs))
+            )
+        }
+    return pharmacies, masks, pharmacy_masks
+
+
+class PurchaseWriter:
+    """
+    Single writer thread applying queued purchases with group commit: up to batch_size purchases share one
+    transaction, and a batch waits at most max_wait_ms to fill. Each caller still gets its own result or error.
+    If the batch transaction fails, its purchases are applied again one transaction each (with retry).
+    """
+    def __init__(self, session_factory=SessionLocal, batch_size: int = PURCHASE_BATCH_SIZE,
+                 max_wait_ms: int = PURCHASE_BATCH_WAIT_MS):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = None
+        self.batches = 0
+        self.orders = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="purchase-writer", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """
+        Apply the purchases already queued, then stop the writer thread.
+        """
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+
+    def submit(self, data: PurchaseRequest) -> Future:
+        """
+        Queue a purchase; the returned future holds its result or its HTTPException.
+        """
+        self.start()
+        future = Future()
+        self.queue.put((data, future))
+        return future
+
+    async def purchase(self, data: PurchaseRequest):
+        return await asyncio.wrap_future(self.submit(data))
+
+    def run(self):
+        while True:
+            order = self.queue.get()
+            if order is None:
+                return
+            # Orders whose caller went away (cancelled futures) are dropped; the others can no longer be cancelled
+            if not order[1].set_running_or_notify_cancel():
+                continue
+            batch = [order]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    order = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if order is None:
+                    self.apply_batch(batch)
+                    return
+                if order[1].set_running_or_notify_cancel():
+                    batch.append(order)
+            self.apply_batch(batch)
+
+    def apply_batch(self, batch: list):
+        """
+        Stage every purchase of a batch in one transaction and commit once.
+        """
+        with self.session_factory() as db:
+            try:
+                outcomes = []
+                for data, future in batch:
+                    try:
+                        outcomes.append((future, stage_purchase(db, data), None))
+                    except HTTPException as e:
+                        outcomes.append((future, None, e))
+                changed = any(error is None and data.items for (data, _), (_, _, error) in zip(batch, outcomes))
+                if changed:
+                    bump_versions(db, BALANCES, SALES)
+                db.commit()
+            except SQLAlchemyError:
+                db.rollback()
+                self.apply_each(db, batch)
+                return
+            except Exception as e:
+                db.rollback()
+                for _, future in batch:
+                    settle(future, error=e)
+                return
+
+        if changed:
+            data_versions.invalidate()
+        with self.lock:
+            self.batches += 1
+            self.orders += len(batch)
+        for future, result, error in outcomes:
+            if error is None:
+                purchase_stats.record(0)
+            settle(future, result, error)
+
+    def apply_each(self, db: Session, batch: list):
+        """
+        Apply the purchases of a failed batch one transaction each, so one bad purchase cannot fail the others.
+        """
+        for data, future in batch:
+            try:
+                result = process_purchase(db, data)
+            except Exception as e:
+                settle(future, error=e)
+            else:
+                settle(future, result)
+        with self.lock:
+            self.batches += len(batch)
+            self.orders += len(batch)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "batch_size": self.batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "orders": self.orders,
+                "orders_per_batch": self.orders / self.batches if self.batches else 0.0,
+            }
+
+
+def settle(future: Future, result=None, error: Exception = None):
+    """
+    Set the result or error of a writer future, unless it is already done, so a caller that went away
+    cannot make the writer thread fail with InvalidStateError.
+    """
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+# Writer used by POST /purchase when PURCHASE_WRITER is enabled
+purchase_writer = PurchaseWriter() if PURCHASE_WRITER else None
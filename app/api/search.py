@@ -1,22 +1,33 @@
-from fastapi import APIRouter, Query, Depends
-from sqlalchemy.orm import Session
+import heapq
+import threading
+from typing import Optional
+
+from fastapi import APIRouter, Query, Depends, Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, joinedload, selectinload
 from difflib import SequenceMatcher
 
-from app.db import SessionLocal
+from app.config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from app.db import get_read_db
+from app.cache import versioned_response, CATALOG, BALANCES
 from app.models import Pharmacy, Mask, PharmacyMask
+from app.utils.money import from_cents
+from app.utils.pagination import Page, decode_cursor, split_page
+from app.utils.trigram import TrigramIndex
 
 router = APIRouter()
 
+# Fuzzy matches need a SequenceMatcher ratio above this
+FUZZY_CUTOFF = 0.3
+
 
-def get_db():
+def relevance_key(pair: tuple) -> tuple:
     """
-    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
+    Sort key of an (id, relevance) pair in result order: most relevant first, ties by id.
     """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    item_id, score = pair
+    return -score, item_id
+
 
 def calculate_relevance_score(search_term: str, target_text: str) -> float:
     """
@@ -43,98 +54,182 @@ def calculate_relevance_score(search_term: str, target_text: str) -> float:
     # Use sequence matcher for fuzzy matching
     similarity = SequenceMatcher(None, search_lower, target_lower).ratio()
 
-    return max(0.0, similarity) if similarity > 0.3 else 0.0
+    return max(0.0, similarity) if similarity > FUZZY_CUTOFF else 0.0
+
+
+class CatalogSearchIndex:
+    """
+    Trigram indexes over pharmacy and mask names, built on first use (or at startup) and
+    rebuilt whenever the catalog changes. Names are never renamed or deleted by the API,
+    so the highest pharmacy and mask ids are enough to detect catalog changes.
+    """
+    def __init__(self):
+        self.pharmacies = TrigramIndex()
+        self.masks = TrigramIndex()
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        """
+        Rebuild both indexes if pharmacies or masks were added since the last build.
+        """
+        signature = tuple(db.execute(select(
+            select(func.max(Pharmacy.id)).scalar_subquery(),
+            select(func.max(Mask.id)).scalar_subquery()
+        )).one())
+        if signature == self.signature:
+            return
+
+        with self.lock:
+            if signature != self.signature:
+                self.pharmacies = TrigramIndex(db.execute(select(Pharmacy.id, Pharmacy.name)).all())
+                self.masks = TrigramIndex(db.execute(select(Mask.id, Mask.name)).all())
+                self.signature = signature
+
+
+search_index = CatalogSearchIndex()
 
 # ============================================================================================
 # GET /search?query_name=...&search_type=pharmacy|mask
 # Purpose: Search for pharmacies or masks by name and rank the results by relevance to the search term
 # ============================================================================================
 @router.get("")
-def search_items(
+async def search_items(
+    request: Request,
+    response: Response,
     query_name: str = Query(..., min_length=1),
     search_type: str = Query(..., enum=["pharmacy", "mask"]),
-    db: Session = Depends(get_db)
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX, description="Page size (top-k by relevance)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of matching results as X-Total-Count"),
+    db: Session = Depends(get_read_db)
 ):
     """
     Search for pharmacies or masks by name and rank by relevance.
+    Candidates are narrowed with the trigram index before scoring, keeping every possible fuzzy match.
     - query_name: Search keyword
     - search_type: 'pharmacy' or 'mask'
-    Returns: List of relevant results
+    - limit, cursor, include_total: Page size, X-Next-Cursor of the previous page, send X-Total-Count
+    Returns: One page of relevant results
+    """
+    after = decode_cursor(cursor, (int, float))
+    return await versioned_response(
+        request, response, db, "search", (CATALOG, BALANCES),
+        search_catalog, query_name, search_type, limit, after, include_total
+    )
+
+
+def search_catalog(db: Session, query_name: str, search_type: str, limit: int, after, include_total: bool):
+    """
+    Search pharmacies or masks by name and rank one page by relevance (sync part of search_items).
+    Results are ordered by relevance descending, then pharmacy id (or pharmacy mask id for masks).
+    - after: (id, relevance) of the last result of the previous page, or None
     """
     keyword = query_name.lower()
     results = []
+    next_cursor, total = None, None
+    search_index.refresh(db)
 
     if search_type == "pharmacy":
-        pharmacies = db.query(Pharmacy).all()
-
-        for pharmacy in pharmacies:
-            pharmacy_name = pharmacy.name.lower()
-            pharmacy_name_score = calculate_relevance_score(keyword, pharmacy_name)
-
-            if pharmacy_name_score > 0:
-                # Opening hours
-                opening_hours = [
-                    f"{hour.day_of_week} {hour.start_time.strftime('%H:%M')} - {hour.end_time.strftime('%H:%M')}"
-                    for hour in pharmacy.opening_hours
-                ]
-
-                # Masks
-                masks = [
-                    {
-                        "mask_id": pharmacy_mask.mask.id,
-                        "mask_name": pharmacy_mask.mask.name,
-                        "price": pharmacy_mask.price
-                    }
-                    for pharmacy_mask in pharmacy.masks
-                ]
-
-                results.append({
-                    "pharmacy_id": pharmacy.id,
-                    "pharmacy_name": pharmacy.name,
-                    "cashBalance": pharmacy.cash_balance,
-                    "openingHours": opening_hours,
-                    "masks": masks,
-                    "relevanceScore": pharmacy_name_score
-                })
+        ranked, next_cursor = split_page(
+            search_index.pharmacies.search(keyword, calculate_relevance_score, limit + 1, after, FUZZY_CUTOFF),
+            limit, list
+        )
+        total = len(
+            search_index.pharmacies.search(keyword, calculate_relevance_score, min_similarity=FUZZY_CUTOFF)
+        ) if include_total else None
+        pharmacies_by_id = {
+            pharmacy.id: pharmacy
+            for pharmacy in db.query(Pharmacy)
+            .options(
+                selectinload(Pharmacy.opening_hours),
+                selectinload(Pharmacy.masks).joinedload(PharmacyMask.mask)
+            )
+            .filter(Pharmacy.id.in_([pharmacy_id for pharmacy_id, _ in ranked]))
+        }
 
-    elif search_type == "mask":
-        pharmacy_masks = db.query(PharmacyMask).join(Mask).join(Pharmacy).all()
+        for pharmacy_id, pharmacy_name_score in ranked:
+            pharmacy = pharmacies_by_id[pharmacy_id]
 
-        for pharmacy_mask in pharmacy_masks:
-            mask_name = pharmacy_mask.mask.name.lower()
-            mask_name_score = calculate_relevance_score(keyword, mask_name)
-
-            if mask_name_score > 0:
-                # Pharmacy info
-                pharmacy = pharmacy_mask.pharmacy
-                opening_hours = [
-                    f"{hour.day_of_week} {hour.start_time.strftime('%H:%M')} - {hour.end_time.strftime('%H:%M')}"
-                    for hour in pharmacy.opening_hours
-                ]
-
-                results.append({
+            # Opening hours
+            opening_hours = [
+                f"{hour.day_of_week} {hour.start_time.strftime('%H:%M')} - {hour.end_time.strftime('%H:%M')}"
+                for hour in pharmacy.opening_hours
+            ]
+
+            # Masks
+            masks = [
+                {
                     "mask_id": pharmacy_mask.mask.id,
                     "mask_name": pharmacy_mask.mask.name,
-                    "mask_price": pharmacy_mask.price,
-                    "pharmacy": {
-                        "pharmacy_id": pharmacy.id,
-                        "pharmacy_name": pharmacy.name,
-                        "cashBalance": pharmacy.cash_balance,
-                        "openingHours": opening_hours
-                    },
-                    "relevanceScore": mask_name_score
-                })
-        
-    # Sort by relevance descending
-    results.sort(key=lambda result: result["relevanceScore"], reverse=True)
+                    "price": from_cents(pharmacy_mask.price_cents)
+                }
+                for pharmacy_mask in pharmacy.masks
+            ]
+
+            results.append({
+                "pharmacy_id": pharmacy.id,
+                "pharmacy_name": pharmacy.name,
+                "cashBalance": from_cents(pharmacy.cash_balance_cents),
+                "openingHours": opening_hours,
+                "masks": masks,
+                "relevanceScore": pharmacy_name_score
+            })
+
+    elif search_type == "mask":
+        # Rank pharmacy mask ids by the relevance of their mask, then load only the page
+        mask_scores = dict(search_index.masks.search(keyword, calculate_relevance_score, min_similarity=FUZZY_CUTOFF))
+        scored = [
+            (pharmacy_mask_id, mask_scores[mask_id])
+            for pharmacy_mask_id, mask_id in db.execute(
+                select(PharmacyMask.id, PharmacyMask.mask_id).where(PharmacyMask.mask_id.in_(list(mask_scores)))
+            )
+        ]
+        total = len(scored) if include_total else None
+        if after is not None:
+            scored = [pair for pair in scored if relevance_key(pair) > relevance_key(after)]
+        ranked, next_cursor = split_page(heapq.nsmallest(limit + 1, scored, key=relevance_key), limit, list)
+
+        pharmacy_masks_by_id = {
+            pharmacy_mask.id: pharmacy_mask
+            for pharmacy_mask in db.query(PharmacyMask)
+            .options(
+                joinedload(PharmacyMask.mask),
+                joinedload(PharmacyMask.pharmacy).joinedload(Pharmacy.opening_hours)
+            )
+            .filter(PharmacyMask.id.in_([pharmacy_mask_id for pharmacy_mask_id, _ in ranked]))
+        }
+        pharmacy_masks = [pharmacy_masks_by_id[pharmacy_mask_id] for pharmacy_mask_id, _ in ranked]
+        relevance = dict(ranked)
+
+        for pharmacy_mask in pharmacy_masks:
+            # Pharmacy info
+            pharmacy = pharmacy_mask.pharmacy
+            opening_hours = [
+                f"{hour.day_of_week} {hour.start_time.strftime('%H:%M')} - {hour.end_time.strftime('%H:%M')}"
+                for hour in pharmacy.opening_hours
+            ]
+
+            results.append({
+                "mask_id": pharmacy_mask.mask.id,
+                "mask_name": pharmacy_mask.mask.name,
+                "mask_price": from_cents(pharmacy_mask.price_cents),
+                "pharmacy": {
+                    "pharmacy_id": pharmacy.id,
+                    "pharmacy_name": pharmacy.name,
+                    "cashBalance": from_cents(pharmacy.cash_balance_cents),
+                    "openingHours": opening_hours
+                },
+                "relevanceScore": relevance[pharmacy_mask.id]
+            })
 
     if not results:
-        return {
+        return Page({
             "message": "No results found.",
             "data": []
-        }
+        }, next_cursor, total)
     else:
-        return {
+        return Page({
             "message": "Search successfully.",
             "data": results
-        }
+        }, next_cursor, total)
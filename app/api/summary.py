@@ -1,69 +1,141 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
+from fastapi import APIRouter, Query, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from datetime import datetime
+from sqlalchemy import func
+from datetime import date, datetime
 
-from app.db import SessionLocal
-from app.models import Transaction, PharmacyMask
+from app.db import get_read_db
+from app.cache import versioned_response, SALES, CATALOG
+from app.models import DailySales, Pharmacy, Mask
+from app.utils.money import from_cents
 
 router = APIRouter()
 
-def get_db():
+
+def parse_date_range(start_date: str, end_date: str):
     """
-    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
+    Parse a YYYY-MM-DD date range (both days inclusive), or raise a 400 error.
+    Returns: (start_day, end_day)
     """
-    db = SessionLocal()
     try:
-        yield db
-    finally:
-        db.close()
+        return datetime.strptime(start_date, "%Y-%m-%d").date(), datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+
+def sales_totals():
+    """
+    Aggregate columns over daily_sales rows, labelled as in the summary responses.
+    """
+    return (
+        func.coalesce(func.sum(DailySales.transaction_count), 0).label("total_transactions"),
+        func.coalesce(func.sum(DailySales.quantity), 0).label("total_masks_sold"),
+        func.coalesce(func.sum(DailySales.total_value_cents), 0).label("total_value_cents")
+    )
 
 # =========================================
 # GET /summary
 # Purpose: Calculate the total number of masks and the total transaction value within a date range.
 # =========================================
 @router.get("")
-def get_mask_summary(
+async def get_mask_summary(
+    request: Request,
+    response: Response,
     start_date: str = Query(..., description="Format: YYYY-MM-DD"),
     end_date: str = Query(..., description="Format: YYYY-MM-DD"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Calculate total transactions, total masks sold, and total value within a date range.
     - start_date, end_date: Date range (YYYY-MM-DD)
     Returns: Summary result dict
     """
-    # Parse date range
-    try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        end_date = datetime.strptime(end_date + " 23:59:59", "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    
-    # Count transactions
-    total_transactions = db.query(func.count(Transaction.id)).filter(
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date <= end_date
-    ).scalar()
+    start_day, end_day = parse_date_range(start_date, end_date)
+    return await versioned_response(request, response, db, "summary", (SALES,), summarize_sales, start_day, end_day)
 
-    # Calculate total revenue and total masks sold
-    total_result =(
-        db.query(
-            func.sum(Transaction.transaction_amount).label("total_value"),
-            func.sum(Transaction.transaction_amount / PharmacyMask.price).label("total_quantity")
-        )
-        .join(PharmacyMask,
-              (Transaction.pharmacy_id == PharmacyMask.pharmacy_id) &
-              (Transaction.mask_id == PharmacyMask.mask_id))
-        .filter(and_(
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date
-        ))
-        .first()
-    )
+
+def summarize_sales(db: Session, start_day: date, end_day: date):
+    """
+    Calculate the sales summary within a day range from the daily_sales rollup (sync part of get_mask_summary).
+    """
+    total_result = db.query(*sales_totals()).filter(DailySales.day.between(start_day, end_day)).one()
 
     return {
-        "total_transactions": total_transactions,
-        "total_masks_sold": int(total_result.total_quantity or 0),
-        "total_value": round(total_result.total_value or 0.0, 2)
-    }
\ No newline at end of file
+        "total_transactions": total_result.total_transactions,
+        "total_masks_sold": total_result.total_masks_sold,
+        "total_value": from_cents(total_result.total_value_cents)
+    }
+
+# =========================================
+# GET /summary/pharmacies
+# Purpose: Break the sales summary down by pharmacy within a date range.
+# =========================================
+@router.get("/pharmacies")
+async def get_summary_by_pharmacy(
+    request: Request,
+    response: Response,
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Calculate transactions, masks sold and value per pharmacy within a date range.
+    - start_date, end_date: Date range (YYYY-MM-DD)
+    Returns: Pharmacies with sales, highest total value first
+    """
+    start_day, end_day = parse_date_range(start_date, end_date)
+    return await versioned_response(
+        request, response, db, "summary_pharmacies", (SALES, CATALOG),
+        summarize_sales_by, Pharmacy, DailySales.pharmacy_id, "pharmacy", start_day, end_day
+    )
+
+# =========================================
+# GET /summary/masks
+# Purpose: Break the sales summary down by mask within a date range.
+# =========================================
+@router.get("/masks")
+async def get_summary_by_mask(
+    request: Request,
+    response: Response,
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Calculate transactions, masks sold and value per mask within a date range.
+    - start_date, end_date: Date range (YYYY-MM-DD)
+    Returns: Masks with sales, highest total value first
+    """
+    start_day, end_day = parse_date_range(start_date, end_date)
+    return await versioned_response(
+        request, response, db, "summary_masks", (SALES, CATALOG),
+        summarize_sales_by, Mask, DailySales.mask_id, "mask", start_day, end_day
+    )
+
+
+def summarize_sales_by(db: Session, model, key, label: str, start_day: date, end_day: date):
+    """
+    Group the daily_sales rollup by pharmacy or mask within a day range (sync part of the breakdown routes).
+    - model: Pharmacy or Mask, providing the name
+    - key: The matching DailySales foreign key column
+    - label: Prefix of the id and name fields ('pharmacy' or 'mask')
+    """
+    totals = sales_totals()
+    result = (
+        db.query(model.id, model.name, *totals)
+        .join(DailySales, key == model.id)
+        .filter(DailySales.day.between(start_day, end_day))
+        .group_by(model.id)
+        .order_by(totals[2].desc(), model.id)
+        .all()
+    )
+
+    return [
+        {
+            f"{label}_id": row.id,
+            f"{label}_name": row.name,
+            "total_transactions": row.total_transactions,
+            "total_masks_sold": row.total_masks_sold,
+            "total_value": from_cents(row.total_value_cents)
+        }
+        for row in result
+    ]
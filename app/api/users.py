@@ -1,53 +1,190 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
+import heapq
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import APIRouter, Query, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from datetime import datetime
+from sqlalchemy import func, and_, select
+from datetime import date, datetime
 
-from app.db import SessionLocal
-from app.models import User, Transaction
+from app.db import get_read_db
+from app.cache import versioned_response, SALES
+from app.models import User, Transaction, UserDailySpend
+from app.utils.money import from_cents
+from app.utils.pagination import Page, decode_cursor, split_page
 
 router = APIRouter()
 
-def get_db():
+
+def ranking_key(pair: tuple) -> tuple:
     """
-    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
+    Sort key of a (user_id, total amount in cents) pair in ranking order: highest amount first, ties by user id.
     """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    user_id, amount = pair
+    return -amount, user_id
+
+
+class UserSpendIndex:
+    """
+    Per-user daily spend held in memory (day -> {user_id: amount in cents}), loaded from user_daily_spend.
+    Transactions are only ever appended, so the highest transaction id detects new spend,
+    and only the days touched by the new transactions are reloaded.
+    Rankings of recent windows (e.g. the last 7 or 30 days) are kept in a small LRU cache.
+    """
+    def __init__(self, window_cache_size: int = 32, max_limit: int = 100):
+        self.days = {}
+        self.last_transaction_id = None
+        self.windows = OrderedDict()
+        self.window_cache_size = window_cache_size
+        self.max_limit = max_limit
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        """
+        Reload the days with transactions added since the last refresh (everything on first use).
+        """
+        last_transaction_id = db.execute(select(func.max(Transaction.id))).scalar() or 0
+        if last_transaction_id == self.last_transaction_id:
+            return
+
+        with self.lock:
+            if last_transaction_id == self.last_transaction_id:
+                return
+
+            spend = select(UserDailySpend.day, UserDailySpend.user_id, UserDailySpend.total_amount_cents)
+            if self.last_transaction_id is None or last_transaction_id < self.last_transaction_id:
+                # First load, or the database was replaced
+                self.days = {}
+            else:
+                touched_days = select(func.date(Transaction.transaction_date)).where(
+                    Transaction.id > self.last_transaction_id
+                ).distinct()
+                spend = spend.where(UserDailySpend.day.in_(touched_days))
+
+            days = {}
+            for day, user_id, amount in db.execute(spend):
+                days.setdefault(day, {})[user_id] = amount
+            self.days = {**self.days, **days}
+            self.windows.clear()
+            self.last_transaction_id = last_transaction_id
+
+    def totals(self, start_day: date, end_day: date) -> dict:
+        """
+        Return {user_id: total amount in cents} over a day range (both days inclusive).
+        """
+        days = self.days
+        totals = {}
+        for day in sorted(day for day in days if start_day <= day <= end_day):
+            for user_id, amount in days[day].items():
+                totals[user_id] = totals.get(user_id, 0) + amount
+        return totals
+
+    def top(self, start_day: date, end_day: date, limit: int, after: Optional[tuple] = None) -> list:
+        """
+        Return the top (user_id, total amount in cents) pairs over a day range, highest first, ties by user id.
+        - after: (user_id, total amount in cents) of the last pair of the previous page; only later pairs are returned
+        The top max_limit users of each window are cached, so repeated windows and their first pages are
+        answered by a slice.
+        """
+        key = (start_day, end_day)
+        with self.lock:
+            cached = self.windows.get(key)
+            if cached is not None:
+                self.windows.move_to_end(key)
+            days = self.days
+
+        if cached is not None:
+            ranking, complete = cached
+            start = 0 if after is None else bisect_right(ranking, ranking_key(after), key=ranking_key)
+            if complete or start + limit <= len(ranking):
+                return ranking[start:start + limit]
+
+        totals = self.totals(start_day, end_day)
+        if after is not None:
+            later = [pair for pair in totals.items() if ranking_key(pair) > ranking_key(after)]
+            return heapq.nsmallest(limit, later, key=ranking_key)
+
+        ranking = heapq.nsmallest(max(limit, self.max_limit), totals.items(), key=ranking_key)
+        with self.lock:
+            if days is self.days:
+                self.windows[key] = (ranking, len(ranking) == len(totals))
+                if len(self.windows) > self.window_cache_size:
+                    self.windows.popitem(last=False)
+        return ranking[:limit]
+
+
+spend_index = UserSpendIndex()
 
 # ============================================================================================
 # GET /users/top
 # Purpose: Retrieve the top X users by total transaction amount of masks within a date range.
 # ============================================================================================
 @router.get("/top")
-def get_top_users(
+async def get_top_users(
+    request: Request,
+    response: Response,
     limit: int = Query(5, ge=1, le=100),
     start_date: str = Query(..., description="Format: YYYY-MM-DD"),
     end_date: str = Query(..., description="Format: YYYY-MM-DD"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    include_total: bool = Query(False, description="Send the number of users with spend as X-Total-Count"),
+    db: Session = Depends(get_read_db)
 ):
     """
     Query the top N users by transaction amount within a date range.
-    - limit: Number of users to return
+    Served from the in-memory per-user daily spend index.
+    - limit: Number of users to return (page size)
     - start_date, end_date: Date range
+    - cursor, include_total: X-Next-Cursor of the previous page, send X-Total-Count
     Returns: Users and their total transaction amount
     """
     # Parse date range
     try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        end_date = datetime.strptime(end_date + " 23:59:59", "%Y-%m-%d %H:%M:%S")
+        start_day = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_day = datetime.strptime(end_date, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    
+    after = decode_cursor(cursor, (int, int))
+
+    return await versioned_response(
+        request, response, db, "users_top", (SALES,),
+        rank_top_users_from_index, limit, start_day, end_day, after, include_total
+    )
+
+
+def rank_top_users_from_index(db: Session, limit: int, start_day: date, end_day: date, after, include_total: bool):
+    """
+    Rank one page of the top users within a day range with the spend index (sync part of get_top_users).
+    - after: (user_id, total amount in cents) of the last user of the previous page, or None
+    """
+    spend_index.refresh(db)
+    top_users, next_cursor = split_page(spend_index.top(start_day, end_day, limit + 1, after), limit, list)
+    total = len(spend_index.totals(start_day, end_day)) if include_total else None
+    names = dict(db.execute(select(User.id, User.name).where(User.id.in_([user_id for user_id, _ in top_users]))).all())
+
+    return Page([
+        {
+            "user_id": user_id,
+            "user_name": names[user_id],
+            "total_amount": from_cents(total_amount_cents)
+        }
+        for user_id, total_amount_cents in top_users
+    ], next_cursor, total)
+
+
+def rank_top_users(db: Session, limit: int, start_date: datetime, end_date: datetime):
+    """
+    Query the top N users by transaction amount within a datetime range straight from the transactions.
+    Reference for the spend index, used by the tests and benchmarks/top_users.py.
+    """
     # Get top users by total mask transaction amounts within date range
     result = (
         db.query(
             User.id,
             User.name,
-            func.sum(Transaction.transaction_amount).label("total_amount")
+            func.sum(Transaction.transaction_amount_cents).label("total_amount_cents")
         )
         .join(Transaction)
         .filter(and_(
@@ -55,7 +192,7 @@ def get_top_users(
             Transaction.transaction_date <= end_date
         ))
         .group_by(User.id)
-        .order_by(func.sum(Transaction.transaction_amount).desc())
+        .order_by(func.sum(Transaction.transaction_amount_cents).desc(), User.id)
         .limit(limit)
         .all()
     )
@@ -64,7 +201,7 @@ def get_top_users(
         {
             "user_id": top_user.id,
             "user_name": top_user.name,
-            "total_amount": round(top_user.total_amount, 2)
+            "total_amount": from_cents(top_user.total_amount_cents)
         } 
         for top_user in result
     ]
@@ -0,0 +1,216 @@
+"""
+Response cache
+LRU/TTL cache for the results of read routes, keyed by route, arguments and the versions of the
+data scopes the route reads. Writers bump those versions, so a write makes older entries unreachable.
+The same versions give each response a strong ETag, so unchanged data is answered with 304 Not Modified.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import RESPONSE_CACHE_ROUTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, DATA_VERSION_REFRESH
+from app.db import run_db
+from app.models import DataVersion
+from app.rollups import upsert_increments
+from app.utils.pagination import Page
+
+# Data scopes: the catalog (pharmacies, masks, prices, opening hours), cash balances and sales
+CATALOG = "catalog"
+BALANCES = "balances"
+SALES = "sales"
+SCOPES = (CATALOG, BALANCES, SALES)
+
+
+def bump_versions(session: Session, *scopes):
+    """
+    Increment the versions of the given scopes in the caller's transaction.
+    Call data_versions.invalidate() after the commit so this process sees the new versions at once.
+    """
+    for scope in scopes:
+        upsert_increments(session, DataVersion, {"scope": scope}, {"version": 1})
+
+
+class DataVersions:
+    """
+    Versions of all data scopes, read from data_versions at most every refresh_interval seconds.
+    """
+    def __init__(self, refresh_interval: float = DATA_VERSION_REFRESH):
+        self.refresh_interval = refresh_interval
+        self.versions = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, db: Session) -> dict:
+        """
+        Return {scope: version}, re-reading the table when the loaded versions are too old.
+        """
+        with self.lock:
+            versions, loaded_at = self.versions, self.loaded_at
+        if versions is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return versions
+
+        loaded_at = time.monotonic()
+        versions = dict.fromkeys(SCOPES, 0)
+        versions.update(db.execute(select(DataVersion.scope, DataVersion.version)).all())
+        with self.lock:
+            self.versions, self.loaded_at = versions, loaded_at
+        return versions
+
+    def stamp(self, db: Session, scopes) -> tuple:
+        """
+        Return the versions of the given scopes as a tuple.
+        """
+        versions = self.get(db)
+        return tuple(versions[scope] for scope in scopes)
+
+    def cached_stamp(self, scopes):
+        """
+        Return the versions of the given scopes without touching the database, or None if they must be re-read.
+        """
+        with self.lock:
+            versions, loaded_at = self.versions, self.loaded_at
+        if versions is None or time.monotonic() - loaded_at >= self.refresh_interval:
+            return None
+        return tuple(versions[scope] for scope in scopes)
+
+    def invalidate(self):
+        """
+        Force the next get() to re-read the versions (after this process committed a bump).
+        """
+        with self.lock:
+            self.versions = None
+
+
+data_versions = DataVersions()
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl seconds, with hit and miss counters per route.
+    - routes: Names of the cached routes, or '*' for all
+    """
+    def __init__(self, routes: str = RESPONSE_CACHE_ROUTES, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_SIZE):
+        self.routes = {route.strip() for route in routes.split(",") if route.strip()}
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def enabled(self, route: str) -> bool:
+        return "*" in self.routes or route in self.routes
+
+    def get(self, route: str, key):
+        """
+        Return (True, value) for a live entry, or (False, None), and count the hit or miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self.entries.move_to_end(key)
+                self.hits[route] = self.hits.get(route, 0) + 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses[route] = self.misses.get(route, 0) + 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> dict:
+        """
+        Return the cache configuration, size and hit/miss counters per route.
+        """
+        with self.lock:
+            routes = sorted(set(self.hits) | set(self.misses))
+            return {
+                "routes_enabled": sorted(self.routes),
+                "ttl_seconds": self.ttl,
+                "max_entries": self.max_entries,
+                "entries": len(self.entries),
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "by_route": {
+                    route: {"hits": self.hits.get(route, 0), "misses": self.misses.get(route, 0)} for route in routes
+                },
+            }
+
+
+response_cache = ResponseCache()
+
+
+def cached_call(db: Session, route: str, stamp: tuple, fn, *args):
+    """
+    Return fn(db, *args) through the response cache when the route is enabled.
+    The key holds the route, the arguments and the stamp (versions of the scopes the route reads).
+    Errors (e.g. HTTPException) are raised as usual and never cached.
+    """
+    if not response_cache.enabled(route):
+        return fn(db, *args)
+
+    key = (route, repr(args), stamp)
+    hit, value = response_cache.get(route, key)
+    if hit:
+        return value
+    value = fn(db, *args)
+    response_cache.set(key, value)
+    return value
+
+
+def make_etag(route: str, stamp: tuple) -> str:
+    """
+    Build the strong ETag of a route's responses at the given data versions (e.g. '"summary-12"').
+    """
+    return '"' + route + "-" + ".".join(str(version) for version in stamp) + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header (a list of entity tags, or '*') against an ETag.
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+async def versioned_response(request: Request, response: Response, db, route: str, scopes: tuple, fn, *args):
+    """
+    Serve a read route with a strong ETag derived from the versions of the scopes it reads.
+    A matching If-None-Match is answered with 304 before the route's own queries run (and without any
+    query while this process's data versions are fresh); otherwise fn(db, *args) runs through the response cache.
+    A Page result is returned as its body, with its cursor and total count as headers.
+    """
+    stamp = data_versions.cached_stamp(scopes)
+    if stamp is None:
+        stamp = await run_db(db, data_versions.stamp, scopes)
+    etag = make_etag(route, stamp)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    result = await run_db(db, cached_call, route, stamp, fn, *args)
+    response.headers["ETag"] = etag
+    if isinstance(result, Page):
+        if result.next_cursor is not None:
+            response.headers["X-Next-Cursor"] = result.next_cursor
+        if result.total is not None:
+            response.headers["X-Total-Count"] = str(result.total)
+        return result.body
+    return result
@@ -0,0 +1,106 @@
+"""
+Application configuration
+Settings are read once from environment variables at import time.
+"""
+import os
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """
+    Read a boolean environment variable ('1', 'true', 'yes' or 'on' are true).
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    """
+    Read an integer environment variable.
+    """
+    value = os.getenv(name)
+    return default if value is None or not value.strip() else int(value)
+
+
+# Serve requests through the async engine (requires aiosqlite) instead of the sync threadpool path
+DB_ASYNC = env_flag("DB_ASYNC")
+
+def async_url(url: str) -> str:
+    """
+    Return the aiosqlite form of a SQLite URL; other URLs are returned unchanged.
+    """
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+# Database connection URLs; the async URL defaults to the aiosqlite form of DATABASE_URL
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///db.sqlite")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", async_url(DATABASE_URL))
+
+# Connection pool sizing (ignored for in-memory SQLite)
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = env_int("DB_POOL_TIMEOUT", 30)
+
+# Separate read-only pool for GET routes, so reads never queue behind purchase writes.
+# DATABASE_READ_URL defaults to a read-only connection to the DATABASE_URL SQLite file; with DB_ASYNC,
+# ASYNC_DATABASE_READ_URL defaults to the aiosqlite form of DATABASE_READ_URL, or to a read-only ASYNC_DATABASE_URL.
+DB_READ_POOL = env_flag("DB_READ_POOL")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+ASYNC_DATABASE_READ_URL = os.getenv("ASYNC_DATABASE_READ_URL", DATABASE_READ_URL and async_url(DATABASE_READ_URL))
+DB_READ_POOL_SIZE = env_int("DB_READ_POOL_SIZE", DB_POOL_SIZE)
+DB_READ_MAX_OVERFLOW = env_int("DB_READ_MAX_OVERFLOW", DB_MAX_OVERFLOW)
+
+# Connect-time SQLite pragmas; an empty value leaves the SQLite default in place
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-64000"),  # Negative values are KiB (64 MB)
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),  # 256 MB
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),  # Milliseconds
+}
+
+# Response cache: routes to cache ('*' for every cacheable route, empty to disable, or comma-separated
+# route names), entry lifetime in seconds and maximum number of entries
+RESPONSE_CACHE_ROUTES = os.getenv("RESPONSE_CACHE_ROUTES", "*")
+RESPONSE_CACHE_TTL = env_int("RESPONSE_CACHE_TTL", 60)
+RESPONSE_CACHE_SIZE = env_int("RESPONSE_CACHE_SIZE", 1024)
+
+# Seconds a process may serve data versions without re-reading them; bumps by other processes
+# (the ETL, other workers) become visible within this interval
+DATA_VERSION_REFRESH = float(os.getenv("DATA_VERSION_REFRESH", "1"))
+
+# Purchases that conflict with a concurrent write (locked database, serialization failure) are retried
+# up to PURCHASE_RETRIES times, sleeping a random share of PURCHASE_RETRY_BACKOFF_MS * 2^attempt in between
+PURCHASE_RETRIES = env_int("PURCHASE_RETRIES", 3)
+PURCHASE_RETRY_BACKOFF_MS = env_int("PURCHASE_RETRY_BACKOFF_MS", 10)
+
+# Single-writer purchase mode: POST /purchase hands orders to one writer thread, which applies up to
+# PURCHASE_BATCH_SIZE orders per transaction (group commit), waiting at most PURCHASE_BATCH_WAIT_MS for a batch to fill
+PURCHASE_WRITER = env_flag("PURCHASE_WRITER")
+PURCHASE_BATCH_SIZE = env_int("PURCHASE_BATCH_SIZE", 64)
+PURCHASE_BATCH_WAIT_MS = env_int("PURCHASE_BATCH_WAIT_MS", 2)
+
+# Keyset pagination of list endpoints: page size when no limit is given, and the largest limit accepted
+PAGE_SIZE_DEFAULT = env_int("PAGE_SIZE_DEFAULT", 100)
+PAGE_SIZE_MAX = env_int("PAGE_SIZE_MAX", 1000)
+
+# Request instrumentation: per-request query counts and DB time (X-DB-Queries / X-DB-Time-ms headers) and
+# per-route latency histograms served at GET /metrics; off by default, when it costs nothing per request
+METRICS = env_flag("METRICS")
+
+# Slow-query log: statements taking at least SLOW_QUERY_MS milliseconds (0 disables) are kept with their
+# parameter types, route and SQLite query plan in a ring buffer of SLOW_QUERY_LOG_SIZE records (GET /admin/slow_queries)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_LOG_SIZE = env_int("SLOW_QUERY_LOG_SIZE", 200)
+
+# Per-request profiling: with PROFILING on, a PROFILE_SAMPLE_RATE share of all requests and those whose PROFILE_HEADER
+# header holds the secret PROFILE_TOKEN (empty, the default, ignores the header) run under cProfile, one at a time.
+# Each writes a .prof file and a collapsed-stack file for flame graphs to PROFILE_DIR, which keeps the newest
+# PROFILE_KEEP profiles
+PROFILING = env_flag("PROFILING")
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = env_int("PROFILE_KEEP", 100)
@@ -0,0 +1,294 @@
+"""
+Synthetic feed generator
+Writes pharmacy and user feeds in the shape of data/pharmacies.json and data/users.json at any scale,
+reproducibly from a seed. Mask popularity, pharmacy popularity and purchases per user are skewed, purchase
+dates follow a weekly cycle with growth over the period, and opening hours mix every format that
+parse_opening_hours() handles (day ranges, day lists, 'Thur', several sections and overnight hours).
+
+Run: PYTHONPATH=. python app/datagen.py --pharmacies 10000 --users 1000000 --purchases 10000000 --out data/synthetic
+"""
+import argparse
+import json
+import os
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+BRANDS = ["True Barrier", "MaskT", "Second Smile", "Masquerade", "Cotton Kiss", "Free to Roam", "AniMask", "Airwave"]
+COLORS = ["black", "blue", "green"]
+PACK_SIZES = [3, 6, 10]
+PHARMACY_PREFIXES = ["DFW", "Keystone", "Carepoint", "Medlife", "RX", "Welltrack", "Cofacare", "Apotheco",
+                     "Longhorn", "Prescription", "Assured", "Heartland", "Summit", "Riverside", "Evergreen"]
+PHARMACY_SUFFIXES = ["Pharmacy", "Wellness", "Drugs", "Health", "Care", "Apothecary", "Rx", "Meds", "Chemists"]
+FIRST_NAMES = ["Yvonne", "Ada", "Wilbert", "Lester", "Viola", "Eric", "Ruby", "Timothy", "Mildred", "Connie",
+               "Bobby", "Tina", "Jo", "Ella", "Marcus", "Priya", "Kenji", "Lucia", "Omar", "Sven"]
+LAST_NAMES = ["Guerrero", "Larson", "Bishop", "Nash", "Gross", "Underwood", "Garner", "Rowe", "Fowler", "Hart",
+              "Ito", "Novak", "Okafor", "Silva", "Moreau", "Kowalski", "Haddad", "Lindqvist", "Reyes", "Chen"]
+
+
+def zipf_weights(count: int, exponent: float) -> list:
+    """
+    Return Zipf weights 1 / rank^exponent for ranks 1..count.
+    """
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def unique_name(parts_a: list, parts_b: list, index: int) -> str:
+    """
+    Return the index-th name of the form 'A B', numbered once every combination is used.
+    """
+    combinations = len(parts_a) * len(parts_b)
+    name = f"{parts_a[index % len(parts_a)]} {parts_b[index // len(parts_a) % len(parts_b)]}"
+    return name if index < combinations else f"{name} {index // combinations + 1}"
+
+
+def day_spec(days: list, rng: random.Random) -> str:
+    """
+    Format a group of weekday indexes as 'Mon - Fri' (three or more consecutive days) or 'Mon, Wed, Fri'.
+    Thursday is usually spelled 'Thur', as in the real feed.
+    """
+    names = [("Thur" if rng.random() < 0.8 else "Thu") if day == 3 else WEEKDAYS[day] for day in days]
+    if len(days) >= 3 and days == list(range(days[0], days[-1] + 1)):
+        return f"{names[0]} - {names[-1]}"
+    return ", ".join(names)
+
+
+def hours_spec(rng: random.Random) -> str:
+    """
+    Return opening hours 'HH:MM - HH:MM': mostly a day shift, sometimes half a day or overnight (e.g. 20:00 - 02:00).
+    """
+    kind = rng.choices(["day", "half", "overnight"], weights=[70, 15, 15])[0]
+    if kind == "day":
+        start, end = rng.choice([7, 8, 8, 9, 10]), rng.choice([17, 18, 20, 21, 22])
+    elif kind == "half":
+        start = rng.choice([8, 9, 13, 14])
+        end = start + 4
+    else:
+        start, end = rng.choice([18, 20, 21, 22]), rng.choice([1, 2, 2, 3, 4])
+    minutes = rng.choice(["00", "00", "00", "30"])
+    return f"{start:02d}:{minutes} - {end:02d}:{minutes}"
+
+
+def opening_hours(rng: random.Random) -> str:
+    """
+    Return an opening hours string with one to three sections over disjoint groups of open days.
+    """
+    open_days = sorted(rng.sample(range(7), rng.choices([7, 6, 5, 4, 3], weights=[25, 30, 30, 10, 5])[0]))
+    section_count = min(rng.choices([1, 2, 3], weights=[55, 35, 10])[0], len(open_days))
+    if rng.random() < 0.5:
+        # Consecutive groups, e.g. 'Mon - Fri 08:00 - 17:00 / Sat, Sun 08:00 - 12:00'
+        cuts = sorted(rng.sample(range(1, len(open_days)), section_count - 1))
+        groups = [open_days[start:end] for start, end in zip([0] + cuts, cuts + [len(open_days)])]
+    else:
+        # Interleaved groups, e.g. 'Mon, Wed, Fri 08:00 - 12:00 / Tue, Thur 14:00 - 18:00'
+        groups = [open_days[offset::section_count] for offset in range(section_count)]
+    return " / ".join(f"{day_spec(group, rng)} {hours_spec(rng)}" for group in groups)
+
+
+class Catalog:
+    """
+    Masks, pharmacies and their price lists, with the weights used to draw purchases.
+    Popular masks are stocked by more pharmacies and bought more often; pharmacy popularity is skewed too.
+    """
+    def __init__(self, pharmacy_count: int, rng: random.Random):
+        masks = [(brand, color, size) for brand in BRANDS for color in COLORS for size in PACK_SIZES]
+        rng.shuffle(masks)
+        self.mask_names = [f"{brand} ({color}) ({size} per pack)" for brand, color, size in masks]
+        base_prices = [rng.uniform(1.2, 4.5) * size for _, _, size in masks]
+        mask_cum_weights = list(accumulate(zipf_weights(len(masks), 1.1)))
+
+        self.pharmacies = []
+        self.sellers = [[] for _ in masks]  # mask index -> [(pharmacy index, price)]
+        pharmacy_weights = []
+        for index in range(pharmacy_count):
+            stock = set()
+            for _ in range(rng.choices(range(1, 11), weights=[10, 12, 14, 14, 12, 10, 9, 8, 6, 5])[0]):
+                stock.add(bisect(mask_cum_weights, rng.random() * mask_cum_weights[-1]))
+            price_list = [(mask, round(base_prices[mask] * rng.uniform(0.85, 1.15), 2)) for mask in sorted(stock)]
+            for mask, price in price_list:
+                self.sellers[mask].append((index, price))
+            self.pharmacies.append({
+                "name": unique_name(PHARMACY_PREFIXES, PHARMACY_SUFFIXES, index),
+                "cashBalance": round(rng.uniform(100, 1000), 2),
+                "openingHours": opening_hours(rng),
+                "masks": [{"name": self.mask_names[mask], "price": price} for mask, price in price_list],
+            })
+            pharmacy_weights.append(rng.lognormvariate(0, 1))
+
+        # Purchases draw a mask by popularity, then one of its sellers by pharmacy popularity
+        self.sold_masks = [mask for mask, sellers in enumerate(self.sellers) if sellers]
+        self.sold_cum_weights = list(accumulate(1 / (mask + 1) ** 1.1 for mask in self.sold_masks))
+        self.seller_cum_weights = [
+            list(accumulate(pharmacy_weights[index] for index, _ in sellers)) for sellers in self.sellers
+        ]
+
+    def draw(self, rng: random.Random):
+        """
+        Draw a (pharmacy index, mask index, unit price) for one purchase.
+        """
+        mask = self.sold_masks[bisect(self.sold_cum_weights, rng.random() * self.sold_cum_weights[-1])]
+        cum_weights = self.seller_cum_weights[mask]
+        pharmacy, price = self.sellers[mask][bisect(cum_weights, rng.random() * cum_weights[-1])]
+        return pharmacy, mask, price
+
+
+def purchase_counts(user_count: int, purchase_count: int, rng: random.Random) -> list:
+    """
+    Split purchase_count purchases over users with Pareto-distributed weights (a few heavy buyers),
+    giving the remainder of the rounding to the largest fractional parts.
+    """
+    weights = [rng.paretovariate(1.3) for _ in range(user_count)]
+    scale = purchase_count / sum(weights)
+    shares = [weight * scale for weight in weights]
+    counts = [int(share) for share in shares]
+    remainder = purchase_count - sum(counts)
+    for index in sorted(range(user_count), key=lambda i: counts[i] - shares[i])[:remainder]:
+        counts[index] += 1
+    return counts
+
+
+class DateSampler:
+    """
+    Draw purchase timestamps over `days` days: sales grow over the period, weekends are busier,
+    and most purchases happen during the day with an evening peak.
+    """
+    def __init__(self, start: datetime, days: int, growth: float = 1.0):
+        self.start = start
+        self.day_cum_weights = list(accumulate(
+            (1 + growth * day / max(days - 1, 1)) * (1.3 if (start + timedelta(days=day)).weekday() >= 5 else 1.0)
+            for day in range(days)
+        ))
+        hour_weights = [1, 0.5, 0.3, 0.2, 0.2, 0.4, 1, 2, 4, 5, 6, 6, 7, 6, 5, 5, 6, 7, 8, 8, 6, 4, 3, 2]
+        self.hour_cum_weights = list(accumulate(hour_weights))
+
+    def draw(self, rng: random.Random) -> datetime:
+        day = bisect(self.day_cum_weights, rng.random() * self.day_cum_weights[-1])
+        hour = bisect(self.hour_cum_weights, rng.random() * self.hour_cum_weights[-1])
+        return self.start + timedelta(days=day, hours=hour, seconds=rng.randrange(3600))
+
+
+def format_pharmacy(pharmacy: dict) -> str:
+    """
+    Format a pharmacy like the entries of data/pharmacies.json (two-space indentation inside the array).
+    """
+    masks = ",\n".join(
+        f'      {{\n        "name": {json.dumps(mask["name"])},\n        "price": {mask["price"]!r}\n      }}'
+        for mask in pharmacy["masks"]
+    )
+    return (
+        f'  {{\n    "name": {json.dumps(pharmacy["name"])},\n    "cashBalance": {pharmacy["cashBalance"]!r},\n'
+        f'    "openingHours": {json.dumps(pharmacy["openingHours"])},\n    "masks": [\n{masks}\n    ]\n  }}'
+    )
+
+
+def format_user(name: str, cash_balance: float, purchases: list) -> str:
+    """
+    Format a user like the entries of data/users.json; purchases are
+    (pharmacy name, mask name, amount, date string) tuples, already JSON-encoded for the names.
+    """
+    if not purchases:
+        histories = "[]"
+    else:
+        histories = "[\n" + ",\n".join(
+            f'      {{\n        "pharmacyName": {pharmacy},\n        "maskName": {mask},\n'
+            f'        "transactionAmount": {amount!r},\n        "transactionDate": "{date}"\n      }}'
+            for pharmacy, mask, amount, date in purchases
+        ) + "\n    ]"
+    return (
+        f'  {{\n    "name": {json.dumps(name)},\n    "cashBalance": {cash_balance!r},\n'
+        f'    "purchaseHistories": {histories}\n  }}'
+    )
+
+
+def write_json_array(path: str, entries):
+    """
+    Write pre-formatted JSON entries as a top-level array, one entry at a time.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for index, entry in enumerate(entries):
+            f.write(",\n" if index else "\n")
+            f.write(entry)
+        f.write("\n]\n")
+
+
+def generate(out_dir: str, pharmacy_count: int, user_count: int, purchase_count: int, seed: int = 0,
+             start_date: str = "2021-01-01", days: int = 365):
+    """
+    Write pharmacies.json and users.json under out_dir. The same arguments always produce the same files.
+    Returns: (pharmacies path, users path)
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    pharmacies_path = os.path.join(out_dir, "pharmacies.json")
+    users_path = os.path.join(out_dir, "users.json")
+
+    catalog = Catalog(pharmacy_count, rng)
+    write_json_array(pharmacies_path, (format_pharmacy(pharmacy) for pharmacy in catalog.pharmacies))
+
+    pharmacy_names = [json.dumps(pharmacy["name"]) for pharmacy in catalog.pharmacies]
+    mask_names = [json.dumps(name) for name in catalog.mask_names]
+    dates = DateSampler(datetime.strptime(start_date, "%Y-%m-%d"), days)
+    counts = purchase_counts(user_count, purchase_count, rng)
+
+    def users():
+        for index, count in enumerate(counts):
+            purchases = []
+            for timestamp in sorted(dates.draw(rng) for _ in range(count)):
+                pharmacy, mask, price = catalog.draw(rng)
+                quantity = rng.choices([1, 2, 3, 4], weights=[70, 20, 7, 3])[0]
+                amount = round(price * quantity * rng.uniform(0.9, 1.1), 2)
+                purchases.append((pharmacy_names[pharmacy], mask_names[mask], amount, timestamp.strftime(DATE_FORMAT)))
+            yield format_user(unique_name(FIRST_NAMES, LAST_NAMES, index), round(rng.uniform(10, 500), 2), purchases)
+
+    write_json_array(users_path, users())
+    return pharmacies_path, users_path
+
+
+def at_least(minimum: int):
+    """
+    Return an argparse type accepting integers of at least `minimum`.
+    """
+    def parse(value: str) -> int:
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}, got {number}")
+        return number
+    parse.__name__ = "integer"
+    return parse
+
+
+def parse_args(argv=None):
+    """
+    Parse generator command line options.
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic pharmacy and user feeds.")
+    parser.add_argument("--pharmacies", type=at_least(1), default=1000, help="Number of pharmacies")
+    parser.add_argument("--users", type=at_least(1), default=10000, help="Number of users")
+    parser.add_argument("--purchases", type=at_least(0), default=100000, help="Total number of purchases over all users")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same files")
+    parser.add_argument("--start-date", default="2021-01-01", help="First purchase day (YYYY-MM-DD)")
+    parser.add_argument("--days", type=at_least(1), default=365, help="Number of days purchases are spread over")
+    parser.add_argument("--out", default="data/synthetic", help="Output directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Generator entry point: write pharmacies.json and users.json to the output directory.
+    """
+    args = parse_args(argv)
+    print(f"🧪 Generating {args.pharmacies} pharmacies, {args.users} users and {args.purchases} purchases "
+          f"(seed {args.seed})...")
+    pharmacies_path, users_path = generate(
+        args.out, args.pharmacies, args.users, args.purchases, args.seed, args.start_date, args.days
+    )
+    print(f"✅ Wrote {pharmacies_path} and {users_path}")
+
+
+if __name__ == "__main__":
+    main()
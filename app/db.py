@@ -1,10 +1,175 @@
-import os
-from sqlalchemy import create_engine
+from functools import partial
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from app.config import (
+    DB_ASYNC, DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_READ_POOL, DATABASE_READ_URL, ASYNC_DATABASE_READ_URL, DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW,
+    SQLITE_PRAGMAS, METRICS, SLOW_QUERY_MS
+)
+from app.metrics import install_query_hooks
+from app.profiling import current_profile
+
+
+def is_sqlite_memory(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def read_only_url(url) -> str:
+    """
+    Derive a read-only URL for a SQLite file database; other URLs are returned unchanged.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or is_sqlite_memory(url) or url.database.startswith("file:"):
+        return url.render_as_string(hide_password=False)
+    query = "&".join(f"{key}={value}" for key, value in {**url.query, "mode": "ro", "uri": "true"}.items())
+    return f"{url.drivername}:///file:{url.database}?{query}"
+
+
+def engine_options(url, pool_size: int, max_overflow: int) -> dict:
+    """
+    Build create_engine keyword arguments for a URL: pool sizing and SQLite thread settings.
+    """
+    options = {}
+    if make_url(url).get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    if not is_sqlite_memory(url):
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+def install_sqlite_pragmas(sync_engine, read_only: bool = False):
+    """
+    Apply the configured SQLITE_PRAGMAS on every new connection of a SQLite engine.
+    journal_mode is persistent in the database file, so read-only connections skip it.
+    """
+    if sync_engine.dialect.name != "sqlite":
+        return
+    pragmas = {name: value for name, value in SQLITE_PRAGMAS.items() if value and not (read_only and name == "journal_mode")}
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_db_engine(url, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, read_only: bool = False):
+    """
+    Create a sync engine with the configured pool and SQLite pragmas.
+    """
+    engine = create_engine(url, **engine_options(url, pool_size, max_overflow))
+    install_sqlite_pragmas(engine, read_only)
+    if METRICS or SLOW_QUERY_MS > 0:
+        install_query_hooks(engine)
+    return engine
+
+
+def create_async_db_engine(url, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, read_only: bool = False):
+    """
+    Create an async engine (requires aiosqlite for SQLite) with the configured pool and SQLite pragmas.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(url, **engine_options(url, pool_size, max_overflow))
+    install_sqlite_pragmas(engine.sync_engine, read_only)
+    if METRICS or SLOW_QUERY_MS > 0:
+        install_query_hooks(engine.sync_engine)
+    return engine
 
-# Database connection URL (default: SQLite file db.sqlite)
-DATABASE_URL = "sqlite:///db.sqlite"
 
 # SQLAlchemy engine and session factory
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
\ No newline at end of file
+engine = create_db_engine(DATABASE_URL)
+SessionLocal = sessionmaker(bind=engine)
+
+# Optional read-only engine for GET routes, only created when DB_READ_POOL is enabled
+read_engine = None
+ReadSessionLocal = SessionLocal
+if DB_READ_POOL:
+    read_engine = create_db_engine(
+        DATABASE_READ_URL or read_only_url(DATABASE_URL), DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW, read_only=True
+    )
+    ReadSessionLocal = sessionmaker(bind=read_engine)
+
+# Optional async engines and session factories, only created when DB_ASYNC is enabled
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+    AsyncReadSessionLocal = AsyncSessionLocal
+    if DB_READ_POOL:
+        async_read_engine = create_async_db_engine(
+            ASYNC_DATABASE_READ_URL or read_only_url(ASYNC_DATABASE_URL), DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW,
+            read_only=True
+        )
+        AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, expire_on_commit=False)
+
+
+def get_sync_db():
+    """
+    Dependency for getting a SQLAlchemy session. Used by FastAPI Depends.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_sync_read_db():
+    """
+    Dependency for getting a SQLAlchemy session on the read-only pool. Used by GET routes.
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Dependency for getting a SQLAlchemy AsyncSession. Used by FastAPI Depends when DB_ASYNC is enabled.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """
+    Dependency for getting a SQLAlchemy AsyncSession on the read-only pool. Used by GET routes.
+    """
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Session dependencies used by the routers; without a read pool, reads share the write dependency
+get_db = get_async_db if DB_ASYNC else get_sync_db
+if DB_READ_POOL:
+    get_read_db = get_async_read_db if DB_ASYNC else get_sync_read_db
+else:
+    get_read_db = get_db
+
+
+async def run_db(db, fn, *args):
+    """
+    Run fn(session, *args) without blocking the event loop.
+    A sync Session runs in the threadpool; an AsyncSession runs fn through run_sync,
+    so its database I/O is awaited on the event loop instead of holding a thread.
+    When the request is being profiled, fn runs under its profile.
+    """
+    profile = current_profile.get()
+    if profile is not None:
+        fn = partial(profile.runcall, fn)
+    if hasattr(db, "run_sync"):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
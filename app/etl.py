@@ -1,10 +1,23 @@
+import argparse
+import hashlib
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
+from typing import NamedTuple
+from sqlalchemy import Float, Integer, bindparam, cast, delete, func, insert, select, update
 from sqlalchemy.orm import Session
 
-from app.models import Base, Pharmacy, OpeningHour, Mask, PharmacyMask, User, Transaction
+from app.models import create_schema, Pharmacy, OpeningHour, OpeningInterval, Mask, PharmacyMask, User, Transaction, EtlState
 from app.db import engine, SessionLocal
-from app.utils.time_parser import parse_opening_hours
+from app.rollups import add_transactions, rebuild_rollups
+from app.cache import bump_versions, SCOPES, CATALOG, BALANCES, SALES
+from app.utils.time_parser import parse_opening_hours, to_week_intervals
+from app.utils.json_stream import iter_json_array
+from app.utils.money import to_cents
 
 
 def load_pharmacies(session: Session, path: str):
@@ -21,13 +34,13 @@ def load_pharmacies(session: Session, path: str):
         if not pharmacy:
             pharmacy = Pharmacy(
                 name=entry["name"],
-                cash_balance=entry["cashBalance"]
+                cash_balance_cents=to_cents(entry["cashBalance"])
             )
             session.add(pharmacy)
             session.flush()
         else:
             # Optionally update cash balance if needed:
-            pharmacy.cash_balance = entry["cashBalance"]
+            pharmacy.cash_balance_cents = to_cents(entry["cashBalance"])
 
         # Load opening hours
         for opening_hours in parse_opening_hours(entry["openingHours"]):
@@ -56,7 +69,7 @@ def load_pharmacies(session: Session, path: str):
                 session.add(PharmacyMask(
                     pharmacy_id=pharmacy.id,
                     mask_id=mask.id,
-                    price=mask_entry["price"]
+                    price_cents=to_cents(mask_entry["price"])
                 ))
 
 
@@ -74,13 +87,13 @@ def load_users(session: Session, path: str):
         if not user:
             user = User(
                 name=entry["name"],
-                cash_balance=entry["cashBalance"]
+                cash_balance_cents=to_cents(entry["cashBalance"])
             )
             session.add(user)
             session.flush()
         else:
             # Optionally update user's cash balance
-            user.cash_balance = entry["cashBalance"]
+            user.cash_balance_cents = to_cents(entry["cashBalance"])
 
         # Load purchase histories
         for purchase in entry.get("purchaseHistories", []):
@@ -93,7 +106,7 @@ def load_users(session: Session, path: str):
                     user_id=user.id,
                     pharmacy_id=pharmacy.id,
                     mask_id=mask.id,
-                    transaction_amount=purchase["transactionAmount"],
+                    transaction_amount_cents=to_cents(purchase["transactionAmount"]),
                     transaction_date=datetime.strptime(purchase["transactionDate"], "%Y-%m-%d %H:%M:%S")
                 ).first()
 
@@ -102,26 +115,764 @@ def load_users(session: Session, path: str):
                         user_id=user.id,
                         pharmacy_id=pharmacy.id,
                         mask_id=mask.id,
-                        transaction_amount=purchase["transactionAmount"],
+                        transaction_amount_cents=to_cents(purchase["transactionAmount"]),
                         transaction_date=datetime.strptime(purchase["transactionDate"], "%Y-%m-%d %H:%M:%S")
                     )
                     session.add(transaction)
 
-def main():
+
+
+# ============================================================================================
+# Bulk ETL mode
+# Purpose: Resolve names through in-memory name -> id maps built once per run and insert rows
+# in executemany batches, instead of one ORM lookup per pharmacy, mask and purchase.
+# ============================================================================================
+BATCH_SIZE = 5000
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class StageStats:
+    """
+    Accumulates row counts and elapsed time per ETL stage and reports rows per second.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.seconds = {}
+        self.invalid = 0
+
+    def add(self, stage: str, rows: int, seconds: float):
+        self.rows[stage] = self.rows.get(stage, 0) + rows
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def report(self):
+        for stage, rows in self.rows.items():
+            seconds = self.seconds[stage]
+            rate = rows / seconds if seconds > 0 else float("inf")
+            print(f"   {stage}: {rows} rows in {seconds:.2f}s ({rate:,.0f} rows/s)")
+        if self.invalid:
+            print(f"   skipped {self.invalid} invalid records")
+
+
+def chunked(items, size: int):
+    """
+    Yield successive lists of at most `size` items from any iterable.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_name_map(session: Session, model, names=None) -> dict:
+    """
+    Return a name -> id map for a model with a unique name column, optionally restricted to `names`.
+    """
+    query = select(model.name, model.id)
+    if names is not None:
+        query = query.where(model.name.in_(names))
+    return dict(session.execute(query).all())
+
+
+def insert_rows(session: Session, model, rows: list, batch_size: int = BATCH_SIZE):
+    """
+    Insert plain row dicts with executemany batches on the model's table.
+    """
+    for batch in chunked(rows, batch_size):
+        session.execute(insert(model.__table__), batch)
+
+
+def upsert_balances(session: Session, model, balances: dict, known_ids: dict):
+    """
+    Insert unseen names with their cash balance (in cents) and update the balance of known ones.
+    `known_ids` (name -> id) is extended in place with the ids of the inserted rows.
+    """
+    new_names = [name for name in balances if name not in known_ids]
+    insert_rows(session, model, [{"name": name, "cash_balance_cents": balances[name]} for name in new_names])
+
+    updates = [
+        {"b_id": known_ids[name], "b_cash_balance": balance}
+        for name, balance in balances.items() if name in known_ids
+    ]
+    if updates:
+        table = model.__table__
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(cash_balance_cents=bindparam("b_cash_balance")),
+            updates
+        )
+
+    if new_names:
+        known_ids.update(load_name_map(session, model, new_names))
+
+
+def existing_transaction_keys(session: Session, user_ids) -> set:
+    """
+    Return the (user, pharmacy, mask, amount, date) tuples already stored for the given users.
+    """
+    return set(session.execute(
+        select(
+            Transaction.user_id,
+            Transaction.pharmacy_id,
+            Transaction.mask_id,
+            Transaction.transaction_amount_cents,
+            Transaction.transaction_date
+        ).where(Transaction.user_id.in_(list(user_ids)))
+    ).all())
+
+
+# ============================================================================================
+# Transform stage
+# Purpose: Validate and normalize raw feed records into plain row tuples (opening hours parsed,
+# dates converted, amounts in cents), optionally sharded across a process pool ahead of the single-writer load stage.
+# ============================================================================================
+class PharmacyRecord(NamedTuple):
+    name: str
+    cash_balance_cents: int
+    opening_hours: list  # (day_of_week, start_time, end_time, is_overnight)
+    masks: list  # (mask_name, price_cents)
+    fingerprint: str
+
+
+class UserRecord(NamedTuple):
+    name: str
+    cash_balance_cents: int
+    purchases: list  # (pharmacy_name, mask_name, transaction_amount_cents, transaction_date)
+    fingerprint: str
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def transform_pharmacy(entry: dict, fingerprints: bool = False):
+    """
+    Validate and normalize a raw pharmacy record.
+    Returns: PharmacyRecord, or None if the record is invalid
+    """
+    try:
+        name, cash_balance = entry["name"], entry["cashBalance"]
+        opening_hours = [
+            (hours["day"], hours["start"], hours["end"], hours["is_overnight"])
+            for hours in parse_opening_hours(entry["openingHours"])
+        ]
+        masks = [(mask_entry["name"], mask_entry["price"]) for mask_entry in entry["masks"]]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+    if not isinstance(name, str) or not name or not is_number(cash_balance):
+        return None
+    if not all(isinstance(mask_name, str) and mask_name and is_number(price) for mask_name, price in masks):
+        return None
+
+    masks = [(mask_name, to_cents(price)) for mask_name, price in masks]
+    return PharmacyRecord(
+        name, to_cents(cash_balance), opening_hours, masks, fingerprint(entry) if fingerprints else None
+    )
+
+
+def transform_user(entry: dict, fingerprints: bool = False):
+    """
+    Validate and normalize a raw user record, parsing every transaction date.
+    Returns: UserRecord, or None if the record is invalid
+    """
+    try:
+        name, cash_balance = entry["name"], entry["cashBalance"]
+        purchases = [
+            (
+                purchase["pharmacyName"],
+                purchase["maskName"],
+                purchase["transactionAmount"],
+                datetime.strptime(purchase["transactionDate"], DATE_FORMAT)
+            )
+            for purchase in entry.get("purchaseHistories", [])
+        ]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+    if not isinstance(name, str) or not name or not is_number(cash_balance):
+        return None
+    if not all(is_number(amount) for _, _, amount, _ in purchases):
+        return None
+
+    purchases = [(pharmacy_name, mask_name, to_cents(amount), date) for pharmacy_name, mask_name, amount, date in purchases]
+    return UserRecord(name, to_cents(cash_balance), purchases, fingerprint(entry) if fingerprints else None)
+
+
+def transform_chunk(transform, entries: list) -> list:
+    """
+    Apply a transform to every entry of a chunk; runs inside worker processes.
+    """
+    return [transform(entry) for entry in entries]
+
+
+def transform_chunks(chunks, transform, stats: StageStats, workers: int = 1):
+    """
+    Transform stage: yield (records, tag) for each (entries, tag) chunk, in input order.
+    Invalid records are dropped and counted in stats.invalid.
+    With workers > 1 the chunks are sharded across a process pool, keeping at most 2 * workers
+    chunks in flight so a streamed feed is never read far ahead of the load stage.
+    """
+    def collect(records, started):
+        valid = [record for record in records if record is not None]
+        stats.invalid += len(records) - len(valid)
+        stats.add("transform", len(records), time.perf_counter() - started)
+        return valid
+
+    if workers <= 1:
+        for entries, tag in chunks:
+            started = time.perf_counter()
+            yield collect(transform_chunk(transform, entries), started), tag
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for entries, tag in chunks:
+            pending.append((executor.submit(transform_chunk, transform, entries), tag))
+            while len(pending) >= 2 * workers or (pending and pending[0][0].done()):
+                future, pending_tag = pending.popleft()
+                started = time.perf_counter()
+                yield collect(future.result(), started), pending_tag
+        while pending:
+            future, pending_tag = pending.popleft()
+            started = time.perf_counter()
+            yield collect(future.result(), started), pending_tag
+
+
+def load_pharmacy_chunk(session: Session, records: list, pharmacy_ids: dict, mask_ids: dict,
+                        pharmacy_mask_pairs: set, stats: StageStats, replace: bool = False):
+    """
+    Load stage: write a chunk of PharmacyRecords with set-based lookups.
+    Same deduplication as load_pharmacies: pharmacies and masks by name (the last cash balance wins),
+    pharmacy-mask pairs by (pharmacy_id, mask_id) (the first price wins).
+    With replace=True the chunk's existing opening hours are replaced and existing pair prices updated.
+    """
+    if not records:
+        return
+
+    started = time.perf_counter()
+    upsert_balances(session, Pharmacy, {record.name: record.cash_balance_cents for record in records}, pharmacy_ids)
+    stats.add("pharmacies", len(records), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    if replace:
+        session.execute(delete(OpeningHour).where(
+            OpeningHour.pharmacy_id.in_([pharmacy_ids[record.name] for record in records])
+        ))
+    opening_hour_rows = [
+        {
+            "pharmacy_id": pharmacy_ids[record.name],
+            "day_of_week": day_of_week,
+            "start_time": start_time,
+            "end_time": end_time,
+            "is_overnight": is_overnight
+        }
+        for record in records
+        for day_of_week, start_time, end_time, is_overnight in record.opening_hours
+    ]
+    insert_rows(session, OpeningHour, opening_hour_rows)
+    stats.add("opening_hours", len(opening_hour_rows), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    new_masks = list(dict.fromkeys(
+        mask_name
+        for record in records
+        for mask_name, _ in record.masks
+        if mask_name not in mask_ids
+    ))
+    insert_rows(session, Mask, [{"name": name} for name in new_masks])
+    if new_masks:
+        mask_ids.update(load_name_map(session, Mask, new_masks))
+    stats.add("masks", len(new_masks), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    pharmacy_mask_rows = []
+    price_updates = []
+    for record in records:
+        pharmacy_id = pharmacy_ids[record.name]
+        for mask_name, price_cents in record.masks:
+            pair = (pharmacy_id, mask_ids[mask_name])
+            if pair not in pharmacy_mask_pairs:
+                pharmacy_mask_pairs.add(pair)
+                pharmacy_mask_rows.append({"pharmacy_id": pair[0], "mask_id": pair[1], "price_cents": price_cents})
+            elif replace:
+                price_updates.append({"b_pharmacy_id": pair[0], "b_mask_id": pair[1], "b_price": price_cents})
+    insert_rows(session, PharmacyMask, pharmacy_mask_rows)
+    if price_updates:
+        table = PharmacyMask.__table__
+        session.execute(
+            update(table)
+            .where(table.c.pharmacy_id == bindparam("b_pharmacy_id"), table.c.mask_id == bindparam("b_mask_id"))
+            .values(price_cents=bindparam("b_price")),
+            price_updates
+        )
+    stats.add("pharmacy_masks", len(pharmacy_mask_rows), time.perf_counter() - started)
+
+
+def load_user_chunk(session: Session, records: list, user_ids: dict, pharmacy_ids: dict, mask_ids: dict,
+                    stats: StageStats, transaction_ids: list = None) -> int:
+    """
+    Load stage: write a chunk of UserRecords with set-based lookups.
+    Same deduplication as load_users: users by name (the last cash balance wins), transactions by
+    the full (user, pharmacy, mask, amount, date) tuple; purchases of unknown pharmacies or masks are skipped.
+    When `transaction_ids` is given, the ids of the inserted transactions are appended to it.
+    Returns: Number of inserted transactions
+    """
+    if not records:
+        return 0
+
+    started = time.perf_counter()
+    upsert_balances(session, User, {record.name: record.cash_balance_cents for record in records}, user_ids)
+    stats.add("users", len(records), time.perf_counter() - started)
+
+    started = time.perf_counter()
+    seen = existing_transaction_keys(session, {user_ids[record.name] for record in records})
+    transaction_rows = []
+    for record in records:
+        user_id = user_ids[record.name]
+        for pharmacy_name, mask_name, transaction_amount_cents, transaction_date in record.purchases:
+            pharmacy_id = pharmacy_ids.get(pharmacy_name)
+            mask_id = mask_ids.get(mask_name)
+            if pharmacy_id is None or mask_id is None:
+                continue
+
+            key = (user_id, pharmacy_id, mask_id, transaction_amount_cents, transaction_date)
+            if key not in seen:
+                seen.add(key)
+                transaction_rows.append(dict(zip(
+                    ("user_id", "pharmacy_id", "mask_id", "transaction_amount_cents", "transaction_date"), key
+                )))
+    if transaction_ids is None:
+        insert_rows(session, Transaction, transaction_rows)
+    else:
+        table = Transaction.__table__
+        for batch in chunked(transaction_rows, BATCH_SIZE):
+            transaction_ids.extend(session.scalars(insert(table).returning(table.c.id), batch))
+    stats.add("transactions", len(transaction_rows), time.perf_counter() - started)
+    return len(transaction_rows)
+
+
+def bulk_load_pharmacies(session: Session, path: str, stats: StageStats, batch_size: int = BATCH_SIZE,
+                         diff: "DiffSummary" = None, workers: int = 1):
+    """
+    Bulk variant of load_pharmacies: name -> id maps are built once and rows inserted in batches.
+    When a DiffSummary is given, only new or changed records are applied (incremental mode).
+    With workers > 1 the transform stage runs in a process pool.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    pharmacy_ids = load_name_map(session, Pharmacy)
+    mask_ids = load_name_map(session, Mask)
+    pharmacy_mask_pairs = set(session.execute(select(PharmacyMask.pharmacy_id, PharmacyMask.mask_id)).all())
+
+    transform = partial(transform_pharmacy, fingerprints=diff is not None)
+    chunks = ((chunk, None) for chunk in chunked(data, batch_size))
+    for records, _ in transform_chunks(chunks, transform, stats, workers):
+        if diff is not None:
+            records = select_changed(session, "pharmacies", records, diff)
+        load_pharmacy_chunk(session, records, pharmacy_ids, mask_ids, pharmacy_mask_pairs, stats, replace=diff is not None)
+        if diff is not None:
+            diff.pharmacy_ids.update(pharmacy_ids[record.name] for record in records)
+
+
+def bulk_load_users(session: Session, path: str, stats: StageStats, batch_size: int = BATCH_SIZE,
+                    diff: "DiffSummary" = None, workers: int = 1):
+    """
+    Bulk variant of load_users: name -> id maps are built once and rows inserted in batches.
+    When a DiffSummary is given, only new or changed records are applied (incremental mode).
+    With workers > 1 the transform stage runs in a process pool.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    user_ids = load_name_map(session, User)
+    pharmacy_ids = load_name_map(session, Pharmacy)
+    mask_ids = load_name_map(session, Mask)
+
+    transform = partial(transform_user, fingerprints=diff is not None)
+    chunks = ((chunk, None) for chunk in chunked(data, batch_size))
+    for records, _ in transform_chunks(chunks, transform, stats, workers):
+        if diff is not None:
+            records = select_changed(session, "users", records, diff)
+        inserted = load_user_chunk(session, records, user_ids, pharmacy_ids, mask_ids, stats,
+                                   None if diff is None else diff.transaction_ids)
+        if diff is not None:
+            diff.add("purchases", "added", inserted)
+
+
+# ============================================================================================
+# Streaming ETL mode
+# Purpose: Parse the top-level feed arrays incrementally and commit in chunks, so peak memory
+# stays flat however large the feeds get, and resume from a checkpoint after a crash.
+# ============================================================================================
+CHUNK_SIZE = 10000
+CHECKPOINT_PATH = "etl_checkpoint.json"
+
+
+class Checkpoint:
+    """
+    Resumable progress of a streaming load: the byte offset after the last committed record of each feed.
+    A stored offset is only reused when the feed path and size are unchanged.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def offset(self, stage: str, feed_path: str) -> int:
+        entry = self.state.get(stage)
+        if entry and entry["feed"] == feed_path and entry["size"] == os.path.getsize(feed_path):
+            return entry["offset"]
+        return 0
+
+    def save(self, stage: str, feed_path: str, offset: int):
+        self.state[stage] = {"feed": feed_path, "size": os.path.getsize(feed_path), "offset": offset}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.state = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream_chunks(path: str, start_offset: int, chunk_size: int):
+    """
+    Yield (entries, end_offset) chunks of a JSON array feed, starting at a byte offset.
+    """
+    entries = []
+    end_offset = start_offset
+    for entry, end_offset in iter_json_array(path, start_offset):
+        entries.append(entry)
+        if len(entries) >= chunk_size:
+            yield entries, end_offset
+            entries = []
+    if entries:
+        yield entries, end_offset
+
+
+def stream_load_pharmacies(session: Session, path: str, stats: StageStats, checkpoint: Checkpoint,
+                           chunk_size: int = CHUNK_SIZE, diff: "DiffSummary" = None, workers: int = 1):
+    """
+    Streaming variant of bulk_load_pharmacies: commits and checkpoints after every chunk.
+    Only the catalog-sized pharmacy and mask maps are kept across chunks.
+    """
+    start_offset = checkpoint.offset("pharmacies", path)
+    if start_offset:
+        print(f"   resuming pharmacies at byte {start_offset}")
+
+    pharmacy_ids = load_name_map(session, Pharmacy)
+    mask_ids = load_name_map(session, Mask)
+    pharmacy_mask_pairs = set(session.execute(select(PharmacyMask.pharmacy_id, PharmacyMask.mask_id)).all())
+
+    transform = partial(transform_pharmacy, fingerprints=diff is not None)
+    chunks = stream_chunks(path, start_offset, chunk_size)
+    for records, end_offset in transform_chunks(chunks, transform, stats, workers):
+        if diff is not None:
+            records = select_changed(session, "pharmacies", records, diff)
+        load_pharmacy_chunk(session, records, pharmacy_ids, mask_ids, pharmacy_mask_pairs, stats, replace=diff is not None)
+        if diff is not None:
+            diff.pharmacy_ids.update(pharmacy_ids[record.name] for record in records)
+        session.commit()
+        checkpoint.save("pharmacies", path, end_offset)
+
+
+def stream_load_users(session: Session, path: str, stats: StageStats, checkpoint: Checkpoint,
+                      chunk_size: int = CHUNK_SIZE, diff: "DiffSummary" = None, workers: int = 1):
+    """
+    Streaming variant of bulk_load_users: commits and checkpoints after every chunk.
+    User ids are resolved per chunk, so memory does not grow with the number of users.
+    """
+    start_offset = checkpoint.offset("users", path)
+    if start_offset:
+        print(f"   resuming users at byte {start_offset}")
+
+    pharmacy_ids = load_name_map(session, Pharmacy)
+    mask_ids = load_name_map(session, Mask)
+
+    transform = partial(transform_user, fingerprints=diff is not None)
+    chunks = stream_chunks(path, start_offset, chunk_size)
+    for records, end_offset in transform_chunks(chunks, transform, stats, workers):
+        if diff is not None:
+            records = select_changed(session, "users", records, diff)
+        user_ids = load_name_map(session, User, list({record.name for record in records}))
+        inserted = load_user_chunk(session, records, user_ids, pharmacy_ids, mask_ids, stats,
+                                   None if diff is None else diff.transaction_ids)
+        if diff is not None:
+            diff.add("purchases", "added", inserted)
+        session.commit()
+        checkpoint.save("users", path, end_offset)
+
+
+# ============================================================================================
+# Incremental ETL mode
+# Purpose: Fingerprint each source record in the etl_state table and only apply new or changed
+# records, replacing (not appending) the opening hours of changed pharmacies.
+# ============================================================================================
+class DiffSummary:
+    """
+    Counts records per source and status (added, changed, unchanged) during an incremental run, and keeps the
+    ids of the pharmacies it applied and the transactions it inserted, so derived tables are only updated for those.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.pharmacy_ids = set()
+        self.transaction_ids = []
+
+    def applied(self, source: str) -> int:
+        """
+        Return the number of added or changed records of a source.
+        """
+        statuses = self.counts.get(source, {})
+        return statuses.get("added", 0) + statuses.get("changed", 0)
+
+    def add(self, source: str, status: str, count: int = 1):
+        statuses = self.counts.setdefault(source, {})
+        statuses[status] = statuses.get(status, 0) + count
+
+    def report(self):
+        for source, statuses in self.counts.items():
+            print(f"   {source}: " + ", ".join(f"{count} {status}" for status, count in statuses.items()))
+
+
+def fingerprint(entry: dict) -> str:
+    """
+    Stable hash of a source record, independent of key order.
+    """
+    canonical = json.dumps(entry, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def select_changed(session: Session, source: str, records: list, diff: DiffSummary) -> list:
+    """
+    Compare a chunk of records with their stored fingerprints and record the new fingerprints.
+    Returns: New or changed records; unchanged ones are skipped
+    """
+    fingerprints = {record.name: record.fingerprint for record in records}
+    stored = dict(session.execute(
+        select(EtlState.record_key, EtlState.fingerprint)
+        .where(EtlState.source == source, EtlState.record_key.in_(list(fingerprints)))
+    ).all())
+
+    for name, digest in fingerprints.items():
+        if name not in stored:
+            diff.add(source, "added")
+        elif stored[name] != digest:
+            diff.add(source, "changed")
+        else:
+            diff.add(source, "unchanged")
+
+    insert_rows(session, EtlState, [
+        {"source": source, "record_key": name, "fingerprint": digest}
+        for name, digest in fingerprints.items() if name not in stored
+    ])
+    updates = [
+        {"b_record_key": name, "b_fingerprint": digest}
+        for name, digest in fingerprints.items() if name in stored and stored[name] != digest
+    ]
+    if updates:
+        table = EtlState.__table__
+        session.execute(
+            update(table)
+            .where(table.c.source == source, table.c.record_key == bindparam("b_record_key"))
+            .values(fingerprint=bindparam("b_fingerprint")),
+            updates
+        )
+
+    return [record for record in records if stored.get(record.name) != fingerprints[record.name]]
+
+
+def refresh_changed(session: Session, diff: DiffSummary):
+    """
+    Incremental counterpart of the index, backfill and rollup rebuilds: re-index the opening hours of the applied
+    pharmacies, backfill and roll up the inserted transactions, and only bump the data versions that changed.
+    Steps with nothing to apply are skipped, so an unchanged re-run leaves these tables alone.
+    """
+    if diff.pharmacy_ids:
+        print(f"🕒 Indexing opening hours of {len(diff.pharmacy_ids)} pharmacies...")
+        rebuild_opening_intervals(session, diff.pharmacy_ids)
+    if diff.transaction_ids:
+        print(f"🧮 Backfilling {len(diff.transaction_ids)} transactions...")
+        backfill_transaction_quantities(session, diff.transaction_ids)
+        print("📊 Adding them to daily sales and user spend...")
+        add_transactions(session, diff.transaction_ids)
+
+    scopes = []
+    if diff.applied("pharmacies"):
+        scopes.append(CATALOG)
+    if diff.applied("pharmacies") or diff.applied("users"):
+        scopes.append(BALANCES)
+    if diff.transaction_ids:
+        scopes.append(SALES)
+    if scopes:
+        bump_versions(session, *scopes)
+
+
+# ============================================================================================
+# Transaction backfill
+# Purpose: Fill quantity and unit_price_cents of transactions loaded from the feed, which only has amounts.
+# ============================================================================================
+def backfill_transaction_quantities(session: Session, transaction_ids: list = None):
+    """
+    Set quantity = round(transaction amount / catalog price) (at least 1) and unit_price_cents =
+    round(amount / quantity) on transactions that have none yet, optionally only on `transaction_ids`.
+    Transactions whose pharmacy no longer lists the mask are left unset.
+    """
+    if transaction_ids is not None:
+        for batch in chunked(transaction_ids, BATCH_SIZE):
+            backfill_transaction_quantities_where(session, Transaction.id.in_(batch))
+    else:
+        backfill_transaction_quantities_where(session)
+
+
+def backfill_transaction_quantities_where(session: Session, *conditions):
+    """
+    Backfill the transactions matching `conditions` (all of them when none are given).
+    """
+    price_cents = select(PharmacyMask.price_cents).where(
+        PharmacyMask.pharmacy_id == Transaction.pharmacy_id,
+        PharmacyMask.mask_id == Transaction.mask_id
+    ).scalar_subquery()
+    amount_cents = cast(Transaction.transaction_amount_cents, Float)  # Avoid integer division
+    session.execute(
+        update(Transaction)
+        .where(Transaction.quantity.is_(None), *conditions)
+        .values(quantity=func.max(1, cast(func.round(amount_cents / price_cents), Integer)))
+    )
+    session.execute(
+        update(Transaction)
+        .where(Transaction.unit_price_cents.is_(None), Transaction.quantity.is_not(None), *conditions)
+        .values(unit_price_cents=cast(func.round(amount_cents / Transaction.quantity), Integer))
+    )
+
+
+# ============================================================================================
+# Opening hours index
+# Purpose: Normalize opening hours into minute-of-week intervals served by GET /pharmacies/open.
+# ============================================================================================
+def rebuild_opening_intervals(session: Session, pharmacy_ids=None):
+    """
+    Rebuild the minute-of-week interval index from the opening_hours table, optionally only for `pharmacy_ids`.
+    Identical intervals of a pharmacy (e.g. from re-appended opening hours) are stored once.
+    """
+    if pharmacy_ids is None:
+        index_opening_hours(session)
+        return
+    for batch in chunked(sorted(pharmacy_ids), BATCH_SIZE):
+        index_opening_hours(session, batch)
+
+
+def index_opening_hours(session: Session, pharmacy_ids: list = None):
+    """
+    Replace the intervals of all pharmacies, or of the given ones, with those of their opening hours.
+    """
+    query = select(OpeningHour.pharmacy_id, OpeningHour.day_of_week, OpeningHour.start_time, OpeningHour.end_time)
+    stale = delete(OpeningInterval)
+    if pharmacy_ids is not None:
+        query = query.where(OpeningHour.pharmacy_id.in_(pharmacy_ids))
+        stale = stale.where(OpeningInterval.pharmacy_id.in_(pharmacy_ids))
+    intervals = {
+        (pharmacy_id, start_minute, end_minute)
+        for pharmacy_id, day_of_week, start_time, end_time in session.execute(query)
+        for start_minute, end_minute in to_week_intervals(day_of_week, start_time, end_time)
+    }
+
+    session.execute(stale)
+    insert_rows(session, OpeningInterval, [
+        {"pharmacy_id": pharmacy_id, "start_minute": start_minute, "end_minute": end_minute}
+        for pharmacy_id, start_minute, end_minute in sorted(intervals)
+    ])
+
+
+def parse_args(argv=None):
+    """
+    Parse ETL command line options.
+    """
+    parser = argparse.ArgumentParser(description="Load pharmacy and user feeds into the database.")
+    parser.add_argument("--pharmacies", default="data/pharmacies.json", help="Path to the pharmacy feed")
+    parser.add_argument("--users", default="data/users.json", help="Path to the user feed")
+    parser.add_argument("--bulk", action="store_true", help="Use set-based lookups and batched inserts")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per executemany batch (bulk mode)")
+    parser.add_argument("--stream", action="store_true", help="Parse feeds incrementally and commit in chunks")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Records per commit (stream mode)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Resumable checkpoint file (stream mode)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only apply records whose fingerprint changed since the last run (bulk or stream mode)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for the transform stage (bulk or stream mode)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     Main ETL entry point: create tables, load pharmacies and users, commit and close session.
     """
-    Base.metadata.create_all(bind=engine)
+    args = parse_args(argv)
+    create_schema(engine)
     session = SessionLocal()
 
-    print("🚚 Loading pharmacies...")
-    load_pharmacies(session, "data/pharmacies.json")
+    diff = DiffSummary() if args.incremental else None
+    checkpoint = None
+    resumed = False
+
+    if args.stream:
+        stats = StageStats()
+        checkpoint = Checkpoint(args.checkpoint)
+        # A leftover checkpoint means an earlier run died before its final commit. The records it committed are not
+        # in this run's diff, so this run refreshes everything
+        resumed = bool(checkpoint.state)
+
+        print("🚚 Streaming pharmacies...")
+        stream_load_pharmacies(session, args.pharmacies, stats, checkpoint, args.chunk_size, diff, args.workers)
+
+        print("👥 Streaming users...")
+        stream_load_users(session, args.users, stats, checkpoint, args.chunk_size, diff, args.workers)
+
+        stats.report()
+    elif args.bulk or args.incremental or args.workers > 1:
+        stats = StageStats()
+
+        print("🚚 Loading pharmacies (bulk)...")
+        bulk_load_pharmacies(session, args.pharmacies, stats, args.batch_size, diff, args.workers)
+
+        print("👥 Loading users (bulk)...")
+        bulk_load_users(session, args.users, stats, args.batch_size, diff, args.workers)
+
+        stats.report()
+    else:
+        print("🚚 Loading pharmacies...")
+        load_pharmacies(session, args.pharmacies)
 
-    print("👥 Loading users...")
-    load_users(session, "data/users.json")
+        print("👥 Loading users...")
+        load_users(session, args.users)
 
+    if diff is None or resumed:
+        print("🕒 Indexing opening hours...")
+        rebuild_opening_intervals(session)
+        print("🧮 Backfilling transaction quantities...")
+        backfill_transaction_quantities(session)
+        print("📊 Rolling up daily sales and user spend...")
+        rebuild_rollups(session)
+        bump_versions(session, *SCOPES)
+    else:
+        refresh_changed(session, diff)
     session.commit()
     session.close()
+    # Only now are the derived tables consistent with the fingerprints the stream committed chunk by chunk
+    if checkpoint is not None:
+        checkpoint.clear()
+    if diff is not None:
+        print("🔁 Changes applied:")
+        diff.report()
     print("✅ ETL complete!")
 
 
@@ -1,7 +1,7 @@
-from app.models import Base
+from app.models import create_schema
 from app.db import engine
 
-# Script to initialize the database schema (create all tables)
+# Script to initialize the database schema (create all tables and indexes)
 if __name__ == '__main__':
-    Base.metadata.create_all(bind=engine)
+    create_schema(engine)
     print("✅ Database created successfully.")
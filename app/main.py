@@ -1,13 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from app.api import pharmacies, users, summary, search, purchase
+from app.api import pharmacies, users, summary, search, purchase, admin
+from app.db import SessionLocal
+from app.metrics import MetricsMiddleware, metrics
+from app.profiling import ProfilingMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the search index at startup; it is built lazily on first search if the database is not ready yet
+    try:
+        with SessionLocal() as db:
+            search.search_index.refresh(db)
+    except SQLAlchemyError:
+        pass
+    yield
+    # Let the single-writer purchase queue apply the purchases already accepted
+    if purchase.purchase_writer is not None:
+        purchase.purchase_writer.stop()
 
 # Main FastAPI application entry point
 app = FastAPI(
     title="Pharmacy Mask API",
-    version="1.0"
+    version="1.0",
+    lifespan=lifespan
 )
 
 # Register all API routers with their respective prefixes
@@ -17,10 +37,17 @@ def register_routers():
     app.include_router(summary.router, prefix="/summary")
     app.include_router(search.router, prefix="/search")
     app.include_router(purchase.router, prefix="/purchase")
+    app.include_router(admin.router, prefix="/admin")
 
 # Register the routers when the app starts
 register_routers()
 
+# Per-request query counts, DB time and latency histograms (a pass-through unless METRICS is enabled)
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in per-request profiling, triggered by the X-Profile header or sampling (a pass-through unless PROFILING is enabled)
+app.add_middleware(ProfilingMiddleware)
+
 # Root endpoint for health check and API info
 @app.get("/")
 def read_root():
@@ -31,6 +58,11 @@ def read_root():
         "redoc_url": "/redoc"
     }
 
+# Prometheus text-format metrics: requests, latency histograms, statements and DB time per route
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Global exception handlers for consistent error responses
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
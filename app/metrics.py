@@ -0,0 +1,328 @@
+"""
+Request metrics
+Counts the SQL statements and DB time of each request through engine events, records per-route latency
+histograms in middleware and renders them in the Prometheus text format for GET /metrics.
+The same events keep a slow-query log: statements over a threshold, with their route and query plan.
+The per-request counters live in a context variable, which follows the request into the threadpool
+and into AsyncSession.run_sync, so statements are attributed to the request that issued them.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+
+from app.config import METRICS, SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE
+
+# Upper bounds (seconds) of the latency histogram buckets; the implicit last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """
+    SQL statement count and DB time of one request.
+    """
+    __slots__ = ("scope", "queries", "db_time")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Stats of the request being served, None outside instrumented requests
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+
+def route_name(scope: dict) -> str:
+    """
+    Return the route template of a request ('/pharmacies/{pharmacy_name}/masks'), so the metrics have one series
+    per route instead of one per URL; requests that match no route share 'unmatched'.
+    The template is rebuilt from the path and the matched path parameters, which works for routes of included
+    routers too (their route objects only know the path below the router prefix).
+    """
+    if "endpoint" not in scope:
+        return "unmatched"
+    segments = scope["path"].split("/")
+    for name, value in scope.get("path_params", {}).items():
+        for index in range(len(segments) - 1, 0, -1):
+            if segments[index] == str(value):
+                segments[index] = "{" + name + "}"
+                break
+    return "/".join(segments)
+
+
+# Runs of placeholders (expanded IN lists), string literals and numbers, collapsed by normalize_sql()
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+MAX_LOGGED_PARAMETERS = 50
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Collapse whitespace, literals and IN lists of any length, so repeated statements read the same.
+    """
+    statement = " ".join(statement.split())
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    return PLACEHOLDER_LIST.sub("?, ...", statement)
+
+
+def parameter_types(parameters) -> list:
+    """
+    Return the type names of up to MAX_LOGGED_PARAMETERS parameters. Values are never logged: they can hold
+    user names and amounts, and the log is served over HTTP.
+    """
+    values = list(parameters.values()) if isinstance(parameters, dict) else list(parameters or ())
+    return [type(value).__name__ for value in values[:MAX_LOGGED_PARAMETERS]]
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of statements that took at least threshold_ms, with their normalized SQL, parameter types, duration,
+    originating route and SQLite EXPLAIN QUERY PLAN. Plans are cached per statement, so a burst of the
+    same slow statement is explained once.
+    """
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, size: int = SLOW_QUERY_LOG_SIZE, plan_cache_size: int = 256):
+        self.threshold_ms = threshold_ms
+        self.records = deque(maxlen=size)
+        self.recorded = 0
+        self.plans = OrderedDict()
+        self.plan_cache_size = plan_cache_size
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def explain(self, cursor, statement: str, parameters) -> list:
+        """
+        Return the EXPLAIN QUERY PLAN details of a statement, run on a new cursor of the same connection.
+        """
+        with self.lock:
+            if statement in self.plans:
+                self.plans.move_to_end(statement)
+                return self.plans[statement]
+        try:
+            plan_cursor = cursor.connection.cursor()
+            try:
+                plan = [row[3] for row in plan_cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+            finally:
+                plan_cursor.close()
+        except Exception as exc:
+            plan = [f"EXPLAIN failed: {exc}"]
+        with self.lock:
+            self.plans[statement] = plan
+            if len(self.plans) > self.plan_cache_size:
+                self.plans.popitem(last=False)
+        return plan
+
+    def record(self, conn, cursor, statement: str, parameters, executemany: bool, seconds: float):
+        stats = current_request.get()
+        rows = parameters if executemany else [parameters]
+        first = rows[0] if rows else ()
+        plan = self.explain(cursor, statement, first) if conn.dialect.name == "sqlite" else None
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "duration_ms": round(seconds * 1000, 3),
+            "route": None if stats is None else f"{stats.scope['method']} {route_name(stats.scope)}",
+            "statement": normalize_sql(statement),
+            "parameter_types": parameter_types(first),
+            "executemany_rows": len(rows) if executemany else None,
+            "plan": plan,
+        }
+        with self.lock:
+            self.records.append(entry)
+            self.recorded += 1
+
+    def stats(self) -> dict:
+        """
+        Report the threshold and the logged statements, most recent first.
+        """
+        with self.lock:
+            records = list(reversed(self.records))
+            recorded = self.recorded
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "capacity": self.records.maxlen,
+            "recorded": recorded,
+            "queries": records,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.recorded = 0
+            self.plans.clear()
+
+
+# Shared slow-query log
+slow_query_log = SlowQueryLog()
+
+
+def install_query_hooks(engine):
+    """
+    Time statements on a sync engine (for an async engine, pass engine.sync_engine): add their count and
+    execution time to the stats of the current request, and log those over the slow-query threshold.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and (current_request.get() is not None or slow_query_log.enabled):
+            context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += seconds
+        if slow_query_log.enabled and seconds * 1000 >= slow_query_log.threshold_ms:
+            slow_query_log.record(conn, cursor, statement, parameters, executemany, seconds)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with a count and a sum, as in the Prometheus exposition format.
+    """
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Per-route request counts, latency histograms, statement counts and DB time.
+    """
+    def __init__(self, enabled: bool = METRICS):
+        self.enabled = enabled
+        self.latency = {}  # (method, route) -> Histogram
+        self.requests = {}  # (method, route, status) -> count
+        self.queries = {}  # (method, route) -> statements
+        self.db_time = {}  # (method, route) -> seconds
+        self.lock = threading.Lock()
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        with self.lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(seconds)
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self.queries[key] = self.queries.get(key, 0) + stats.queries
+            self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+
+    def render(self) -> str:
+        """
+        Render all series in the Prometheus text exposition format (version 0.0.4).
+        """
+        def labels(method, route, **extra):
+            pairs = {"method": method, "route": route, **extra}
+            return ",".join(f'{name}="{escape(value)}"' for name, value in pairs.items())
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+            latency = sorted((key, list(h.counts), h.count, h.sum) for key, h in self.latency.items())
+            queries = sorted(self.queries.items())
+            db_time = sorted(self.db_time.items())
+
+        lines = ["# HELP http_requests_total Requests served, by route and status code.",
+                 "# TYPE http_requests_total counter"]
+        lines += [f"http_requests_total{{{labels(method, route, status=str(status))}}} {count}"
+                  for (method, route, status), count in requests]
+
+        lines += ["# HELP http_request_duration_seconds Request latency, by route.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), counts, count, total in latency:
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"http_request_duration_seconds_bucket{{{labels(method, route, le=str(bound))}}} {cumulative}")
+            lines.append(f"http_request_duration_seconds_sum{{{labels(method, route)}}} {total}")
+            lines.append(f"http_request_duration_seconds_count{{{labels(method, route)}}} {count}")
+
+        lines += ["# HELP db_queries_total SQL statements executed, by route.",
+                  "# TYPE db_queries_total counter"]
+        lines += [f"db_queries_total{{{labels(method, route)}}} {count}" for (method, route), count in queries]
+
+        lines += ["# HELP db_query_seconds_total Time spent executing SQL statements, by route.",
+                  "# TYPE db_query_seconds_total counter"]
+        lines += [f"db_query_seconds_total{{{labels(method, route)}}} {seconds}" for (method, route), seconds in db_time]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.latency.clear()
+            self.requests.clear()
+            self.queries.clear()
+            self.db_time.clear()
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Shared metrics registry
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times each HTTP request, collects its statement count and DB time, adds the
+    X-DB-Queries and X-DB-Time-ms response headers and records the request in the metrics registry.
+    With only the slow-query log enabled, it just tracks the request so slow statements name their route.
+    When both are disabled, requests pass straight through.
+    """
+    def __init__(self, app, registry: Metrics = metrics, slow_queries: SlowQueryLog = slow_query_log):
+        self.app = app
+        self.registry = registry
+        self.slow_queries = slow_queries
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (self.registry.enabled or self.slow_queries.enabled):
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        if not self.registry.enabled:
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                current_request.reset(token)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-queries", str(stats.queries).encode()),
+                    (b"x-db-time-ms", f"{stats.db_time * 1000:.3f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_request.reset(token)
+            self.registry.record(scope["method"], route_name(scope), status, time.perf_counter() - started, stats)
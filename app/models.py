@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, Time, DateTime, Boolean, ForeignKey
+from sqlalchemy import inspect, text, Column, Integer, String, Time, Date, DateTime, Boolean, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 
@@ -9,17 +9,18 @@ Base = declarative_base()
 
 class Pharmacy(Base):
     """
-    Pharmacy table: stores pharmacy info and cash balance.
+    Pharmacy table: stores pharmacy info and cash balance (in cents).
     Relationships: opening hours, masks, transactions.
     """
     __tablename__ = 'pharmacies'
 
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
-    cash_balance = Column(Float, nullable=False)
+    cash_balance_cents = Column(Integer, nullable=False)
 
     opening_hours = relationship('OpeningHour', back_populates='pharmacy')
-    masks = relationship('PharmacyMask', back_populates='pharmacy')
+    opening_intervals = relationship('OpeningInterval', back_populates='pharmacy')
+    masks = relationship('PharmacyMask', back_populates='pharmacy', order_by='PharmacyMask.id')
     transactions = relationship('Transaction', back_populates='pharmacy')
 
 
@@ -29,6 +30,7 @@ class OpeningHour(Base):
     OpeningHour table: stores opening hours for each pharmacy.
     """
     __tablename__ = 'opening_hours'
+    __table_args__ = (Index('ix_opening_hours_pharmacy_id', 'pharmacy_id'),)
 
     id = Column(Integer, primary_key=True)
     pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False)
@@ -41,6 +43,27 @@ class OpeningHour(Base):
 
 
 
+class OpeningInterval(Base):
+    """
+    OpeningInterval table: opening hours normalized into half-open minute-of-week intervals
+    [start_minute, end_minute), where 0 is Monday 00:00. Overnight spans are split at midnight,
+    so every interval lies within one day and an open-at lookup is a bounded index range seek.
+    """
+    __tablename__ = 'opening_intervals'
+    __table_args__ = (
+        Index('ix_opening_intervals_start_end', 'start_minute', 'end_minute'),
+        Index('ix_opening_intervals_pharmacy_id', 'pharmacy_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False)
+    start_minute = Column(Integer, nullable=False)
+    end_minute = Column(Integer, nullable=False)
+
+    pharmacy = relationship('Pharmacy', back_populates='opening_intervals')
+
+
+
 class Mask(Base):
     """
     Mask table: stores mask product info.
@@ -58,14 +81,20 @@ class Mask(Base):
 
 class PharmacyMask(Base):
     """
-    PharmacyMask table: association table for pharmacy and mask, with price.
+    PharmacyMask table: association table for pharmacy and mask, with price (in cents).
+    Each pharmacy lists a mask at most once; (price_cents, pharmacy_id) serves the price-range filter.
     """
     __tablename__ = 'pharmacy_masks'
+    __table_args__ = (
+        Index('uq_pharmacy_masks_pharmacy_mask', 'pharmacy_id', 'mask_id', unique=True),
+        Index('ix_pharmacy_masks_mask_id', 'mask_id'),
+        Index('ix_pharmacy_masks_price_pharmacy', 'price_cents', 'pharmacy_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False)
     mask_id = Column(Integer, ForeignKey('masks.id'), nullable=False)
-    price = Column(Float, nullable=False)
+    price_cents = Column(Integer, nullable=False)
 
     pharmacy = relationship('Pharmacy', back_populates='masks')
     mask = relationship('Mask', back_populates='pharmacies')
@@ -74,13 +103,13 @@ class PharmacyMask(Base):
 
 class User(Base):
     """
-    User table: stores user info and cash balance.
+    User table: stores user info and cash balance (in cents).
     """
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
-    cash_balance = Column(Float, nullable=False)
+    cash_balance_cents = Column(Integer, nullable=False)
 
     transactions = relationship('Transaction', back_populates='user')
 
@@ -88,17 +117,171 @@ class User(Base):
 
 class Transaction(Base):
     """
-    Transaction table: records each mask purchase transaction.
+    Transaction table: records each mask purchase transaction (amounts in cents).
+    Indexed by date for the date-range reports and by user for per-user history lookups.
+    quantity and unit_price_cents are NULL only for rows loaded before they existed, until the ETL backfills them.
     """
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_date', 'transaction_date'),
+        Index('ix_transactions_user_date', 'user_id', 'transaction_date'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False)
     mask_id = Column(Integer, ForeignKey('masks.id'), nullable=False)
-    transaction_amount = Column(Float, nullable=False)
+    transaction_amount_cents = Column(Integer, nullable=False)
     transaction_date = Column(DateTime, nullable=False)
+    quantity = Column(Integer)
+    unit_price_cents = Column(Integer)
 
     user = relationship('User', back_populates='transactions')
     pharmacy = relationship('Pharmacy', back_populates='transactions')
-    mask = relationship('Mask', back_populates='transactions')
\ No newline at end of file
+    mask = relationship('Mask', back_populates='transactions')
+
+
+
+class DailySales(Base):
+    """
+    DailySales table: transaction count, masks sold and value (in cents) per (day, pharmacy, mask).
+    Rebuilt by the ETL and updated by each purchase, so date-range reports read one row per day and product.
+    """
+    __tablename__ = 'daily_sales'
+    __table_args__ = (Index('uq_daily_sales_day_pharmacy_mask', 'day', 'pharmacy_id', 'mask_id', unique=True),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    pharmacy_id = Column(Integer, ForeignKey('pharmacies.id'), nullable=False)
+    mask_id = Column(Integer, ForeignKey('masks.id'), nullable=False)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    total_value_cents = Column(Integer, nullable=False, default=0)
+
+
+
+class UserDailySpend(Base):
+    """
+    UserDailySpend table: total transaction amount (in cents) per (day, user), maintained like daily_sales.
+    Serves the /users/top ranking without grouping the raw transactions.
+    """
+    __tablename__ = 'user_daily_spend'
+    __table_args__ = (Index('uq_user_daily_spend_day_user', 'day', 'user_id', unique=True),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    total_amount_cents = Column(Integer, nullable=False, default=0)
+
+
+
+class DataVersion(Base):
+    """
+    DataVersion table: a counter per data scope ('catalog', 'balances', 'sales'), bumped in the same
+    database transaction as every write to that scope. Cached responses are keyed by these versions.
+    """
+    __tablename__ = 'data_versions'
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String, unique=True, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+
+
+
+class EtlState(Base):
+    """
+    EtlState table: fingerprint of each source record applied by the incremental ETL,
+    keyed by source feed ('pharmacies' or 'users') and record name.
+    """
+    __tablename__ = 'etl_state'
+    __table_args__ = (UniqueConstraint('source', 'record_key'),)
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    record_key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)
+
+
+
+# Money columns stored as dollar floats before amounts moved to integer cents: (table, old column, new column)
+DOLLAR_COLUMNS = [
+    ('pharmacies', 'cash_balance', 'cash_balance_cents'),
+    ('pharmacy_masks', 'price', 'price_cents'),
+    ('users', 'cash_balance', 'cash_balance_cents'),
+    ('transactions', 'transaction_amount', 'transaction_amount_cents'),
+    ('transactions', 'unit_price', 'unit_price_cents'),
+    ('daily_sales', 'total_value', 'total_value_cents'),
+    ('user_daily_spend', 'total_amount', 'total_amount_cents'),
+]
+
+
+def migrate_dollars_to_cents(bind):
+    """
+    Convert the dollar float columns of a database created by an older schema into integer cents columns.
+    Each old column is replaced by a new INTEGER column filled with round(value * 100); indexes on
+    the old column are dropped first and rebuilt on the new column by create_schema.
+    """
+    tables = set(inspect(bind).get_table_names())
+    for table_name, old_column, new_column in DOLLAR_COLUMNS:
+        if table_name not in tables:
+            continue
+        inspector = inspect(bind)
+        columns = {column["name"] for column in inspector.get_columns(table_name)}
+        if old_column not in columns or new_column in columns:
+            continue
+
+        nullable = Base.metadata.tables[table_name].columns[new_column].nullable
+        with bind.begin() as conn:
+            for index in inspector.get_indexes(table_name):
+                if old_column in index["column_names"]:
+                    conn.execute(text(f"DROP INDEX {index['name']}"))
+            conn.execute(text(
+                f"ALTER TABLE {table_name} ADD COLUMN {new_column} INTEGER" + ("" if nullable else " NOT NULL DEFAULT 0")
+            ))
+            conn.execute(text(f"UPDATE {table_name} SET {new_column} = CAST(ROUND({old_column} * 100) AS INTEGER)"))
+            conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {old_column}"))
+
+
+def create_schema(bind):
+    """
+    Create all tables, migrate dollar columns to cents, then add any nullable column and index missing
+    from a table created by an older schema (create_all only builds columns and indexes together with a new table).
+    Finally fill the derived tables a database created by an older schema lacks.
+    """
+    Base.metadata.create_all(bind=bind)
+    migrate_dollars_to_cents(bind)
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns and column.nullable:
+                with bind.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                    ))
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    populate_derived_tables(bind)
+
+
+def populate_derived_tables(bind):
+    """
+    Build the derived tables added after the source tables (opening_intervals, daily_sales, user_daily_spend)
+    when they are empty but their source rows exist, so an upgraded database answers the reports without
+    rerunning the ETL. Transactions get their quantities backfilled first, as the rollups sum them.
+    """
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session
+    from app.etl import backfill_transaction_quantities, rebuild_opening_intervals
+    from app.rollups import rebuild_rollups
+
+    def empty(model):
+        return session.scalar(select(model.id).limit(1)) is None
+
+    with Session(bind=bind) as session:
+        if empty(OpeningInterval) and not empty(OpeningHour):
+            rebuild_opening_intervals(session)
+        if (empty(DailySales) or empty(UserDailySpend)) and not empty(Transaction):
+            backfill_transaction_quantities(session)
+            rebuild_rollups(session)
+        session.commit()
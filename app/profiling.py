@@ -0,0 +1,251 @@
+"""
+Per-request profiling
+Runs sampled requests under cProfile and writes one artifact pair per request: pstats data (.prof, for
+pstats/snakeviz) and collapsed stacks (.collapsed, for flamegraph.pl/speedscope). A request is profiled when it
+falls in the sample rate or its profile header holds the configured secret token; without a token the header is
+ignored, so clients cannot force profiling. Only one request is profiled at a time, so a low sample rate is
+safe in production: unsampled requests pay one random() call.
+
+Before Python 3.12, cProfile only sees the thread it is enabled in, so the profile has two parts: the event loop
+thread for the whole request (routing, validation, serialization, and the database work of async sessions), and
+every run_db() call of the request in its worker thread. From 3.12, cProfile is built on sys.monitoring, which allows
+one profiler per process and sees every thread, so the event loop profile records the worker threads too. While a
+request is profiled, the profile also includes other requests' work that ran in between.
+"""
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import PROFILING, PROFILE_HEADER, PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_KEEP
+from app.metrics import route_name
+
+# Collapsed stacks stop at this depth and drop frames under this many microseconds
+MAX_STACK_DEPTH = 64
+MIN_STACK_MICROSECONDS = 1
+
+
+class RequestProfile:
+    """
+    The cProfile profiles of one request: its event loop thread and each run_db() call in a worker thread.
+    """
+    def __init__(self):
+        self.loop_thread = threading.get_ident()
+        self.loop_profile = cProfile.Profile()
+        self.worker_profiles = []
+        self.lock = threading.Lock()
+
+    def runcall(self, fn, *args):
+        """
+        Call fn(*args), under a new profile when it runs outside the event loop thread and a second profiler
+        can be enabled (Python 3.12+ refuses it, but the event loop profile already covers every thread there).
+        """
+        if threading.get_ident() == self.loop_thread:
+            return fn(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return fn(*args)
+        with self.lock:
+            self.worker_profiles.append(profile)
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+
+    def stats(self):
+        """
+        Merge all profiles into one pstats.Stats, or return None if nothing was recorded.
+        """
+        merged = None
+        for profile in [self.loop_profile] + self.worker_profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if merged is None:
+                merged = pstats.Stats(profile)
+            else:
+                merged.add(profile)
+        return merged
+
+
+# Profile of the request being served, None when it is not profiled
+current_profile: ContextVar = ContextVar("current_profile", default=None)
+
+
+def frame_label(function: tuple) -> str:
+    """
+    Label a pstats function key (filename, line, name) as 'module.py:name:line'; built-ins keep their name.
+    """
+    filename, line, name = function
+    if filename == "~":
+        return name.replace(";", ",").replace(" ", "_")
+    return f"{os.path.basename(filename)}:{name}:{line}".replace(";", ",").replace(" ", "_")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> list:
+    """
+    Derive collapsed stacks ('root;caller;callee microseconds') from cProfile's caller/callee edges.
+    cProfile records edges rather than full stacks, so a function's calls are split over the stacks of its callers
+    in proportion to the cumulative time of each edge, and its own time is spread over those stacks accordingly;
+    recursion is cut at the first repeated frame. Stacks start at functions without callers, then at functions
+    whose time is not fully covered yet (frames that were already running when profiling started, such as
+    suspended coroutines, only show up through their callees).
+    """
+    callees = {}
+    incoming = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        incoming[function] = sum(edge[3] for edge in callers.values())
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, edge_cumulative))
+
+    lines = {}
+    covered = {}
+
+    def walk(function, weight, path, labels):
+        covered[function] = covered.get(function, 0.0) + weight
+        labels = labels + [frame_label(function)]
+        stack = ";".join(labels)
+        lines[stack] = lines.get(stack, 0.0) + stats.stats[function][2] * weight
+        if len(labels) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge in callees.get(function, ()):
+            if callee in path or not incoming[callee]:
+                continue
+            callee_weight = weight * edge / incoming[callee]
+            if callee_weight * stats.stats[callee][3] * 1e6 >= MIN_STACK_MICROSECONDS:
+                walk(callee, callee_weight, path | {callee}, labels)
+
+    for root in [function for function, entry in stats.stats.items() if not entry[4]]:
+        walk(root, 1.0, {root}, [])
+    for root in sorted(stats.stats, key=lambda function: -stats.stats[function][3]):
+        remaining = 1.0 - covered.get(root, 0.0)
+        if remaining * stats.stats[root][3] * 1e6 >= MIN_STACK_MICROSECONDS:
+            walk(root, remaining, {root}, [])
+    return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in lines.items() if seconds * 1e6 >= MIN_STACK_MICROSECONDS]
+
+
+class Profiler:
+    """
+    Decides which requests to profile and writes their artifacts to directory, keeping the newest `keep`.
+    """
+    def __init__(self, enabled: bool = PROFILING, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 header: str = PROFILE_HEADER, token: str = PROFILE_TOKEN, directory: str = PROFILE_DIR,
+                 keep: int = PROFILE_KEEP):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode()
+        self.token = token
+        self.directory = directory
+        self.keep = keep
+        self.busy = threading.Lock()
+        self.profiled = 0
+        self.skipped = 0
+
+    def wants(self, scope: dict) -> bool:
+        """
+        Return whether a request falls in the sample rate or sends the secret token in the profile header.
+        """
+        if self.header and self.token and any(
+            name == self.header and hmac.compare_digest(value, self.token.encode()) for name, value in scope["headers"]
+        ):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def write(self, profile: RequestProfile, scope: dict, profile_id: str):
+        """
+        Write <profile_id>.prof and <profile_id>.collapsed, then drop the oldest artifacts beyond `keep`.
+        """
+        stats = profile.stats()
+        if stats is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile_id)
+        stats.dump_stats(path + ".prof")
+        with open(path + ".collapsed", "w", encoding="utf-8") as f:
+            f.write("\n".join(collapsed_stacks(stats)) + "\n")
+
+        artifacts = sorted(name[:-len(".prof")] for name in os.listdir(self.directory) if name.endswith(".prof"))
+        for old in artifacts[:max(len(artifacts) - self.keep, 0)]:
+            for suffix in (".prof", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.directory, old + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "header": self.header.decode(),
+            "header_enabled": bool(self.header and self.token),
+            "directory": self.directory,
+            "profiled": self.profiled,
+            "skipped_while_busy": self.skipped,
+        }
+
+
+# Shared profiler
+profiler = Profiler()
+
+
+def profile_id(scope: dict) -> str:
+    """
+    Name a profile '<epoch ms>-<method>-<route>-<random>', so the artifacts sort by time.
+    """
+    route = re.sub(r"[^A-Za-z0-9]+", "_", route_name(scope)).strip("_") or "root"
+    return f"{int(time.time() * 1000)}-{scope['method']}-{route}-{uuid.uuid4().hex[:8]}"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that runs requests chosen by the profiler under cProfile and answers them with an
+    X-Profile-Id header naming their artifacts. Requests pass straight through when profiling is disabled,
+    when they are not chosen, or while another request is being profiled.
+    """
+    def __init__(self, app, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled or not self.profiler.wants(scope):
+            return await self.app(scope, receive, send)
+        if not self.profiler.busy.acquire(blocking=False):
+            self.profiler.skipped += 1
+            return await self.app(scope, receive, send)
+
+        try:
+            profile = RequestProfile()
+            try:
+                profile.loop_profile.enable()
+            except ValueError:
+                # Another profiler is active in this process
+                return await self.app(scope, receive, send)
+            identifier = None
+
+            async def send_with_id(message):
+                nonlocal identifier
+                if message["type"] == "http.response.start":
+                    identifier = profile_id(scope)
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", identifier.encode())]
+                await send(message)
+
+            token = current_profile.set(profile)
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profile.loop_profile.disable()
+                current_profile.reset(token)
+            self.profiler.profiled += 1
+            await run_in_threadpool(self.profiler.write, profile, scope, identifier or profile_id(scope))
+        finally:
+            self.profiler.busy.release()
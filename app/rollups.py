@@ -0,0 +1,154 @@
+"""
+Sales rollups
+Maintains the daily_sales and user_daily_spend tables read by the /summary and /users/top reports.
+"""
+from functools import lru_cache
+
+from sqlalchemy import Date, delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models import DailySales, UserDailySpend, Transaction
+
+
+def rebuild_rollups(session: Session):
+    """
+    Rebuild every rollup table from the transactions table.
+    """
+    rebuild_daily_sales(session)
+    rebuild_user_daily_spend(session)
+
+
+def rebuild_daily_sales(session: Session):
+    """
+    Rebuild the daily_sales rollup from the transactions table.
+    """
+    day = func.date(Transaction.transaction_date)
+    totals = (
+        select(
+            day,
+            Transaction.pharmacy_id,
+            Transaction.mask_id,
+            func.count(Transaction.id),
+            func.coalesce(func.sum(Transaction.quantity), 0),
+            func.sum(Transaction.transaction_amount_cents)
+        )
+        .group_by(day, Transaction.pharmacy_id, Transaction.mask_id)
+    )
+
+    session.execute(delete(DailySales))
+    session.execute(insert(DailySales).from_select(
+        ["day", "pharmacy_id", "mask_id", "transaction_count", "quantity", "total_value_cents"], totals
+    ))
+
+
+def rebuild_user_daily_spend(session: Session):
+    """
+    Rebuild the user_daily_spend rollup from the transactions table.
+    """
+    day = func.date(Transaction.transaction_date)
+    totals = (
+        select(day, Transaction.user_id, func.sum(Transaction.transaction_amount_cents))
+        .group_by(day, Transaction.user_id)
+    )
+
+    session.execute(delete(UserDailySpend))
+    session.execute(insert(UserDailySpend).from_select(["day", "user_id", "total_amount_cents"], totals))
+
+
+def add_transactions(session: Session, transaction_ids: list, batch_size: int = 500):
+    """
+    Add the given (newly inserted) transactions to both rollups, instead of rebuilding them (incremental ETL
+    runs, which only append transactions). Their cost grows with the new transactions, not with the whole history.
+    Transactions are named by id, so purchases recorded concurrently (which update the rollups themselves) are not
+    counted twice.
+    """
+    day = func.date(Transaction.transaction_date, type_=Date)
+    for start in range(0, len(transaction_ids), batch_size):
+        new = Transaction.id.in_(transaction_ids[start:start + batch_size])
+        sales = session.execute(
+            select(
+                day, Transaction.pharmacy_id, Transaction.mask_id, func.count(Transaction.id),
+                func.coalesce(func.sum(Transaction.quantity), 0), func.sum(Transaction.transaction_amount_cents)
+            )
+            .where(new)
+            .group_by(day, Transaction.pharmacy_id, Transaction.mask_id)
+        ).all()
+        upsert_many_increments(session, DailySales, ["day", "pharmacy_id", "mask_id"], [
+            {
+                "day": sale_day, "pharmacy_id": pharmacy_id, "mask_id": mask_id,
+                "transaction_count": count, "quantity": quantity, "total_value_cents": value_cents
+            }
+            for sale_day, pharmacy_id, mask_id, count, quantity, value_cents in sales
+        ])
+
+        spend = session.execute(
+            select(day, Transaction.user_id, func.sum(Transaction.transaction_amount_cents))
+            .where(new)
+            .group_by(day, Transaction.user_id)
+        ).all()
+        upsert_many_increments(session, UserDailySpend, ["day", "user_id"], [
+            {"day": spend_day, "user_id": user_id, "total_amount_cents": amount_cents}
+            for spend_day, user_id, amount_cents in spend
+        ])
+
+
+def upsert_increments(session: Session, model, keys: dict, increments: dict):
+    """
+    Insert a rollup row, or add the increments to the row already stored under the same keys.
+    - keys: Values of the columns of the model's unique index
+    - increments: Values added to the counter columns
+    """
+    upsert_many_increments(session, model, list(keys), [{**keys, **increments}])
+
+
+def upsert_many_increments(session: Session, model, key_columns: list, rows: list):
+    """
+    Upsert several rollup rows with a single executemany of one INSERT ... ON CONFLICT statement.
+    - key_columns: Columns of the model's unique index
+    - rows: dicts with the key columns and the counter columns; every other column is added on conflict
+    """
+    if not rows:
+        return
+    counter_columns = tuple(column for column in rows[0] if column not in key_columns)
+    session.execute(upsert_statement(model.__table__, tuple(key_columns), counter_columns), rows)
+
+
+@lru_cache(maxsize=None)
+def upsert_statement(table, key_columns: tuple, counter_columns: tuple):
+    """
+    Build (once per table and column set) an INSERT ... ON CONFLICT statement adding the counter columns.
+    It has no inline values, so its compiled form is also cached across calls.
+    """
+    statement = sqlite_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={column: table.c[column] + statement.excluded[column] for column in counter_columns}
+    )
+
+
+def record_daily_sales(session: Session, sales: list):
+    """
+    Add sales to the daily_sales rollup in the caller's transaction.
+    - sales: dicts with day, pharmacy_id, mask_id, quantity and total_value_cents, one per transaction
+    """
+    totals = {}
+    for sale in sales:
+        key = (sale["day"], sale["pharmacy_id"], sale["mask_id"])
+        count, quantity, value_cents = totals.get(key, (0, 0, 0))
+        totals[key] = (count + 1, quantity + sale["quantity"], value_cents + sale["total_value_cents"])
+
+    upsert_many_increments(session, DailySales, ["day", "pharmacy_id", "mask_id"], [
+        {
+            "day": day, "pharmacy_id": pharmacy_id, "mask_id": mask_id,
+            "transaction_count": count, "quantity": quantity, "total_value_cents": value_cents
+        }
+        for (day, pharmacy_id, mask_id), (count, quantity, value_cents) in totals.items()
+    ])
+
+
+def record_user_spend(session: Session, day, user_id: int, amount_cents: int):
+    """
+    Add a user's spend on a day (in cents) to the user_daily_spend rollup in the caller's transaction.
+    """
+    upsert_increments(session, UserDailySpend, {"day": day, "user_id": user_id}, {"total_amount_cents": amount_cents})
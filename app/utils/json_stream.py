@@ -0,0 +1,95 @@
+# Utility functions for incrementally parsing large JSON feeds.
+import codecs
+import json
+
+
+# Characters a number cut at the buffer boundary may still continue with ("12" of "12.5", "1e" of "1e5")
+NUMBER_CHARS = frozenset("0123456789.eE+-")
+LITERALS = ("true", "false", "null")
+
+
+def is_cut_off(buffer: str, error: json.JSONDecodeError) -> bool:
+    """
+    Return whether a decode error comes from an item cut at the end of the buffer rather than from malformed JSON:
+    a string running to the end, or an error within a possibly incomplete number, literal or escape there.
+    """
+    rest = buffer[error.pos:]
+    if error.msg.startswith("Unterminated string") or len(rest) <= 1:
+        return True
+    if error.msg.startswith("Invalid \\uXXXX escape"):
+        return len(rest) <= 6
+    return all(c in NUMBER_CHARS for c in rest) or any(literal.startswith(rest) for literal in LITERALS)
+
+
+def iter_json_array(path, start_offset=0, block_size=1 << 16, max_item_size=64 << 20):
+    """
+    Incrementally parse a file holding a top-level JSON array, reading `block_size` bytes at a time.
+    Yields (item, end_offset) tuples, where end_offset is the byte offset right after the item.
+    Passing a previously yielded end_offset as start_offset resumes parsing after that item.
+    Only an item cut at the end of the buffer is read further; malformed input fails at once with its byte
+    offset, and an item larger than `max_item_size` characters fails instead of growing the buffer without bound.
+    Returns: Iterator[tuple]
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    buffer_offset = start_offset  # Byte offset of buffer[0] in the file
+    state = "start" if start_offset == 0 else "after_item"
+    eof = False
+
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+
+        def read_more():
+            nonlocal buffer, eof
+            if eof:
+                raise ValueError(f"Unexpected end of JSON array in {path}")
+            if len(buffer) > max_item_size:
+                raise ValueError(f"JSON item at byte {buffer_offset} in {path} exceeds {max_item_size} characters")
+            block = f.read(block_size)
+            eof = not block
+            buffer += utf8.decode(block, final=eof)
+
+        while True:
+            pos = 0
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buffer):
+                read_more()
+                continue
+
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise ValueError(f"{path} does not hold a top-level JSON array")
+                end, state = pos + 1, "first"
+            elif state == "after_item":
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' at byte {buffer_offset + pos} in {path}")
+                end, state = pos + 1, "after_comma"
+            elif state == "first" and char == "]":
+                return
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if not eof and is_cut_off(buffer, e):
+                        read_more()
+                        continue
+                    raise ValueError(f"Invalid JSON at byte {buffer_offset + len(buffer[:e.pos].encode('utf-8'))} "
+                                     f"in {path}: {e.msg}") from None
+                # A number cut at the buffer boundary ("12" of "12.5") decodes without error
+                if not eof and all(c in NUMBER_CHARS for c in buffer[end:]):
+                    read_more()
+                    continue
+                if end < len(buffer) and buffer[end] not in " \t\r\n,]":
+                    raise ValueError(f"Expected ',' or ']' at byte {buffer_offset + len(buffer[:end].encode('utf-8'))} "
+                                     f"in {path}")
+                state = "after_item"
+
+            buffer_offset += len(buffer[:end].encode("utf-8"))
+            buffer = buffer[end:]
+            if state == "after_item":
+                yield item, buffer_offset
@@ -0,0 +1,20 @@
+# Money helpers: amounts are stored as integer cents and converted to dollars only at the JSON boundary.
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_cents(amount, rounding: str = ROUND_HALF_UP) -> int:
+    """
+    Convert a dollar amount (int, float or numeric string) to integer cents, rounding half up by default.
+    The float is read through its shortest repr, so 19.99 becomes 1999 and not 1998.
+    Range bounds pass ROUND_CEILING (lower bound) or ROUND_FLOOR (upper bound), so the range never widens.
+    Returns: int
+    """
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=rounding))
+
+
+def from_cents(cents: int) -> float:
+    """
+    Convert integer cents to dollars for a JSON response.
+    Returns: float
+    """
+    return cents / 100
@@ -0,0 +1,57 @@
+# Keyset pagination helpers: opaque cursors holding the sort key of the last item of a page.
+import base64
+import binascii
+import json
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+
+
+class Page(NamedTuple):
+    """
+    One page of a list endpoint. versioned_response() returns the body and sends the rest as headers:
+    next_cursor as X-Next-Cursor (absent on the last page) and total as X-Total-Count (when requested).
+    """
+    body: object
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+def encode_cursor(key) -> str:
+    """
+    Encode a sort key (a sequence of JSON scalars) as an opaque, URL-safe cursor.
+    Returns: str
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(key), separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], types: tuple):
+    """
+    Decode a cursor made by encode_cursor() into a sort key tuple whose items have the given types,
+    or raise a 400 error. An empty cursor means the first page and decodes to None.
+    Returns: Optional[tuple]
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != len(types) or not all(
+        isinstance(value, (int, float) if kind is float else kind) and not isinstance(value, bool)
+        for value, kind in zip(key, types)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
+
+
+def split_page(rows: list, limit: int, sort_key):
+    """
+    Split the limit + 1 rows fetched for a page into the page and the cursor of the next page.
+    - sort_key: Function returning the sort key of a row
+    Returns: (rows of the page, next cursor or None on the last page)
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort_key(rows[-1]))
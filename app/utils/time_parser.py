@@ -2,6 +2,15 @@
 import re
 from datetime import time
 
+DAY_MAP = {
+    "Mon": "Mon", "Tue": "Tue", "Wed": "Wed",
+    "Thu": "Thu", "Thur": "Thu",
+    "Fri": "Fri", "Sat": "Sat", "Sun": "Sun"
+}
+DAY_ORDER = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
 
 def parse_opening_hours(opening_str):
     """
@@ -38,25 +47,17 @@ def parse_days(day_part):
     Parse a day part string (e.g. 'Mon - Fri', 'Mon, Wed, Fri') into a list of weekday strings.
     Returns: List[str]
     """
-    day_map = {
-        "Mon": "Mon", "Tue": "Tue", "Wed": "Wed",
-        "Thu": "Thu", "Thur": "Thu",
-        "Fri": "Fri", "Sat": "Sat", "Sun": "Sun"
-    }
-
-    day_order = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-
     # Format 1: "Mon - Fri"
     if "-" in day_part:
         start_day, end_day = [d.strip() for d in day_part.split("-")]
-        start_idx = day_order.index(day_map[start_day])
-        end_idx = day_order.index(day_map[end_day])
-        return day_order[start_idx:end_idx + 1]
+        start_idx = DAY_ORDER.index(DAY_MAP[start_day])
+        end_idx = DAY_ORDER.index(DAY_MAP[end_day])
+        return DAY_ORDER[start_idx:end_idx + 1]
 
     # Format 2: "Mon, Wed, Fri"
     else:
         parts = [d.strip() for d in day_part.split(",")]
-        return [day_map[d] for d in parts if d in day_map]
+        return [DAY_MAP[d] for d in parts if d in DAY_MAP]
 
 
 def to_time(t_str):
@@ -65,3 +66,32 @@ def to_time(t_str):
     """
     hour, minute = map(int, t_str.split(":"))
     return time(hour, minute)
+
+
+def minute_of_week(day, t):
+    """
+    Convert a weekday name and a datetime.time into minutes since Monday 00:00.
+    Raises KeyError for an unknown weekday.
+    """
+    return DAY_ORDER.index(DAY_MAP[day]) * MINUTES_PER_DAY + t.hour * 60 + t.minute
+
+
+def to_week_intervals(day, start, end):
+    """
+    Convert one opening-hours entry into half-open minute-of-week intervals [start, end).
+    Overnight spans are split at midnight, spilling into the next day (Sun spills into Mon),
+    so no interval is longer than a day or crosses a day boundary.
+    Returns: List[tuple]
+    """
+    day_start = DAY_ORDER.index(DAY_MAP[day]) * MINUTES_PER_DAY
+    start_minute = day_start + start.hour * 60 + start.minute
+    end_minute = day_start + end.hour * 60 + end.minute
+
+    if end_minute > start_minute:
+        return [(start_minute, end_minute)]
+
+    next_day_start = (day_start + MINUTES_PER_DAY) % MINUTES_PER_WEEK
+    intervals = [(start_minute, day_start + MINUTES_PER_DAY)]
+    if end.hour or end.minute:
+        intervals.append((next_day_start, next_day_start + end.hour * 60 + end.minute))
+    return intervals
@@ -0,0 +1,98 @@
+# Utility classes for narrowing name searches with a trigram inverted index.
+import heapq
+from collections import Counter, defaultdict
+
+
+def trigrams(text):
+    """
+    Return the set of trigrams of a lowercased string, padded so that short words and
+    word boundaries also produce trigrams (e.g. 'kf94' -> '  k', ' kf', 'kf9', 'f94', '94 ').
+    Returns: Set[str]
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from name trigrams (and characters) to item ids.
+    Any name containing a search term of three or more characters shares all of the term's
+    inner trigrams, so candidates() never drops an exact, prefix or contains match.
+    Fuzzy matches need not share a trigram with the term, so with a min_similarity the names whose
+    SequenceMatcher ratio can exceed it are added too, found through their shared characters.
+    """
+    def __init__(self, items=()):
+        self.names = {}
+        self.postings = defaultdict(set)
+        self.characters = defaultdict(dict)  # character -> {item id: occurrences in the name}
+        for item_id, name in items:
+            self.add(item_id, name)
+
+    def add(self, item_id, name):
+        lowered = name.lower()
+        self.names[item_id] = lowered
+        for gram in trigrams(lowered):
+            self.postings[gram].add(item_id)
+        for character, count in Counter(lowered).items():
+            self.characters[character][item_id] = count
+
+    def candidates(self, term, min_similarity=None):
+        """
+        Return the ids whose names may be relevant to the term.
+        Terms shorter than three characters can match inside a word without sharing a
+        trigram, so every id is a candidate.
+        - min_similarity: also return the names whose SequenceMatcher ratio with the term may exceed it
+        Returns: Set[int]
+        """
+        term = term.lower()
+        if len(term) < 3:
+            return set(self.names)
+
+        ids = set()
+        for gram in trigrams(term):
+            ids |= self.postings.get(gram, set())
+        if min_similarity is not None:
+            ids |= self.similar(term, min_similarity)
+        return ids
+
+    def similar(self, term, min_similarity):
+        """
+        Return the ids whose names may have a SequenceMatcher ratio above min_similarity with the term.
+        The ratio is 2 * matched characters / total length, and no more characters can match than the two
+        strings have in common (SequenceMatcher.quick_ratio), so this bound never drops a match.
+        Returns: Set[int]
+        """
+        shared = defaultdict(int)
+        for character, count in Counter(term).items():
+            for item_id, name_count in self.characters.get(character, {}).items():
+                shared[item_id] += min(count, name_count)
+        return {
+            item_id for item_id, matches in shared.items()
+            if 2.0 * matches / (len(term) + len(self.names[item_id])) > min_similarity
+        }
+
+    def search(self, term, score, limit=None, after=None, min_similarity=None):
+        """
+        Score candidate names with score(term, name) and return (id, score) pairs with a positive
+        score, ordered by score descending then id. Pass the score's fuzzy cutoff as min_similarity to keep
+        fuzzy matches that share no trigram with the term. With a limit, top-k selection replaces the full sort.
+        With after (the (id, score) pair ending the previous page), only the pairs ranked after it are returned.
+        Returns: List[tuple]
+        """
+        term = term.lower()
+        scored = []
+        for item_id in sorted(self.candidates(term, min_similarity)):
+            item_score = score(term, self.names[item_id])
+            if item_score > 0:
+                scored.append((item_id, item_score))
+
+        if after is not None:
+            after_id, after_score = after
+            scored = [
+                (item_id, item_score) for item_id, item_score in scored
+                if (-item_score, item_id) > (-after_score, after_id)
+            ]
+
+        if limit is not None:
+            return heapq.nlargest(limit, scored, key=lambda pair: pair[1])
+        return sorted(scored, key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,371 @@
+"""
+End-to-end API benchmark.
+Generates a synthetic dataset for each size (app/datagen.py), loads it with the bulk ETL into a fresh SQLite file,
+then drives every route of app/main.py in-process through the ASGI app with a weighted request mix and N concurrent
+clients. Reports overall throughput and, per endpoint, throughput, p50/p95/p99 latency and status codes as JSON.
+Each size runs in its own subprocess because the database URL is read at import time; other settings
+(RESPONSE_CACHE_ROUTES, DB_ASYNC, PURCHASE_WRITER, ...) are passed through from the environment.
+
+Run:      PYTHONPATH=. python benchmarks/api.py --sizes small medium --concurrency 1 16 --output bench.json
+Compare:  PYTHONPATH=. python benchmarks/api.py --sizes small medium --concurrency 1 16 --baseline bench.json
+          PYTHONPATH=. python benchmarks/api.py --compare new.json --baseline bench.json --threshold 15
+A comparison exits with status 1 when any endpoint's p95 latency grows, or its throughput drops, by more than
+--threshold percent.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+# (pharmacies, users, purchases) for each named size; custom sizes are given as P:U:N
+SIZES = {
+    "small": (100, 1_000, 10_000),
+    "medium": (1_000, 10_000, 100_000),
+    "large": (10_000, 100_000, 1_000_000),
+}
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+START_DATE = date(2021, 1, 1)
+DAYS = 365
+
+
+class Workload:
+    """
+    Builds requests for every route from the names in the generated feeds.
+    Each builder returns (method, path, params, json body).
+    """
+    def __init__(self, pharmacies_path: str, users_path: str, seed: int):
+        with open(pharmacies_path, encoding="utf-8") as f:
+            self.pharmacies = [(p["name"], [(m["name"], m["price"]) for m in p["masks"]]) for p in json.load(f)]
+        with open(users_path, encoding="utf-8") as f:
+            self.users = [user["name"] for user in json.load(f)]
+        self.mask_words = sorted({word for _, masks in self.pharmacies for name, _ in masks for word in name.split()[:1]})
+        self.rng = random.Random(seed)
+
+    def time(self) -> str:
+        return f"{self.rng.randrange(24):02d}:{self.rng.choice(['00', '15', '30', '45'])}"
+
+    def date_range(self) -> dict:
+        start = START_DATE + timedelta(days=self.rng.randrange(DAYS))
+        end = min(start + timedelta(days=self.rng.choice([1, 7, 30, 90, 365])), START_DATE + timedelta(days=DAYS - 1))
+        return {"start_date": start.isoformat(), "end_date": end.isoformat()}
+
+    def root(self):
+        return "GET", "/", None, None
+
+    def open(self):
+        return "GET", "/pharmacies/open", {"weekday": self.rng.choice(WEEKDAYS), "time_str": self.time()}, None
+
+    def open_between(self):
+        params = {"start_weekday": self.rng.choice(WEEKDAYS), "start_time": self.time(),
+                  "end_weekday": self.rng.choice(WEEKDAYS), "end_time": self.time()}
+        return "GET", "/pharmacies/open_between", params, None
+
+    def pharmacy_masks(self):
+        name, _ = self.rng.choice(self.pharmacies)
+        return "GET", f"/pharmacies/{name}/masks", {"sort_by": self.rng.choice(["name", "price"])}, None
+
+    def filter_by_mask_count(self):
+        low = self.rng.choice([0, 5, 10, 20])
+        params = {"min_price": low, "max_price": low + self.rng.choice([5, 10, 30]), "count": self.rng.randint(0, 4),
+                  "comparison": self.rng.choice(["more", "fewer"])}
+        return "GET", "/pharmacies/filter_by_mask_count_within_price_range", params, None
+
+    def top_users(self):
+        return "GET", "/users/top", {**self.date_range(), "limit": self.rng.choice([5, 10, 50])}, None
+
+    def summary(self):
+        return "GET", "/summary", self.date_range(), None
+
+    def summary_pharmacies(self):
+        return "GET", "/summary/pharmacies", self.date_range(), None
+
+    def summary_masks(self):
+        return "GET", "/summary/masks", self.date_range(), None
+
+    def search(self):
+        if self.rng.random() < 0.5:
+            name, _ = self.rng.choice(self.pharmacies)
+            params = {"query_name": name.split()[0][:self.rng.randint(3, 6)], "search_type": "pharmacy"}
+        else:
+            params = {"query_name": self.rng.choice(self.mask_words), "search_type": "mask"}
+        return "GET", "/search", {**params, "limit": 20}, None
+
+    def purchase(self):
+        items = []
+        for _ in range(self.rng.choice([1, 1, 2, 3])):
+            name, masks = self.rng.choice(self.pharmacies)
+            mask, _ = min(masks, key=lambda m: m[1]) if masks else ("", 0)
+            items.append({"pharmacy_name": name, "mask_name": mask, "quantity": 1})
+        return "POST", "/purchase", None, {"user_name": self.rng.choice(self.users), "items": items}
+
+    def admin_cache(self):
+        return "GET", "/admin/cache", None, None
+
+    def admin_purchases(self):
+        return "GET", "/admin/purchases", None, None
+
+    def admin_slow_queries(self):
+        return "GET", "/admin/slow_queries", None, None
+
+    def admin_profiling(self):
+        return "GET", "/admin/profiling", None, None
+
+    def metrics(self):
+        return "GET", "/metrics", None, None
+
+
+# Endpoint name -> (default weight in the request mix, Workload builder)
+ENDPOINTS = {
+    "GET /": (1, Workload.root),
+    "GET /pharmacies/open": (15, Workload.open),
+    "GET /pharmacies/open_between": (5, Workload.open_between),
+    "GET /pharmacies/{pharmacy_name}/masks": (15, Workload.pharmacy_masks),
+    "GET /pharmacies/filter_by_mask_count_within_price_range": (8, Workload.filter_by_mask_count),
+    "GET /users/top": (8, Workload.top_users),
+    "GET /summary": (5, Workload.summary),
+    "GET /summary/pharmacies": (3, Workload.summary_pharmacies),
+    "GET /summary/masks": (3, Workload.summary_masks),
+    "GET /search": (20, Workload.search),
+    "POST /purchase": (15, Workload.purchase),
+    "GET /admin/cache": (1, Workload.admin_cache),
+    "GET /admin/purchases": (1, Workload.admin_purchases),
+    "GET /admin/slow_queries": (1, Workload.admin_slow_queries),
+    "GET /admin/profiling": (1, Workload.admin_profiling),
+    "GET /metrics": (1, Workload.metrics),
+}
+
+
+def parse_mix(spec: str) -> dict:
+    """
+    Parse 'GET /search=50,POST /purchase=10' into endpoint weights; endpoints left out keep their default weight
+    (use =0 to leave one out).
+    """
+    weights = {name: weight for name, (weight, _) in ENDPOINTS.items()}
+    for part in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, weight = part.rpartition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name!r}; choose from {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(ordered: list, pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def endpoint_stats(latencies: list, statuses: Counter, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "rps": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def drive(app, workload: Workload, weights: dict, concurrency: int, total: int, warmup: int) -> dict:
+    """
+    Send `warmup` untimed requests, then `total` requests drawn from the weighted mix from `concurrency`
+    concurrent clients, and collect latency and status codes per endpoint.
+    """
+    import httpx
+
+    names = [name for name, weight in weights.items() if weight > 0]
+    plan = workload.rng.choices(names, weights=[weights[name] for name in names], k=warmup + total)
+    requests = [(name, ENDPOINTS[name][1](workload)) for name in plan]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+
+    async def client_loop(client, queue, record):
+        for name, (method, path, params, body) in queue:
+            started = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body)
+            if record:
+                latencies[name].append(time.perf_counter() - started)
+                statuses[name][response.status_code] += 1
+
+    async def run(batch, record):
+        queue = iter(batch)
+        await asyncio.gather(*(client_loop(client, queue, record) for _ in range(concurrency)))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await run(requests[:warmup], record=False)
+        started = time.perf_counter()
+        await run(requests[warmup:], record=True)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "errors": sum(count for counter in statuses.values() for status, count in counter.items() if status >= 500),
+        "endpoints": {name: endpoint_stats(latencies[name], statuses[name], elapsed) for name in names if latencies[name]},
+    }
+
+
+def run_worker(args) -> dict:
+    """
+    Generate and load one dataset, then benchmark it at every concurrency level (runs inside the subprocess).
+    """
+    from app import datagen, etl
+
+    pharmacy_count, user_count, purchase_count = parse_size(args.sizes[0])
+    pharmacies_path, users_path = datagen.generate(
+        os.path.join(args.data_dir, "feeds"), pharmacy_count, user_count, purchase_count, args.seed,
+        START_DATE.isoformat(), DAYS
+    )
+    started = time.perf_counter()
+    etl.main(["--bulk", "--pharmacies", pharmacies_path, "--users", users_path])
+    load_seconds = time.perf_counter() - started
+
+    from app.main import app
+
+    async def run_all():
+        async with app.router.lifespan_context(app):
+            return [
+                await drive(app, Workload(pharmacies_path, users_path, args.seed + concurrency),
+                            parse_mix(args.mix), concurrency, args.requests, args.warmup)
+                for concurrency in args.concurrency
+            ]
+
+    return {
+        "size": args.sizes[0],
+        "pharmacies": pharmacy_count,
+        "users": user_count,
+        "purchases": purchase_count,
+        "load_seconds": round(load_seconds, 2),
+        "runs": asyncio.run(run_all()),
+    }
+
+
+def parse_size(size: str) -> tuple:
+    if size in SIZES:
+        return SIZES[size]
+    try:
+        pharmacy_count, user_count, purchase_count = (int(part) for part in size.split(":"))
+    except ValueError:
+        raise SystemExit(f"Unknown size {size!r}; use one of {', '.join(SIZES)} or PHARMACIES:USERS:PURCHASES")
+    return pharmacy_count, user_count, purchase_count
+
+
+def run_size(args, size: str, directory: str) -> dict:
+    """
+    Benchmark one dataset size in a subprocess with its own SQLite file.
+    """
+    data_dir = os.path.join(directory, size.replace(":", "_"))
+    os.makedirs(data_dir, exist_ok=True)
+    result_path = os.path.join(data_dir, "result.json")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(data_dir, 'bench.sqlite')}")
+    command = [
+        sys.executable, __file__, "--worker", "--sizes", size, "--data-dir", data_dir, "--result", result_path,
+        "--concurrency", *map(str, args.concurrency), "--requests", str(args.requests),
+        "--warmup", str(args.warmup), "--seed", str(args.seed), "--mix", args.mix or "",
+    ]
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(result_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare two benchmark reports and return one line per regression: an endpoint (or a whole run) whose
+    p95 latency grew, or whose throughput dropped, by more than threshold percent.
+    Sizes, concurrency levels and endpoints missing from the baseline are skipped.
+    """
+    regressions = []
+    baseline_runs = {
+        (result["size"], run["concurrency"]): run for result in baseline["results"] for run in result["runs"]
+    }
+    for result in current["results"]:
+        for run in result["runs"]:
+            base_run = baseline_runs.get((result["size"], run["concurrency"]))
+            if base_run is None:
+                continue
+            label = f"{result['size']} x{run['concurrency']}"
+            if run["rps"] < base_run["rps"] * (1 - threshold / 100):
+                regressions.append(f"{label} overall: {base_run['rps']} -> {run['rps']} req/s")
+            for name, stats in run["endpoints"].items():
+                base = base_run["endpoints"].get(name)
+                if base is None:
+                    continue
+                if stats["p95_ms"] > base["p95_ms"] * (1 + threshold / 100):
+                    regressions.append(f"{label} {name}: p95 {base['p95_ms']} -> {stats['p95_ms']} ms")
+                if stats["rps"] < base["rps"] * (1 - threshold / 100):
+                    regressions.append(f"{label} {name}: {base['rps']} -> {stats['rps']} req/s")
+    return regressions
+
+
+def print_report(report: dict):
+    for result in report["results"]:
+        for run in result["runs"]:
+            print(f"📦 {result['size']} ({result['pharmacies']} pharmacies, {result['purchases']} purchases) | "
+                  f"{run['concurrency']} clients | {run['rps']} req/s | {run['errors']} errors", file=sys.stderr)
+            for name, stats in run["endpoints"].items():
+                print(f"   {name:<58} {stats['rps']:>8} req/s | p50 {stats['p50_ms']:>8} | "
+                      f"p95 {stats['p95_ms']:>8} | p99 {stats['p99_ms']:>8} ms", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["small"], help=f"Dataset sizes: {', '.join(SIZES)} or P:U:N")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--requests", type=int, default=2000, help="Timed requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=200, help="Untimed requests before each timed run")
+    parser.add_argument("--mix", default="", help="Endpoint weights, e.g. 'GET /search=50,POST /purchase=0'")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", help="Report to compare against; exit 1 on regressions")
+    parser.add_argument("--compare", help="Compare this saved report against --baseline instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(args)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        parse_mix(args.mix)
+        with tempfile.TemporaryDirectory() as directory:
+            report = {
+                "settings": {"concurrency": args.concurrency, "requests": args.requests, "mix": parse_mix(args.mix),
+                             "seed": args.seed},
+                "results": [run_size(args, size, directory) for size in args.sizes],
+            }
+        print_report(report)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"❌ Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.threshold}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Sync vs async database layer benchmark.
+Drives the ASGI app in-process with N concurrent clients, once with the sync threadpool path
+and once with DB_ASYNC=1, and reports requests per second and p99 latency for each mode.
+Each mode runs in its own subprocess because DB_ASYNC is read at import time.
+
+Load data first (PYTHONPATH=. python app/etl.py --bulk), then run:
+PYTHONPATH=. python benchmarks/async_db.py --concurrency 50 200 --requests 4000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+REQUESTS = [
+    ("/pharmacies/open", {"weekday": "Mon", "time_str": "08:30"}),
+    ("/pharmacies/Carepoint/masks", {"sort_by": "price"}),
+    ("/search", {"query_name": "care", "search_type": "pharmacy"}),
+    ("/summary", {"start_date": "2021-01-01", "end_date": "2021-12-31"}),
+    ("/users/top", {"start_date": "2021-01-01", "end_date": "2021-12-31", "limit": 5}),
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(concurrency: int, total: int) -> dict:
+    """
+    Send `total` GET requests from `concurrency` concurrent clients and collect latencies.
+    """
+    import httpx
+    from app.main import app
+
+    latencies = []
+    counter = iter(range(total))
+
+    async def client_loop(client):
+        for i in counter:
+            path, params = REQUESTS[i % len(REQUESTS)]
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.text
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def run_mode(mode: str, concurrency: int, total: int) -> dict:
+    env = dict(os.environ, DB_ASYNC="1" if mode == "async" else "0")
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", "--concurrency", str(concurrency), "--requests", str(total)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return {"mode": mode, **json.loads(output.strip().splitlines()[-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(drive(args.concurrency[0], args.requests))))
+        return
+
+    results = []
+    for concurrency in args.concurrency:
+        for mode in ("sync", "async"):
+            result = run_mode(mode, concurrency, args.requests)
+            results.append(result)
+            print(f"{mode:>5} | {concurrency:>4} clients | {result['rps']:>8} req/s | "
+                  f"p50 {result['p50_ms']:>7} ms | p99 {result['p99_ms']:>7} ms")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+ETL transform stage benchmark.
+Measures transform throughput (records/s) with 1, 2, 4 and 8 worker processes on a synthetic feed.
+
+Run: PYTHONPATH=. python benchmarks/etl_transform.py --users 200000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+from app.etl import StageStats, chunked, transform_chunks, transform_pharmacy, transform_user
+
+OPENING_HOURS = [
+    "Mon - Fri 08:00 - 17:00",
+    "Mon, Wed, Fri 08:00 - 12:00 / Tue, Thur 14:00 - 18:00",
+    "Mon - Wed 08:00 - 17:00 / Thur, Sat 20:00 - 02:00",
+    "Fri - Sun 20:00 - 02:00",
+]
+
+
+def synthetic_feeds(pharmacy_count: int, user_count: int, purchases_per_user: int, seed: int = 0):
+    """
+    Build in-memory pharmacy and user feeds in the same shape as data/*.json.
+    """
+    rng = random.Random(seed)
+    masks = [f"Mask {i} ({size} per pack)" for i in range(50) for size in (3, 6, 10)]
+    pharmacies = [
+        {
+            "name": f"Pharmacy {i}",
+            "cashBalance": round(rng.uniform(100, 1000), 2),
+            "openingHours": rng.choice(OPENING_HOURS),
+            "masks": [{"name": name, "price": round(rng.uniform(3, 50), 2)} for name in rng.sample(masks, 5)],
+        }
+        for i in range(pharmacy_count)
+    ]
+    start = datetime(2021, 1, 1)
+    users = [
+        {
+            "name": f"User {i}",
+            "cashBalance": round(rng.uniform(10, 500), 2),
+            "purchaseHistories": [
+                {
+                    "pharmacyName": f"Pharmacy {rng.randrange(pharmacy_count)}",
+                    "maskName": rng.choice(masks),
+                    "transactionAmount": round(rng.uniform(3, 50), 2),
+                    "transactionDate": (start + timedelta(seconds=rng.randrange(180 * 86400))).strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                for _ in range(purchases_per_user)
+            ],
+        }
+        for i in range(user_count)
+    ]
+    return pharmacies, users
+
+
+def measure(entries: list, transform, workers: int, chunk_size: int) -> float:
+    """
+    Run the transform stage over entries and return records per second.
+    """
+    stats = StageStats()
+    started = time.perf_counter()
+    chunks = ((chunk, None) for chunk in chunked(entries, chunk_size))
+    records = sum(len(batch) for batch, _ in transform_chunks(chunks, transform, stats, workers))
+    return records / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pharmacies", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--purchases-per-user", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--fingerprints", action="store_true", help="Also fingerprint records (incremental mode)")
+    args = parser.parse_args()
+
+    pharmacies, users = synthetic_feeds(args.pharmacies, args.users, args.purchases_per_user)
+    results = []
+    for feed, entries, transform in (
+        ("pharmacies", pharmacies, partial(transform_pharmacy, fingerprints=args.fingerprints)),
+        ("users", users, partial(transform_user, fingerprints=args.fingerprints)),
+    ):
+        baseline = None
+        for workers in args.workers:
+            rate = measure(entries, transform, workers, args.chunk_size)
+            baseline = baseline or rate
+            results.append({"feed": feed, "workers": workers, "records_per_second": round(rate), "speedup": round(rate / baseline, 2)})
+            print(f"{feed:>10} | {workers} workers | {rate:>12,.0f} records/s | x{rate / baseline:.2f}")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Money representation micro-benchmark.
+Compares dollar floats with integer cents for in-process accumulation, for a plain SQLite SUM() over a
+REAL vs an INTEGER column, and for the aggregate queries behind GET /summary (date-range totals and per-pharmacy
+totals) and GET /users/top (per-user totals, highest first) run on a REAL and on an INTEGER copy of the same
+daily rollup table. It reports how far the float totals drift from the exact total.
+The dollar columns no longer exist in the app, so the endpoints themselves cannot be timed on both schemas;
+benchmarks/api.py times them on the current (cents) schema.
+
+Run: PYTHONPATH=. python benchmarks/money.py --rows 1000000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import time
+from decimal import Decimal
+
+from app.utils.money import from_cents
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, round((time.perf_counter() - started) * 1000, 3)
+
+
+def accumulate(values):
+    total = 0
+    for value in values:
+        total += value
+    return total
+
+
+def sqlite_sum(rows: list, column_type: str):
+    """
+    Load rows into an in-memory table with the given column type and time SUM() over it.
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE amounts (amount {column_type})")
+    conn.executemany("INSERT INTO amounts VALUES (?)", ((row,) for row in rows))
+    result = timed(lambda: conn.execute("SELECT SUM(amount) FROM amounts").fetchone()[0])
+    conn.close()
+    return result
+
+
+def rollup_queries(rows: list, column_type: str, scale):
+    """
+    Load (day, pharmacy_id, user_id, amount) rows into an in-memory rollup table with the given amount type
+    (amounts converted by `scale`) and time the /summary and /users/top query shapes over its whole date range.
+    Returns: ({query: result}, {query: ms})
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE spend (day INTEGER, pharmacy_id INTEGER, user_id INTEGER, amount {column_type})")
+    conn.executemany("INSERT INTO spend VALUES (?, ?, ?, ?)",
+                     ((day, pharmacy_id, user_id, scale(amount)) for day, pharmacy_id, user_id, amount in rows))
+    conn.execute("CREATE INDEX ix_spend_day ON spend (day)")
+    queries = {
+        "summary_total": "SELECT COALESCE(SUM(amount), 0) FROM spend WHERE day BETWEEN ? AND ?",
+        "summary_by_pharmacy": "SELECT pharmacy_id, SUM(amount) FROM spend WHERE day BETWEEN ? AND ? "
+                               "GROUP BY pharmacy_id ORDER BY SUM(amount) DESC",
+        "users_top": "SELECT user_id, SUM(amount) FROM spend WHERE day BETWEEN ? AND ? "
+                     "GROUP BY user_id ORDER BY SUM(amount) DESC LIMIT 10",
+    }
+    results = {}
+    timings = {}
+    for name, sql in queries.items():
+        results[name], timings[name] = timed(lambda: conn.execute(sql, (0, 366)).fetchall())
+    conn.close()
+    return results, timings
+
+
+def inexact_rows(float_rows: list, cents_rows: list) -> int:
+    """
+    Count the rows of a dollar-float result whose amount is not exactly the cents result for the same key
+    (rows ranked differently count too).
+    """
+    exact = {tuple(key): amount for *key, amount in cents_rows}
+    return sum(Decimal(repr(amount)) * 100 != exact.get(tuple(key)) for *key, amount in float_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cents = [rng.randint(1, 5000) for _ in range(args.rows)]
+    dollars = [value / 100 for value in cents]
+    exact = sum(Decimal(value) for value in cents) / 100
+
+    float_total, float_ms = timed(accumulate, dollars)
+    cents_total, cents_ms = timed(accumulate, cents)
+    sql_float_total, sql_float_ms = sqlite_sum(dollars, "FLOAT")
+    sql_cents_total, sql_cents_ms = sqlite_sum(cents, "INTEGER")
+    rollup = [(rng.randrange(366), rng.randrange(1000), rng.randrange(10000), value) for value in cents]
+    float_results, float_query_ms = rollup_queries(rollup, "FLOAT", lambda value: value / 100)
+    cents_results, cents_query_ms = rollup_queries(rollup, "INTEGER", lambda value: value)
+    inexact = {name: inexact_rows(float_results[name], cents_results[name]) for name in cents_results}
+
+    print(json.dumps({
+        "rows": args.rows,
+        "python_float_ms": float_ms,
+        "python_cents_ms": cents_ms,
+        "python_float_drift": float(Decimal(repr(float_total)) - exact),
+        "python_cents_drift": float(Decimal(cents_total) / 100 - exact),
+        "sqlite_float_ms": sql_float_ms,
+        "sqlite_cents_ms": sql_cents_ms,
+        "sqlite_float_drift": float(Decimal(repr(sql_float_total)) - exact),
+        "sqlite_cents_drift": float(Decimal(sql_cents_total) / 100 - exact),
+        "queries_float_ms": float_query_ms,
+        "queries_cents_ms": cents_query_ms,
+        "queries_float_inexact_rows": inexact,
+        "cents_total": from_cents(cents_total),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
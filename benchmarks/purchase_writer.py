@@ -0,0 +1,120 @@
+"""
+POST /purchase write path benchmark.
+Compares purchases per second and latency (p50/p99) of the per-request commit path against the
+single-writer queue with group commit, with the same number of concurrent clients on a fresh SQLite file
+using the configured pragmas (WAL, synchronous=NORMAL by default; set SQLITE_SYNCHRONOUS=FULL to pay an
+fsync on every commit).
+
+Run: PYTHONPATH=. python benchmarks/purchase_writer.py --purchases 4000 --concurrency 8 32
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.purchase import PurchaseRequest, PurchaseWriter, process_purchase
+from app.db import create_db_engine
+from app.models import create_schema, User, Pharmacy, Mask, PharmacyMask
+
+PHARMACIES = 20
+USERS = 200
+
+
+def build_database(path: str):
+    """
+    Create a SQLite database with PHARMACIES pharmacies selling one mask each and USERS wealthy users.
+    Returns: session factory
+    """
+    engine = create_db_engine(f"sqlite:///{path}", pool_size=64, max_overflow=0)
+    create_schema(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.execute(insert(Pharmacy), [{"name": f"Pharmacy {i}", "cash_balance_cents": 0} for i in range(PHARMACIES)])
+        session.execute(insert(Mask), [{"name": f"Mask {i}"} for i in range(PHARMACIES)])
+        session.execute(insert(PharmacyMask), [
+            {"pharmacy_id": i + 1, "mask_id": i + 1, "price_cents": 500 + i} for i in range(PHARMACIES)
+        ])
+        session.execute(insert(User), [{"name": f"User {i}", "cash_balance_cents": 10 ** 12} for i in range(USERS)])
+        session.commit()
+    return session_factory
+
+
+def make_orders(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(count):
+        pharmacy = rng.randrange(PHARMACIES)
+        orders.append(PurchaseRequest(user_name=f"User {rng.randrange(USERS)}", items=[
+            {"pharmacy_name": f"Pharmacy {pharmacy}", "mask_name": f"Mask {pharmacy}", "quantity": rng.randint(1, 3)}
+        ]))
+    return orders
+
+
+def run(purchase, orders: list, concurrency: int) -> dict:
+    """
+    Run purchase(order) for every order from `concurrency` threads and report throughput and latency.
+    """
+    def timed(order):
+        started = time.perf_counter()
+        purchase(order)
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, orders))
+    elapsed = time.perf_counter() - started
+    return {
+        "purchases_per_second": round(len(orders) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--purchases", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=int, default=2)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for concurrency in args.concurrency:
+            orders = make_orders(args.purchases, seed=concurrency)
+
+            session_factory = build_database(os.path.join(directory, f"per_request_{concurrency}.sqlite"))
+
+            def per_request(order):
+                with session_factory() as session:
+                    process_purchase(session, order)
+
+            per_request_result = run(per_request, orders, concurrency)
+
+            writer = PurchaseWriter(
+                build_database(os.path.join(directory, f"writer_{concurrency}.sqlite")),
+                args.batch_size, args.max_wait_ms
+            )
+            writer_result = run(lambda order: writer.submit(order).result(), orders, concurrency)
+            writer.stop()
+
+            results.append({
+                "concurrency": concurrency,
+                "purchases": args.purchases,
+                "per_request_commit": per_request_result,
+                "group_commit": {**writer_result, "orders_per_batch": round(writer.stats()["orders_per_batch"], 1)},
+                "speedup": round(writer_result["purchases_per_second"] / per_request_result["purchases_per_second"], 2),
+            })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
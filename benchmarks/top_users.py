@@ -0,0 +1,102 @@
+"""
+/users/top benchmark.
+Compares the GROUP BY over raw transactions with the in-memory spend index (cold load, new window,
+cached window) for "last N days" windows at 10k, 100k and 1M transactions, and checks that both
+paths return the same ranking.
+
+Run: PYTHONPATH=. python benchmarks/top_users.py --transactions 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.users import UserSpendIndex, rank_top_users
+from app.models import create_schema, User, Transaction
+from app.rollups import rebuild_user_daily_spend
+
+DAYS = 365
+WINDOWS = [7, 30, 90]
+
+
+def build_database(path: str, transactions: int, seed: int = 0):
+    """
+    Create a SQLite database with one user per 20 transactions spread over DAYS days.
+    Returns: (session, last day)
+    """
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    create_schema(engine)
+    session = sessionmaker(bind=engine)()
+
+    user_count = max(transactions // 20, 1)
+    start = datetime(2021, 1, 1)
+    session.execute(insert(User), [{"name": f"User {i}", "cash_balance_cents": 10000} for i in range(user_count)])
+    rows = [
+        {
+            "user_id": rng.randrange(user_count) + 1,
+            "pharmacy_id": 1,
+            "mask_id": 1,
+            "transaction_amount_cents": rng.randint(300, 5000),
+            "transaction_date": start + timedelta(seconds=rng.randrange(DAYS * 86400)),
+        }
+        for _ in range(transactions)
+    ]
+    for offset in range(0, len(rows), 50000):
+        session.execute(insert(Transaction), rows[offset:offset + 50000])
+    rebuild_user_daily_spend(session)
+    session.commit()
+    return session, (start + timedelta(days=DAYS - 1)).date()
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for transactions in args.transactions:
+            session, last_day = build_database(os.path.join(directory, f"top_users_{transactions}.sqlite"), transactions)
+            index = UserSpendIndex()
+            _, load_ms = timed(index.refresh, session)
+
+            for window in WINDOWS:
+                start_day = last_day - timedelta(days=window - 1)
+                start_date = datetime.combine(start_day, datetime.min.time())
+                end_date = datetime.combine(last_day, datetime.max.time()).replace(microsecond=0)
+
+                reference, query_ms = timed(rank_top_users, session, args.limit, start_date, end_date)
+                top, new_window_ms = timed(index.top, start_day, last_day, args.limit)
+                _, cached_window_ms = timed(index.top, start_day, last_day, args.limit)
+                ranking = [(user_id, amount_cents / 100) for user_id, amount_cents in top]
+
+                results.append({
+                    "transactions": transactions,
+                    "window_days": window,
+                    "group_by_ms": round(query_ms, 3),
+                    "index_load_ms": round(load_ms, 3),
+                    "index_new_window_ms": round(new_window_ms, 3),
+                    "index_cached_window_ms": round(cached_window_ms, 3),
+                    "same_ranking": ranking == [(row["user_id"], row["total_amount"]) for row in reference],
+                })
+            session.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
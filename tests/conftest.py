@@ -1,11 +1,13 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 
 from app.main import app
 from app.models import Base
 from app.api import pharmacies, users, purchase, summary, search
+from app.cache import response_cache, data_versions
+from app.metrics import install_query_hooks, metrics
 
 
 # Define a test-specific SQLite DB
@@ -17,6 +19,9 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 Base.metadata.drop_all(bind=engine)
 Base.metadata.create_all(bind=engine)
 
+# Attribute test database statements to the request being served (inactive while metrics are disabled)
+install_query_hooks(engine)
+
 # Override FastAPI dependency for all routers
 @pytest.fixture(scope="module")
 def client():
@@ -28,10 +33,77 @@ def client():
             db.close()
 
     app.dependency_overrides = {}
-    app.dependency_overrides[pharmacies.get_db] = override_get_db
-    app.dependency_overrides[users.get_db] = override_get_db
+    app.dependency_overrides[pharmacies.get_read_db] = override_get_db
+    app.dependency_overrides[users.get_read_db] = override_get_db
     app.dependency_overrides[purchase.get_db] = override_get_db
-    app.dependency_overrides[summary.get_db] = override_get_db
-    app.dependency_overrides[search.get_db] = override_get_db
+    app.dependency_overrides[summary.get_read_db] = override_get_db
+    app.dependency_overrides[search.get_read_db] = override_get_db
 
+    # Tests seed data directly instead of through versioned writes, so responses are not cached by default
+    routes = response_cache.routes
+    response_cache.routes = set()
     yield TestClient(app)
+    response_cache.routes = routes
+
+
+# Cache every route, starting from an empty cache and freshly read data versions
+@pytest.fixture
+def cache_enabled():
+    routes = response_cache.routes
+    response_cache.routes = {"*"}
+    response_cache.clear()
+    data_versions.invalidate()
+    yield response_cache
+    response_cache.routes = routes
+    response_cache.clear()
+
+
+# Enable request metrics, starting from an empty registry
+@pytest.fixture
+def metrics_enabled():
+    enabled = metrics.enabled
+    metrics.enabled = True
+    metrics.clear()
+    yield metrics
+    metrics.enabled = enabled
+    metrics.clear()
+
+
+# Count SQL statements sent to the test database
+@pytest.fixture
+def query_counter():
+    counter = {"count": 0}
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter["count"] += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+    yield counter
+    event.remove(engine, "before_cursor_execute", count_query)
+
+
+# Capture statements sent to the test database and explain them afterwards
+@pytest.fixture
+def query_plans():
+    statements = []
+
+    def capture_query(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    def explain():
+        """
+        Return (statement, [plan detail, ...]) for each captured statement.
+        """
+        raw = engine.raw_connection()
+        try:
+            return [
+                (statement, [row[3] for row in raw.cursor().execute("EXPLAIN QUERY PLAN " + statement, parameters)])
+                for statement, parameters in statements
+            ]
+        finally:
+            raw.close()
+
+    event.listen(engine, "before_cursor_execute", capture_query)
+    yield {"statements": statements, "explain": explain}
+    event.remove(engine, "before_cursor_execute", capture_query)
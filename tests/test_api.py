@@ -1,14 +1,18 @@
+import pytest
+
 from app.models import User, Pharmacy, Mask, PharmacyMask
 from app.api import pharmacies, purchase, summary, search, users
+from app.config import PAGE_SIZE_MAX
+from app.utils.pagination import encode_cursor
 
 def setup_test_data(db):
     """
     Create test user, pharmacy, mask, and their relationship for testing.
     """
-    user = User(name="TestUser", cash_balance=100.0)
-    pharmacy = Pharmacy(name="TestPharmacy", cash_balance=0.0)
+    user = User(name="TestUser", cash_balance_cents=10000)
+    pharmacy = Pharmacy(name="TestPharmacy", cash_balance_cents=0)
     mask = Mask(name="KF94")
-    pharmacy_mask = PharmacyMask(pharmacy=pharmacy, mask=mask, price=10.0)
+    pharmacy_mask = PharmacyMask(pharmacy=pharmacy, mask=mask, price_cents=1000)
 
     db.add_all([user, pharmacy, mask, pharmacy_mask])
     db.commit()
@@ -27,19 +31,19 @@ def _test_get_db_covered(get_db_func):
         pass
 
 def test_pharmacies_get_db():
-    _test_get_db_covered(pharmacies.get_db)
+    _test_get_db_covered(pharmacies.get_read_db)
 
 def test_purchase_get_db():
     _test_get_db_covered(purchase.get_db)
 
 def test_summary_get_db():
-    _test_get_db_covered(summary.get_db)
+    _test_get_db_covered(summary.get_read_db)
 
 def test_search_get_db():
-    _test_get_db_covered(search.get_db)
+    _test_get_db_covered(search.get_read_db)
 
 def test_users_get_db():
-    _test_get_db_covered(users.get_db)
+    _test_get_db_covered(users.get_read_db)
 
 
 def test_purchase_success(client):
@@ -70,10 +74,10 @@ def test_purchase_insufficient_funds(client):
     Test purchase flow when user has insufficient funds.
     """
     db = next(client.app.dependency_overrides[client.app.dependency_overrides.keys().__iter__().__next__()]())
-    user = User(name="LowFundsUser", cash_balance=5.0)
-    pharmacy = Pharmacy(name="CheapPharmacy", cash_balance=0.0)
+    user = User(name="LowFundsUser", cash_balance_cents=500)
+    pharmacy = Pharmacy(name="CheapPharmacy", cash_balance_cents=0)
     mask = Mask(name="KN95")
-    pharmacy_mask = PharmacyMask(pharmacy=pharmacy, mask=mask, price=20.0)
+    pharmacy_mask = PharmacyMask(pharmacy=pharmacy, mask=mask, price_cents=2000)
 
     db.add_all([user, pharmacy, mask, pharmacy_mask])
     db.commit()
@@ -112,8 +116,8 @@ def test_purchase_invalid_user(client):
 
 def test_purchase_invalid_mask(client):
     db = next(client.app.dependency_overrides[client.app.dependency_overrides.keys().__iter__().__next__()]())
-    user = User(name="User2", cash_balance=100.0)
-    pharmacy = Pharmacy(name="NoMaskPharmacy", cash_balance=0.0)
+    user = User(name="User2", cash_balance_cents=10000)
+    pharmacy = Pharmacy(name="NoMaskPharmacy", cash_balance_cents=0)
     db.add_all([user, pharmacy])
     db.commit()
 
@@ -203,6 +207,27 @@ def test_filter_by_mask_count_success(client):
     assert response.status_code == 200
     assert "data" in response.json()
 
+def test_filter_by_mask_count_price_bounds_do_not_widen(client):
+    """
+    Sub-cent bounds are rounded inwards: 4.995-4.995 excludes a 5.00 mask, as the float comparison did.
+    """
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Bound Pharmacy 0").first():
+        setup_catalog(db, "Bound", 1)
+
+    def total(min_price, max_price):
+        response = client.get("/pharmacies/filter_by_mask_count_within_price_range", params={
+            "min_price": min_price, "max_price": max_price, "count": 1, "comparison": "more", "include_total": True
+        })
+        assert response.status_code == 200
+        return int(response.headers["X-Total-Count"])
+
+    assert total(4.995, 4.995) == 0
+    assert total(5.005, 5.009) == 0
+    assert total(4.995, 5.005) >= 1
+    assert total(5, 5) >= 1
+
+
 def test_get_masks_by_pharmacy_name(client):
     response = client.get("/pharmacies/TestPharmacy/masks")
     assert response.status_code == 200
@@ -219,3 +244,860 @@ def test_get_masks_by_pharmacy_sorted_by_price(client):
     response = client.get("/pharmacies/TestPharmacy/masks", params={"sort_by": "price"})
     assert response.status_code == 200
     assert isinstance(response.json(), list)
+
+
+def setup_overnight_pharmacy(db):
+    """
+    Create a pharmacy open 'Mon 20:00 - 02:00' and 'Sun 23:00 - 01:00' and index its opening hours.
+    """
+    from datetime import time
+    from app.etl import rebuild_opening_intervals
+    from app.models import OpeningHour
+
+    pharmacy = db.query(Pharmacy).filter_by(name="NightOwl").first()
+    if not pharmacy:
+        pharmacy = Pharmacy(name="NightOwl", cash_balance_cents=0)
+        db.add_all([
+            pharmacy,
+            OpeningHour(pharmacy=pharmacy, day_of_week="Mon", start_time=time(20), end_time=time(2), is_overnight=True),
+            OpeningHour(pharmacy=pharmacy, day_of_week="Sun", start_time=time(23), end_time=time(1), is_overnight=True),
+        ])
+        db.flush()
+        rebuild_opening_intervals(db)
+        db.commit()
+    return pharmacy
+
+
+def open_names(client, path, **params):
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    return [pharmacy["pharmacy_name"] for pharmacy in response.json()]
+
+
+def test_open_pharmacies_overnight_spill(client):
+    db = next(client.app.dependency_overrides[pharmacies.get_read_db]())
+    setup_overnight_pharmacy(db)
+
+    assert "NightOwl" in open_names(client, "/pharmacies/open", weekday="Mon", time_str="20:00")
+    assert "NightOwl" in open_names(client, "/pharmacies/open", weekday="Tue", time_str="01:59")
+    assert "NightOwl" not in open_names(client, "/pharmacies/open", weekday="Tue", time_str="02:00")
+    assert "NightOwl" not in open_names(client, "/pharmacies/open", weekday="Mon", time_str="01:00")
+    assert "NightOwl" in open_names(client, "/pharmacies/open", weekday="Mon", time_str="00:30")
+
+
+def test_open_pharmacies_invalid_weekday(client):
+    response = client.get("/pharmacies/open", params={"weekday": "Funday", "time_str": "08:30"})
+    assert response.status_code == 400
+
+
+def test_pharmacies_open_between(client):
+    db = next(client.app.dependency_overrides[pharmacies.get_read_db]())
+    setup_overnight_pharmacy(db)
+
+    def names(start_weekday, start_time, end_weekday, end_time):
+        return open_names(client, "/pharmacies/open_between", start_weekday=start_weekday, start_time=start_time,
+                          end_weekday=end_weekday, end_time=end_time)
+
+    assert "NightOwl" in names("Mon", "10:00", "Mon", "20:00")
+    assert "NightOwl" not in names("Mon", "10:00", "Mon", "19:59")
+    assert "NightOwl" in names("Tue", "01:00", "Tue", "12:00")
+    assert "NightOwl" not in names("Tue", "02:00", "Sun", "22:59")
+    assert "NightOwl" in names("Sun", "22:00", "Sun", "23:00")
+    assert "NightOwl" in names("Sun", "23:59", "Mon", "00:10")
+
+
+def test_search_relevance_tiers_and_limit(client):
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    db.add_all([Pharmacy(name=name, cash_balance_cents=0) for name in ("Zephyr", "Zephyr Care", "Old Zephyr", "Zephir")])
+    db.commit()
+
+    response = client.get("/search", params={"query_name": "zephyr", "search_type": "pharmacy"})
+    scores = {item["pharmacy_name"]: item["relevanceScore"] for item in response.json()["data"]}
+    assert scores["Zephyr"] == 1.0
+    assert scores["Zephyr Care"] == 0.9
+    assert scores["Old Zephyr"] == 0.7
+    assert 0.3 < scores["Zephir"] < 1.0
+
+    response = client.get("/search", params={"query_name": "zephyr", "search_type": "pharmacy", "limit": 2})
+    assert [item["pharmacy_name"] for item in response.json()["data"]] == ["Zephyr", "Zephyr Care"]
+
+
+def test_search_index_tracks_catalog_changes(client):
+    response = client.get("/search", params={"query_name": "Quokka", "search_type": "mask"})
+    assert response.json()["data"] == []
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    pharmacy = Pharmacy(name="QuokkaPharmacy", cash_balance_cents=0)
+    db.add_all([pharmacy, PharmacyMask(pharmacy=pharmacy, mask=Mask(name="Quokka Shield"), price_cents=300)])
+    db.commit()
+
+    response = client.get("/search", params={"query_name": "Quokka", "search_type": "mask"})
+    assert [item["mask_name"] for item in response.json()["data"]] == ["Quokka Shield"]
+    assert response.json()["data"][0]["pharmacy"]["pharmacy_name"] == "QuokkaPharmacy"
+
+
+def setup_catalog(db, prefix, size):
+    """
+    Create `size` pharmacies, each with opening hours and two masks, named with a common prefix.
+    """
+    from datetime import time
+    from app.models import OpeningHour
+
+    for i in range(size):
+        pharmacy = Pharmacy(name=f"{prefix} Pharmacy {i}", cash_balance_cents=0)
+        db.add_all([
+            pharmacy,
+            OpeningHour(pharmacy=pharmacy, day_of_week="Mon", start_time=time(8), end_time=time(17), is_overnight=False),
+            PharmacyMask(pharmacy=pharmacy, mask=Mask(name=f"{prefix} Mask {i} A"), price_cents=500),
+            PharmacyMask(pharmacy=pharmacy, mask=Mask(name=f"{prefix} Mask {i} B"), price_cents=5000),
+        ])
+    db.commit()
+
+
+@pytest.mark.parametrize("path, params, ceiling", [
+    ("/search", {"query_name": "Ceiling", "search_type": "pharmacy"}, 4),
+    ("/search", {"query_name": "Ceiling", "search_type": "mask"}, 3),
+    ("/pharmacies/filter_by_mask_count_within_price_range",
+     {"min_price": 0, "max_price": 100, "count": 0, "comparison": "more"}, 3),
+    ("/pharmacies/Ceiling Pharmacy 0/masks", {}, 2),
+])
+def test_query_count_is_independent_of_result_size(client, query_counter, path, params, ceiling):
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Ceiling Pharmacy 0").first():
+        setup_catalog(db, "Ceiling", 12)
+
+    client.get(path, params=params)  # Warm up the search index
+    query_counter["count"] = 0
+    response = client.get(path, params=params)
+
+    assert response.status_code == 200
+    assert query_counter["count"] <= ceiling
+
+
+def test_purchase_updates_sales_rollup(client):
+    """
+    A purchase is reflected in /summary and in the per-pharmacy and per-mask breakdowns.
+    """
+    from datetime import datetime, timezone
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Rollup Pharmacy 0").first():
+        setup_catalog(db, "Rollup", 1)
+        db.add(User(name="RollupUser", cash_balance_cents=100000))
+        db.commit()
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    params = {"start_date": today, "end_date": today}
+    before = client.get("/summary", params=params).json()
+
+    response = client.post("/purchase", json={"user_name": "RollupUser", "items": [
+        {"pharmacy_name": "Rollup Pharmacy 0", "mask_name": "Rollup Mask 0 A", "quantity": 3},
+        {"pharmacy_name": "Rollup Pharmacy 0", "mask_name": "Rollup Mask 0 B", "quantity": 1},
+    ]})
+    assert response.status_code == 200
+
+    after = client.get("/summary", params=params).json()
+    assert after["total_transactions"] == before["total_transactions"] + 2
+    assert after["total_masks_sold"] == before["total_masks_sold"] + 4
+    assert after["total_value"] == round(before["total_value"] + 65.0, 2)
+
+    by_pharmacy = client.get("/summary/pharmacies", params=params).json()
+    rollup_pharmacy = next(row for row in by_pharmacy if row["pharmacy_name"] == "Rollup Pharmacy 0")
+    assert rollup_pharmacy["total_masks_sold"] == 4
+    assert rollup_pharmacy["total_value"] == 65.0
+
+    by_mask = {row["mask_name"]: row for row in client.get("/summary/masks", params=params).json()}
+    assert by_mask["Rollup Mask 0 A"]["total_masks_sold"] == 3
+    assert by_mask["Rollup Mask 0 B"]["total_value"] == 50.0
+
+    assert client.get("/summary/masks", params={"start_date": "bad", "end_date": today}).status_code == 400
+
+    db.expire_all()
+    user = db.query(User).filter_by(name="RollupUser").first()
+    purchases = sorted((t.quantity, t.unit_price_cents, t.transaction_amount_cents) for t in user.transactions)[-2:]
+    assert purchases == [(1, 5000, 5000), (3, 500, 1500)]
+
+
+def test_top_users_reflects_new_purchases(client):
+    """
+    The spend index picks up a purchase made after it was loaded and matches the raw GROUP BY.
+    """
+    from datetime import datetime, timezone
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Spender Pharmacy 0").first():
+        setup_catalog(db, "Spender", 1)
+        db.add(User(name="BigSpender", cash_balance_cents=10000000))
+        db.commit()
+
+    today = datetime.now(timezone.utc)
+    params = {"start_date": today.strftime("%Y-%m-%d"), "end_date": today.strftime("%Y-%m-%d"), "limit": 3}
+    client.get("/users/top", params=params)  # Load the spend index before the purchase
+
+    response = client.post("/purchase", json={"user_name": "BigSpender", "items": [
+        {"pharmacy_name": "Spender Pharmacy 0", "mask_name": "Spender Mask 0 B", "quantity": 1000}
+    ]})
+    assert response.status_code == 200
+
+    response = client.get("/users/top", params=params)
+    assert response.status_code == 200
+    top_users = response.json()
+    assert top_users[0]["user_name"] == "BigSpender"
+
+    start = today.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    end = today.replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=None)
+    assert top_users == users.rank_top_users(db, 3, start, end)
+
+
+def table_scans(plans):
+    """
+    Return the (table, statement) pairs whose query plan scans a whole table instead of searching an index.
+    Scans of subqueries and constant rows are not table scans; aliases like masks_1 map to their table.
+    """
+    import re
+    from app.models import Base
+
+    scans = []
+    for statement, details in plans:
+        for detail in details:
+            match = re.match(r"SCAN (\w+)", detail)
+            if match and re.sub(r"_\d+$", "", match.group(1)) in Base.metadata.tables:
+                scans.append((match.group(1), statement))
+    return scans
+
+
+@pytest.mark.parametrize("method, path, kwargs", [
+    ("get", "/pharmacies/open", {"params": {"weekday": "Mon", "time": "10:00"}}),
+    ("get", "/pharmacies/open_between",
+     {"params": {"start_weekday": "Mon", "start_time": "10:00", "end_weekday": "Tue", "end_time": "10:00"}}),
+    ("get", "/pharmacies/Ceiling Pharmacy 0/masks", {"params": {"sort_by": "price"}}),
+    ("get", "/pharmacies/filter_by_mask_count_within_price_range",
+     {"params": {"min_price": 0, "max_price": 10, "count": 0, "comparison": "more"}}),
+    ("get", "/search", {"params": {"query_name": "Ceiling", "search_type": "pharmacy"}}),
+    ("get", "/search", {"params": {"query_name": "Ceiling", "search_type": "mask"}}),
+    ("get", "/summary", {"params": {"start_date": "2021-01-01", "end_date": "2021-01-31"}}),
+    ("get", "/summary/pharmacies", {"params": {"start_date": "2021-01-01", "end_date": "2021-01-31"}}),
+    ("get", "/summary/masks", {"params": {"start_date": "2021-01-01", "end_date": "2021-01-31"}}),
+    ("get", "/users/top", {"params": {"start_date": "2021-01-01", "end_date": "2021-01-31"}}),
+    ("get", "/pharmacies/open",
+     {"params": {"weekday": "Mon", "time": "10:00", "limit": 2, "cursor": encode_cursor([3]), "include_total": True}}),
+    ("get", "/pharmacies/Ceiling Pharmacy 0/masks",
+     {"params": {"limit": 1, "cursor": encode_cursor(["Ceiling Mask 0 A", 1]), "include_total": True}}),
+    ("get", "/pharmacies/filter_by_mask_count_within_price_range",
+     {"params": {"min_price": 0, "max_price": 10, "count": 0, "comparison": "more", "limit": 2,
+                 "cursor": encode_cursor([3]), "include_total": True}}),
+    ("post", "/purchase", {"json": {"user_name": "PlanUser", "items": [
+        {"pharmacy_name": "Ceiling Pharmacy 0", "mask_name": "Ceiling Mask 0 A", "quantity": 1}]}}),
+])
+def test_hot_queries_use_indexes(client, query_plans, method, path, kwargs):
+    """
+    Every statement an endpoint issues must be served by an index, never a full table scan.
+    """
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Ceiling Pharmacy 0").first():
+        setup_catalog(db, "Ceiling", 12)
+    if not db.query(User).filter_by(name="PlanUser").first():
+        db.add(User(name="PlanUser", cash_balance_cents=100000))
+        db.commit()
+
+    # Warm up the in-memory search and spend indexes, whose full loads scan their tables by design
+    client.get("/search", params={"query_name": "Ceiling", "search_type": "mask"})
+    client.get("/users/top", params={"start_date": "2021-01-01", "end_date": "2021-01-31"})
+    query_plans["statements"].clear()
+    response = getattr(client, method)(path, **kwargs)
+
+    assert response.status_code == 200
+    assert query_plans["statements"]
+    assert table_scans(query_plans["explain"]()) == []
+
+
+def test_run_db_with_async_session():
+    """
+    Route logic runs unchanged on an AsyncSession (the DB_ASYNC=1 path).
+    """
+    import asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.db import run_db
+
+    async def query():
+        async_engine = create_async_engine("sqlite+aiosqlite:///test_db.sqlite")
+        try:
+            async with async_sessionmaker(bind=async_engine)() as db:
+                return await run_db(db, search.search_catalog, "Test", "pharmacy", 10, None, False)
+        finally:
+            await async_engine.dispose()
+
+    result = asyncio.run(query())
+    assert "TestPharmacy" in [item["pharmacy_name"] for item in result.body["data"]]
+
+
+def test_response_cache_hits_until_a_write_bumps_the_version(client, cache_enabled, query_counter):
+    """
+    Repeated reads are served from the cache without queries; a purchase makes the next read fresh.
+    """
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Cache Pharmacy 0").first():
+        setup_catalog(db, "Cache", 1)
+        db.add(User(name="CacheUser", cash_balance_cents=100000))
+        db.commit()
+
+    params = {"start_date": "2000-01-01", "end_date": "2100-01-01"}
+    first = client.get("/summary", params=params).json()
+    query_counter["count"] = 0
+    assert client.get("/summary", params=params).json() == first
+    assert query_counter["count"] == 0
+
+    response = client.post("/purchase", json={"user_name": "CacheUser", "items": [
+        {"pharmacy_name": "Cache Pharmacy 0", "mask_name": "Cache Mask 0 A", "quantity": 2}
+    ]})
+    assert response.status_code == 200
+
+    after = client.get("/summary", params=params).json()
+    assert after["total_transactions"] == first["total_transactions"] + 1
+
+    stats = client.get("/admin/cache").json()
+    assert stats["by_route"]["summary"] == {"hits": 1, "misses": 2}
+
+
+def test_response_cache_per_route_toggle_and_catalog_bump(client, cache_enabled):
+    """
+    Only enabled routes are cached, and bumping the catalog version invalidates catalog reads.
+    """
+    from app.cache import bump_versions, data_versions, CATALOG
+
+    cache_enabled.routes = {"search"}
+    params = {"query_name": "Zephyr", "search_type": "pharmacy"}
+    for _ in range(2):
+        client.get("/search", params=params)
+        client.get("/summary", params={"start_date": "2000-01-01", "end_date": "2100-01-01"})
+    assert cache_enabled.stats()["by_route"] == {"search": {"hits": 1, "misses": 1}}
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    bump_versions(db, CATALOG)
+    db.commit()
+    data_versions.invalidate()
+    client.get("/search", params=params)
+    assert cache_enabled.stats()["by_route"]["search"] == {"hits": 1, "misses": 2}
+
+
+def test_response_cache_ttl_and_lru_eviction(monkeypatch):
+    from app import cache
+
+    clock = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+    response_cache = cache.ResponseCache(routes="*", ttl=10, max_entries=2)
+
+    response_cache.set("a", 1)
+    response_cache.set("b", 2)
+    assert response_cache.get("r", "a") == (True, 1)
+    response_cache.set("c", 3)  # Evicts "b", the least recently used
+    assert response_cache.get("r", "b") == (False, None)
+    clock[0] += 11
+    assert response_cache.get("r", "a") == (False, None)
+    assert response_cache.stats()["entries"] == 1
+
+
+def test_etag_not_modified_without_queries_and_changed_by_purchase(client, query_counter):
+    """
+    A matching If-None-Match is answered with 304 before any query; a purchase changes the sales ETags.
+    """
+    from app.cache import data_versions
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Etag Pharmacy 0").first():
+        setup_catalog(db, "Etag", 1)
+        db.add(User(name="EtagUser", cash_balance_cents=100000))
+        db.commit()
+    data_versions.invalidate()
+
+    params = {"start_date": "2000-01-01", "end_date": "2100-01-01"}
+    summary_etag = client.get("/summary", params=params).headers["ETag"]
+    top_etag = client.get("/users/top", params=params).headers["ETag"]
+    assert summary_etag.startswith('"summary-') and top_etag.startswith('"users_top-')
+
+    query_counter["count"] = 0
+    response = client.get("/summary", params=params, headers={"If-None-Match": summary_etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == summary_etag
+    assert query_counter["count"] == 0
+    assert client.get("/summary", params=params, headers={"If-None-Match": '"other"'}).status_code == 200
+
+    response = client.post("/purchase", json={"user_name": "EtagUser", "items": [
+        {"pharmacy_name": "Etag Pharmacy 0", "mask_name": "Etag Mask 0 A", "quantity": 1}
+    ]})
+    assert response.status_code == 200
+
+    response = client.get("/summary", params=params, headers={"If-None-Match": summary_etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != summary_etag
+    assert client.get("/users/top", params=params).headers["ETag"] != top_etag
+
+
+def test_etag_matching():
+    from app.cache import make_etag, etag_matches
+
+    etag = make_etag("summary_masks", (3, 7))
+    assert etag == '"summary_masks-3.7"'
+    assert etag_matches('"a", ' + etag, etag)
+    assert etag_matches("W/" + etag, etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"summary_masks-3.8"', etag)
+
+
+def test_purchase_query_count_is_independent_of_cart_size(client, query_counter):
+    """
+    Items are resolved with IN-list queries and each pharmacy is credited once, whatever the cart size.
+    """
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Cart Pharmacy 0").first():
+        setup_catalog(db, "Cart", 10)
+        db.add(User(name="CartUser", cash_balance_cents=10_000_000))
+        db.commit()
+
+    def purchase(items):
+        query_counter["count"] = 0
+        response = client.post("/purchase", json={"user_name": "CartUser", "items": items})
+        assert response.status_code == 200
+        return query_counter["count"]
+
+    small = purchase([{"pharmacy_name": "Cart Pharmacy 0", "mask_name": "Cart Mask 0 A", "quantity": 1}])
+    large = purchase([
+        {"pharmacy_name": f"Cart Pharmacy {i}", "mask_name": f"Cart Mask {i} {kind}", "quantity": 2}
+        for i in range(10) for kind in "AB"
+    ])
+    assert large == small
+
+    db.expire_all()
+    pharmacy = db.query(Pharmacy).filter_by(name="Cart Pharmacy 3").one()
+    assert pharmacy.cash_balance_cents == 2 * 500 + 2 * 5000
+
+
+def test_purchase_reports_the_first_invalid_item(client):
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Cart Pharmacy 0").first():
+        setup_catalog(db, "Cart", 10)
+        db.add(User(name="CartUser", cash_balance_cents=10_000_000))
+        db.commit()
+
+    def error(items):
+        response = client.post("/purchase", json={"user_name": "CartUser", "items": items})
+        assert response.status_code == 404
+        return response.json()["error"]
+
+    valid = {"pharmacy_name": "Cart Pharmacy 0", "mask_name": "Cart Mask 0 A", "quantity": 1}
+    assert error([valid, {"pharmacy_name": "Cart Pharmacy 1", "mask_name": "Cart Mask 0 A", "quantity": 1},
+                  {"pharmacy_name": "Nowhere", "mask_name": "Cart Mask 0 A", "quantity": 1}]) \
+        == "Mask 'Cart Mask 0 A' not sold by 'Cart Pharmacy 1'"
+    assert error([valid, {"pharmacy_name": "Nowhere", "mask_name": "Nothing", "quantity": 1}]) \
+        == "Pharmacy 'Nowhere' not found"
+    assert error([valid, {"pharmacy_name": "Cart Pharmacy 0", "mask_name": "Nothing", "quantity": 1}]) \
+        == "Mask 'Nothing' not found"
+
+
+def test_empty_purchase_writes_nothing(client):
+    """
+    An empty cart succeeds without touching the balance, the spend rollup or the data versions.
+    """
+    from sqlalchemy import select
+    from app.models import DataVersion, UserDailySpend
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    user = db.query(User).filter_by(name="EmptyCartUser").first()
+    if not user:
+        user = User(name="EmptyCartUser", cash_balance_cents=1000)
+        db.add(user)
+        db.commit()
+
+    versions = dict(db.execute(select(DataVersion.scope, DataVersion.version)).all())
+    response = client.post("/purchase", json={"user_name": "EmptyCartUser", "items": []})
+    assert response.status_code == 200 and response.json()["total_amount"] == 0
+
+    db.expire_all()
+    assert db.query(User).filter_by(name="EmptyCartUser").one().cash_balance_cents == 1000
+    assert db.query(UserDailySpend).filter_by(user_id=user.id).count() == 0
+    assert dict(db.execute(select(DataVersion.scope, DataVersion.version)).all()) == versions
+
+
+def test_concurrent_purchases_conserve_money(tmp_path):
+    """
+    Thousands of purchases from many threads neither overdraw a wallet nor lose a pharmacy credit.
+    """
+    import random
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi import HTTPException
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from app.db import create_db_engine
+    from app.models import Transaction, create_schema
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'stress.sqlite'}", pool_size=8, max_overflow=0)
+    create_schema(engine)
+    StressSession = sessionmaker(bind=engine)
+    with StressSession() as db:
+        setup_catalog(db, "Stress", 4)
+        db.add_all([User(name=f"Stress User {i}", cash_balance_cents=2_000_000) for i in range(8)])
+        db.commit()
+
+    def total_money(db):
+        return db.scalar(select(func.sum(User.cash_balance_cents))) + db.scalar(select(func.sum(Pharmacy.cash_balance_cents)))
+
+    def buy(seed):
+        rng = random.Random(seed)
+        data = purchase.PurchaseRequest(user_name=f"Stress User {seed % 8}", items=[
+            {"pharmacy_name": f"Stress Pharmacy {p}", "mask_name": f"Stress Mask {p} {rng.choice('AB')}",
+             "quantity": rng.randint(1, 3)}
+            for p in rng.sample(range(4), rng.randint(1, 3))
+        ])
+        with StressSession() as db:
+            try:
+                purchase.process_purchase(db, data)
+                return 200
+            except HTTPException as e:
+                return e.status_code
+
+    with StressSession() as db:
+        money_before = total_money(db)
+    stats_before = purchase.purchase_stats.stats()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(buy, range(2000)))
+    elapsed = time.perf_counter() - started
+
+    stats = purchase.purchase_stats.stats()
+    retries = stats["retries"] - stats_before["retries"]
+    print(f"\n2000 purchases in {elapsed:.2f}s ({2000 / elapsed:,.0f}/s), "
+          f"{statuses.count(200)} completed, {statuses.count(400)} declined, {retries} retries")
+
+    assert set(statuses) <= {200, 400}
+    assert statuses.count(400) > 0  # Wallets run dry, so the balance check is exercised under contention
+    with StressSession() as db:
+        assert total_money(db) == money_before
+        assert db.scalar(select(func.min(User.cash_balance_cents))) >= 0
+        spent = db.scalar(select(func.sum(Transaction.transaction_amount_cents)))
+        assert spent == db.scalar(select(func.sum(Pharmacy.cash_balance_cents)))
+    engine.dispose()
+
+
+def test_purchase_retries_write_conflicts(client, monkeypatch):
+    import sqlite3
+    from sqlalchemy.exc import OperationalError
+
+    busy = sqlite3.OperationalError("database is locked")
+    busy.sqlite_errorcode = sqlite3.SQLITE_BUSY
+    calls = []
+
+    def flaky_apply(db, data):
+        calls.append(data)
+        if len(calls) < 3:
+            raise OperationalError("UPDATE users ...", {}, busy)
+        return {"message": "ok"}
+
+    monkeypatch.setattr(purchase, "apply_purchase", flaky_apply)
+    monkeypatch.setattr(purchase, "PURCHASE_RETRY_BACKOFF_MS", 0)
+    before = client.get("/admin/purchases").json()
+    assert client.post("/purchase", json={"user_name": "x", "items": []}).json() == {"message": "ok"}
+    after = client.get("/admin/purchases").json()
+    assert len(calls) == 3 and after["retries"] - before["retries"] == 2
+
+    calls.clear()
+    monkeypatch.setattr(purchase, "PURCHASE_RETRIES", 1)
+    response = client.post("/purchase", json={"user_name": "x", "items": []})
+    assert response.status_code == 500 and len(calls) == 2
+
+
+def test_purchase_writer_group_commits_with_per_order_results(client, monkeypatch):
+    """
+    The single writer applies queued purchases in shared transactions and answers each one on its own.
+    """
+    from fastapi import HTTPException
+    from tests.conftest import TestingSessionLocal
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Writer Pharmacy 0").first():
+        setup_catalog(db, "Writer", 2)
+        db.add(User(name="WriterUser", cash_balance_cents=3000))
+        db.commit()
+
+    writer = purchase.PurchaseWriter(TestingSessionLocal, batch_size=8, max_wait_ms=200)
+    item = {"pharmacy_name": "Writer Pharmacy 1", "mask_name": "Writer Mask 1 A", "quantity": 1}
+    orders = [
+        purchase.PurchaseRequest(user_name="WriterUser", items=[item]),
+        purchase.PurchaseRequest(user_name="Nobody", items=[item]),
+        purchase.PurchaseRequest(user_name="WriterUser", items=[{**item, "quantity": 6}]),
+        purchase.PurchaseRequest(user_name="WriterUser", items=[{**item, "quantity": 2}]),
+    ]
+    futures = [writer.submit(order) for order in orders]
+    writer.stop()
+
+    assert futures[0].result()["total_amount"] == 5.0
+    assert isinstance(futures[1].exception(), HTTPException) and futures[1].exception().status_code == 404
+    assert futures[2].exception().detail == "Insufficient balance"  # 2500 left after the first order
+    assert futures[3].result()["total_amount"] == 10.0
+    assert writer.stats()["batches"] == 1 and writer.stats()["orders"] == 4
+
+    db.expire_all()
+    assert db.query(User).filter_by(name="WriterUser").one().cash_balance_cents == 1500
+    assert db.query(Pharmacy).filter_by(name="Writer Pharmacy 1").one().cash_balance_cents == 1500
+
+    monkeypatch.setattr(purchase, "purchase_writer", purchase.PurchaseWriter(TestingSessionLocal, max_wait_ms=0))
+    response = client.post("/purchase", json={"user_name": "WriterUser", "items": [item]})
+    assert response.status_code == 200 and response.json()["total_amount"] == 5.0
+    assert client.get("/admin/purchases").json()["writer"]["orders"] == 1
+    purchase.purchase_writer.stop()
+
+
+def test_purchase_route_takes_no_session_with_the_writer():
+    from app.db import get_db
+
+    assert purchase.purchase_db_dependency(True)() is None
+    assert purchase.purchase_db_dependency(False) is get_db
+
+
+def test_purchase_writer_survives_cancelled_callers(client):
+    """
+    Cancelling a caller mid-batch neither kills the writer thread nor fails the other purchases.
+    """
+    import asyncio
+    from tests.conftest import TestingSessionLocal
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Cancel Pharmacy 0").first():
+        setup_catalog(db, "Cancel", 1)
+        db.add(User(name="CancelUser", cash_balance_cents=100000))
+        db.commit()
+
+    writer = purchase.PurchaseWriter(TestingSessionLocal, batch_size=8, max_wait_ms=100)
+    order = purchase.PurchaseRequest(user_name="CancelUser", items=[
+        {"pharmacy_name": "Cancel Pharmacy 0", "mask_name": "Cancel Mask 0 A", "quantity": 1}
+    ])
+
+    async def scenario():
+        callers = [asyncio.ensure_future(writer.purchase(order)) for _ in range(4)]
+        await asyncio.sleep(0)
+        callers[1].cancel()
+        results = await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 5)
+        return results, await asyncio.wait_for(writer.purchase(order), 5)
+
+    results, after = asyncio.run(scenario())
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert [result["total_amount"] for i, result in enumerate(results) if i != 1] == [5.0] * 3
+    assert after["total_amount"] == 5.0
+    assert writer.thread.is_alive()
+    writer.stop()
+
+
+def walk_pages(client, path, params, limit):
+    """
+    Follow X-Next-Cursor from the first page to the last and return the pages' bodies.
+    """
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(path, params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("path, params, items", [
+    ("/pharmacies/open", {"weekday": "Mon", "time_str": "10:00"}, lambda body: body),
+    ("/pharmacies/open_between",
+     {"start_weekday": "Sun", "start_time": "12:00", "end_weekday": "Mon", "end_time": "09:00"}, lambda body: body),
+    ("/pharmacies/Page Pharmacy 0/masks", {"sort_by": "name"}, lambda body: body),
+    ("/pharmacies/Page Pharmacy 0/masks", {"sort_by": "price"}, lambda body: body),
+    ("/pharmacies/filter_by_mask_count_within_price_range",
+     {"min_price": 0, "max_price": 100, "count": 1, "comparison": "more"}, lambda body: body["data"]),
+    ("/search", {"query_name": "Page", "search_type": "pharmacy"}, lambda body: body["data"]),
+    ("/search", {"query_name": "Page", "search_type": "mask"}, lambda body: body["data"]),
+    ("/users/top", {"start_date": "2000-01-01", "end_date": "2100-01-01"}, lambda body: body),
+])
+def test_keyset_pages_cover_the_full_list(client, path, params, items):
+    """
+    Walking the pages with their cursors returns the full list once, in order, and the opt-in total matches it.
+    """
+    from app.etl import rebuild_opening_intervals
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Page Pharmacy 0").first():
+        setup_catalog(db, "Page", 7)
+        pharmacy = db.query(Pharmacy).filter_by(name="Page Pharmacy 0").one()
+        db.add_all([PharmacyMask(pharmacy=pharmacy, mask=Mask(name=f"Page Mask 0 {kind}"), price_cents=500)
+                    for kind in "CDE"])
+        db.add_all([User(name=f"Page User {i}", cash_balance_cents=100000) for i in range(5)])
+        rebuild_opening_intervals(db)
+        db.commit()
+        for i in range(5):
+            client.post("/purchase", json={"user_name": f"Page User {i}", "items": [
+                {"pharmacy_name": "Page Pharmacy 0", "mask_name": "Page Mask 0 A", "quantity": 1 + i % 2}
+            ]})
+
+    limit = 100 if path == "/users/top" else PAGE_SIZE_MAX
+    full = client.get(path, params={**params, "limit": limit, "include_total": True})
+    expected = items(full.json())
+    assert len(expected) > 2 and "X-Next-Cursor" not in full.headers
+    assert int(full.headers["X-Total-Count"]) == len(expected)
+
+    paged = [item for page in walk_pages(client, path, params, 2) for item in items(page)]
+    assert paged == expected
+
+
+def test_invalid_cursor_is_rejected(client):
+    for cursor in ["not base64!", encode_cursor(["x"]), encode_cursor([1, 2])]:
+        response = client.get("/pharmacies/open", params={"weekday": "Mon", "time_str": "10:00", "cursor": cursor})
+        assert response.status_code == 400
+        assert response.json() == {"error": "Invalid cursor"}
+    response = client.get("/search", params={"query_name": "Page", "search_type": "mask", "limit": PAGE_SIZE_MAX + 1})
+    assert response.status_code == 422
+
+
+def test_metrics_count_queries_per_request(client, query_counter, metrics_enabled):
+    """
+    Each response reports its statements and DB time; /metrics aggregates them per route template.
+    """
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Metrics Pharmacy 0").first():
+        setup_catalog(db, "Metrics", 1)
+
+    query_counter["count"] = 0
+    response = client.get("/pharmacies/Metrics Pharmacy 0/masks")
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Queries"]) == query_counter["count"] > 0
+    assert float(response.headers["X-DB-Time-ms"]) > 0
+    assert client.get("/pharmacies/Metrics Pharmacy 1/masks").status_code == 404
+
+    text = client.get("/metrics").text
+    route = 'method="GET",route="/pharmacies/{pharmacy_name}/masks"'
+    assert f'http_requests_total{{{route},status="200"}} 1' in text
+    assert f'http_requests_total{{{route},status="404"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{route},le="+Inf"}} 2' in text
+    assert f'http_request_duration_seconds_count{{{route}}} 2' in text
+    assert f"db_queries_total{{{route}}} " in text
+
+    metrics_enabled.enabled = False
+    response = client.get("/pharmacies/Metrics Pharmacy 0/masks")
+    assert "X-DB-Queries" not in response.headers
+    assert f'http_requests_total{{{route},status="200"}} 1' in client.get("/metrics").text
+
+
+def test_slow_query_log_records_route_and_plan(client, monkeypatch):
+    """
+    Statements over the threshold are logged with their normalized SQL, parameter types, route and query plan,
+    but without parameter values.
+    """
+    from app.metrics import slow_query_log, normalize_sql
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Slow Pharmacy 0").first():
+        setup_catalog(db, "Slow", 1)
+
+    slow_query_log.clear()
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 1e-6)
+    assert client.get("/pharmacies/Slow Pharmacy 0/masks", params={"sort_by": "price"}).status_code == 200
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 0)
+    assert client.get("/pharmacies/Slow Pharmacy 0/masks").status_code == 200
+
+    response = client.get("/admin/slow_queries")
+    log = response.json()
+    assert log["recorded"] == len(log["queries"]) > 0
+    assert "Slow Pharmacy 0" not in response.text
+    record = next(r for r in log["queries"] if "FROM pharmacies" in r["statement"] and "str" in r["parameter_types"])
+    assert record["route"] == "GET /pharmacies/{pharmacy_name}/masks"
+    assert record["duration_ms"] > 0
+    assert record["plan"] and "EXPLAIN failed" not in record["plan"][0]
+    slow_query_log.clear()
+
+    assert normalize_sql("SELECT *\n  FROM t WHERE id IN (?, ?, ?) AND name = 'x' LIMIT 10") == \
+        "SELECT * FROM t WHERE id IN (?, ...) AND name = ? LIMIT ?"
+
+
+def test_profiled_request_with_one_profiler_per_process(client, monkeypatch, tmp_path):
+    """
+    With one cProfile profiler allowed per process (Python 3.12+), a profiled request still runs its database
+    work and answers normally instead of failing with 'Another profiling tool is already active'.
+    """
+    import cProfile
+    from app.profiling import profiler
+
+    class SingleProfile(cProfile.Profile):
+        active = None
+
+        def enable(self, *args, **kwargs):
+            if SingleProfile.active is not None:
+                raise ValueError("Another profiling tool is already active")
+            super().enable(*args, **kwargs)
+            SingleProfile.active = self
+
+        def disable(self):
+            super().disable()
+            if SingleProfile.active is self:
+                SingleProfile.active = None
+
+    monkeypatch.setattr(cProfile, "Profile", SingleProfile)
+    monkeypatch.setattr(profiler, "enabled", True)
+    monkeypatch.setattr(profiler, "token", "s3cret")
+    monkeypatch.setattr(profiler, "directory", str(tmp_path))
+    response = client.get("/search", params={"query_name": "Profile", "search_type": "pharmacy"},
+                          headers={"X-Profile": "s3cret"})
+    assert response.status_code == 200
+    assert (tmp_path / (response.headers["X-Profile-Id"] + ".prof")).exists()
+    assert SingleProfile.active is None
+
+
+def test_profiled_request_writes_stats_and_collapsed_stacks(client, monkeypatch, tmp_path):
+    """
+    A request with the profile token in the profile header writes a loadable .prof file and collapsed stacks
+    covering the route's work; without the configured token the header is ignored.
+    """
+    import pstats
+    from app.profiling import profiler
+
+    db = next(client.app.dependency_overrides[search.get_read_db]())
+    if not db.query(Pharmacy).filter_by(name="Profile Pharmacy 0").first():
+        setup_catalog(db, "Profile", 2)
+
+    monkeypatch.setattr(profiler, "enabled", True)
+    monkeypatch.setattr(profiler, "directory", str(tmp_path))
+    monkeypatch.setattr(profiler, "keep", 1)
+    params = {"query_name": "Profile", "search_type": "pharmacy"}
+    assert "X-Profile-Id" not in client.get("/search", params=params).headers
+    assert "X-Profile-Id" not in client.get("/search", params=params, headers={"X-Profile": "1"}).headers
+    monkeypatch.setattr(profiler, "token", "s3cret")
+    assert "X-Profile-Id" not in client.get("/search", params=params, headers={"X-Profile": "1"}).headers
+
+    for _ in range(2):
+        response = client.get("/search", params=params, headers={"X-Profile": "s3cret"})
+        assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    assert "-GET-search-" in profile_id
+    assert sorted(path.name for path in tmp_path.iterdir()) == [profile_id + ".collapsed", profile_id + ".prof"]
+
+    functions = {name for _, _, name in pstats.Stats(str(tmp_path / (profile_id + ".prof"))).stats}
+    assert "search_catalog" in functions
+    lines = (tmp_path / (profile_id + ".collapsed")).read_text().splitlines()
+    assert any(":search_catalog:" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+@pytest.mark.parametrize("term", ["helth", "mart", "prime", "medcare", "kf94", "mask", "pharmcy", "blak", "ce", "zzz"])
+def test_trigram_search_matches_full_scan(term):
+    """
+    Narrowing to trigram candidates ranks the same names, fuzzy matches included, as scoring every name.
+    """
+    import json
+    from app.utils.trigram import TrigramIndex
+
+    pharmacies = json.load(open("data/pharmacies.json", encoding="utf-8"))
+    names = sorted({entry["name"] for entry in pharmacies} | {mask["name"] for entry in pharmacies for mask in entry["masks"]})
+    index = TrigramIndex(enumerate(names))
+
+    full_scan = sorted(
+        ((item_id, score) for item_id, name in enumerate(names)
+         if (score := search.calculate_relevance_score(term, name)) > 0),
+        key=search.relevance_key
+    )
+    narrowed = index.search(term, search.calculate_relevance_score, min_similarity=search.FUZZY_CUTOFF)
+    assert sorted(narrowed, key=search.relevance_key) == full_scan
@@ -0,0 +1,176 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db import create_db_engine, read_only_url, engine_options
+
+
+# Test: SQLite pragmas are applied on every new connection
+def test_sqlite_pragmas_applied(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.sqlite'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -64000
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    assert engine.pool.size() == 5
+    engine.dispose()
+
+
+# Test: the read-only engine reads the writer's data but rejects writes
+def test_read_only_engine(tmp_path):
+    url = f"sqlite:///{tmp_path / 'reads.sqlite'}"
+    writer = create_db_engine(url)
+    with writer.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO items (id) VALUES (1)"))
+
+    reader = create_db_engine(read_only_url(url), read_only=True)
+    with reader.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM items")).scalar() == 1
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO items (id) VALUES (2)"))
+    reader.dispose()
+    writer.dispose()
+
+
+# Test: read-only URL derivation and pool options for in-memory databases
+def test_read_only_url_and_memory_pool():
+    assert read_only_url("sqlite:///db.sqlite") == "sqlite:///file:db.sqlite?mode=ro&uri=true"
+    assert read_only_url("sqlite+aiosqlite:///db.sqlite") == "sqlite+aiosqlite:///file:db.sqlite?mode=ro&uri=true"
+    assert read_only_url("sqlite://") == "sqlite://"
+    assert "pool_size" not in engine_options("sqlite://", 5, 10)
+    assert engine_options("sqlite:///db.sqlite", 5, 10)["max_overflow"] == 10
+
+
+# Test: with DB_ASYNC and a read pool, a sync DATABASE_READ_URL is used in its aiosqlite form
+@pytest.mark.parametrize("read_url, expected", [
+    (None, "sqlite+aiosqlite file:{path}"),
+    ("sqlite:///{path}", "sqlite+aiosqlite {path}"),
+])
+def test_async_read_engine_url(tmp_path, read_url, expected):
+    import os
+    import subprocess
+    import sys
+
+    path = tmp_path / "async_reads.sqlite"
+    env = {**os.environ, "DB_ASYNC": "1", "DB_READ_POOL": "1", "DATABASE_URL": f"sqlite:///{path}"}
+    env.pop("DATABASE_READ_URL", None)
+    env.pop("ASYNC_DATABASE_URL", None)
+    env.pop("ASYNC_DATABASE_READ_URL", None)
+    if read_url:
+        env["DATABASE_READ_URL"] = read_url.format(path=path)
+    output = subprocess.run(
+        [sys.executable, "-c", "from app import db; print(db.async_read_engine.url.drivername, db.async_read_engine.url.database)"],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == expected.format(path=path)
+
+
+# Test: create_schema adds indexes missing from tables created by an older schema
+def test_create_schema_adds_missing_indexes(tmp_path):
+    from sqlalchemy import inspect
+    from app.models import create_schema
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'schema.sqlite'}")
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_pharmacy_masks_pharmacy_mask"))
+        conn.execute(text("DROP INDEX ix_transactions_date"))
+
+    create_schema(engine)
+    inspector = inspect(engine)
+    pharmacy_mask_indexes = {index["name"]: index for index in inspector.get_indexes("pharmacy_masks")}
+    assert pharmacy_mask_indexes["uq_pharmacy_masks_pharmacy_mask"]["unique"]
+    assert "ix_transactions_date" in {index["name"] for index in inspector.get_indexes("transactions")}
+    engine.dispose()
+
+
+# Test: create_schema adds nullable columns missing from tables created by an older schema
+def test_create_schema_adds_missing_columns(tmp_path):
+    from sqlalchemy import inspect
+    from app.models import create_schema
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'columns.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, pharmacy_id INTEGER NOT NULL,"
+            " mask_id INTEGER NOT NULL, transaction_amount FLOAT NOT NULL, transaction_date DATETIME NOT NULL)"
+        ))
+
+    create_schema(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns("transactions")}
+    assert {"quantity", "unit_price_cents"} <= columns
+    engine.dispose()
+
+
+# Test: create_schema converts dollar float columns of an older database into integer cents
+def test_create_schema_migrates_dollars_to_cents(tmp_path):
+    from sqlalchemy import inspect
+    from app.models import create_schema
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'dollars.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE pharmacies (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, cash_balance FLOAT NOT NULL)"))
+        conn.execute(text(
+            "CREATE TABLE pharmacy_masks (id INTEGER PRIMARY KEY, pharmacy_id INTEGER NOT NULL, mask_id INTEGER NOT NULL,"
+            " price FLOAT NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX ix_pharmacy_masks_price_pharmacy ON pharmacy_masks (price, pharmacy_id)"))
+        conn.execute(text("INSERT INTO pharmacies (id, name, cash_balance) VALUES (1, 'Old', 328.41), (2, 'Older', 19.99)"))
+        conn.execute(text("INSERT INTO pharmacy_masks (pharmacy_id, mask_id, price) VALUES (1, 1, 0.29), (2, 1, 12.5)"))
+
+    create_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT cash_balance_cents FROM pharmacies ORDER BY id")).scalars().all() == [32841, 1999]
+        assert conn.execute(text("SELECT typeof(price_cents) FROM pharmacy_masks")).scalars().all() == ["integer"] * 2
+        assert conn.execute(text("SELECT price_cents FROM pharmacy_masks ORDER BY id")).scalars().all() == [29, 1250]
+    inspector = inspect(engine)
+    assert "cash_balance" not in {column["name"] for column in inspector.get_columns("pharmacies")}
+    price_index = next(i for i in inspector.get_indexes("pharmacy_masks") if i["name"] == "ix_pharmacy_masks_price_pharmacy")
+    assert price_index["column_names"] == ["price_cents", "pharmacy_id"]
+
+    create_schema(engine)  # Idempotent
+    engine.dispose()
+
+
+# Test: create_schema fills the derived tables of a database loaded before they existed
+def test_create_schema_populates_derived_tables(tmp_path):
+    from app.models import create_schema
+
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'derived.sqlite'}")
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO pharmacies (id, name, cash_balance_cents) VALUES (1, 'Old', 0)"))
+        conn.execute(text(
+            "INSERT INTO opening_hours (pharmacy_id, day_of_week, start_time, end_time, is_overnight)"
+            " VALUES (1, 'Mon', '08:00:00', '12:00:00', 0)"
+        ))
+        conn.execute(text("INSERT INTO masks (id, name) VALUES (1, 'Mask')"))
+        conn.execute(text("INSERT INTO pharmacy_masks (pharmacy_id, mask_id, price_cents) VALUES (1, 1, 250)"))
+        conn.execute(text("INSERT INTO users (id, name, cash_balance_cents) VALUES (1, 'Buyer', 0)"))
+        conn.execute(text(
+            "INSERT INTO transactions (user_id, pharmacy_id, mask_id, transaction_amount_cents, transaction_date)"
+            " VALUES (1, 1, 1, 750, '2021-01-04 10:00:00'), (1, 1, 1, 250, '2021-01-04 11:00:00')"
+        ))
+
+    create_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT start_minute, end_minute FROM opening_intervals")).all() == [(480, 720)]
+        assert conn.execute(text(
+            "SELECT day, transaction_count, quantity, total_value_cents FROM daily_sales"
+        )).all() == [("2021-01-04", 2, 4, 1000)]
+        assert conn.execute(text("SELECT day, user_id, total_amount_cents FROM user_daily_spend")).all() == \
+            [("2021-01-04", 1, 1000)]
+    engine.dispose()
+
+
+# Test: dollar amounts convert to cents exactly, rounding half up
+def test_money_conversion():
+    from decimal import ROUND_CEILING, ROUND_FLOOR
+    from app.utils.money import to_cents, from_cents
+
+    assert [to_cents(value) for value in (19.99, 0.29, 1.005, 0.015, 12, "7.10")] == [1999, 29, 101, 2, 1200, 710]
+    assert to_cents(10.001, ROUND_CEILING) == 1001 and to_cents(10.009, ROUND_FLOOR) == 1000
+    assert from_cents(1999) == 19.99
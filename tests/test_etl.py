@@ -0,0 +1,512 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app import etl
+from app.models import Base, Pharmacy, OpeningHour, Mask, PharmacyMask, User, Transaction
+
+PHARMACIES_PATH = "data/pharmacies.json"
+USERS_PATH = "data/users.json"
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    """
+    Build sessions on fresh SQLite files under tmp_path.
+    """
+    sessions = []
+
+    def factory(name="etl.sqlite"):
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        sessions.append(session)
+        return session
+
+    yield factory
+    for session in sessions:
+        session.close()
+
+
+def snapshot(session):
+    """
+    Return the loaded data keyed by names, independent of surrogate ids.
+    """
+    pharmacy_names = dict(session.execute(select(Pharmacy.id, Pharmacy.name)).all())
+    mask_names = dict(session.execute(select(Mask.id, Mask.name)).all())
+    user_names = dict(session.execute(select(User.id, User.name)).all())
+    return {
+        "pharmacies": sorted(session.execute(select(Pharmacy.name, Pharmacy.cash_balance_cents)).all()),
+        "users": sorted(session.execute(select(User.name, User.cash_balance_cents)).all()),
+        "masks": sorted(mask_names.values()),
+        "opening_hours": sorted(
+            (pharmacy_names[h.pharmacy_id], h.day_of_week, h.start_time, h.end_time, h.is_overnight)
+            for h in session.scalars(select(OpeningHour))
+        ),
+        "pharmacy_masks": sorted(
+            (pharmacy_names[pm.pharmacy_id], mask_names[pm.mask_id], pm.price_cents)
+            for pm in session.scalars(select(PharmacyMask))
+        ),
+        "transactions": sorted(
+            (user_names[t.user_id], pharmacy_names[t.pharmacy_id], mask_names[t.mask_id],
+             t.transaction_amount_cents, t.transaction_date)
+            for t in session.scalars(select(Transaction))
+        ),
+    }
+
+
+def test_bulk_load_matches_orm_load(make_session):
+    orm_session = make_session("orm.sqlite")
+    etl.load_pharmacies(orm_session, PHARMACIES_PATH)
+    etl.load_users(orm_session, USERS_PATH)
+    orm_session.commit()
+
+    bulk_session = make_session("bulk.sqlite")
+    stats = etl.StageStats()
+    etl.bulk_load_pharmacies(bulk_session, PHARMACIES_PATH, stats, batch_size=7)
+    etl.bulk_load_users(bulk_session, USERS_PATH, stats, batch_size=7)
+    bulk_session.commit()
+
+    assert snapshot(bulk_session) == snapshot(orm_session)
+    assert stats.rows["transactions"] == 100
+
+
+def test_bulk_load_deduplicates_across_runs_and_within_feed(make_session, tmp_path):
+    users_path = tmp_path / "users.json"
+    purchase = {
+        "pharmacyName": "Carepoint",
+        "maskName": "Masquerade (blue) (6 per pack)",
+        "transactionAmount": 7.05,
+        "transactionDate": "2021-01-04 15:18:51"
+    }
+    users_path.write_text(json.dumps([
+        {"name": "Dup", "cashBalance": 10.0, "purchaseHistories": [purchase, purchase]},
+        {"name": "Dup", "cashBalance": 20.0, "purchaseHistories": [purchase]},
+    ]))
+
+    session = make_session()
+    for _ in range(2):
+        stats = etl.StageStats()
+        etl.bulk_load_pharmacies(session, PHARMACIES_PATH, stats)
+        etl.bulk_load_users(session, str(users_path), stats)
+        session.commit()
+
+    assert session.execute(select(User.cash_balance_cents)).scalars().all() == [2000]
+    assert len(session.execute(select(Transaction.id)).all()) == 1
+    assert len(session.execute(select(Pharmacy.id)).all()) == 20
+
+
+def test_stream_load_matches_bulk_load(make_session, tmp_path):
+    bulk_session = make_session("bulk.sqlite")
+    stats = etl.StageStats()
+    etl.bulk_load_pharmacies(bulk_session, PHARMACIES_PATH, stats)
+    etl.bulk_load_users(bulk_session, USERS_PATH, stats)
+    bulk_session.commit()
+
+    stream_session = make_session("stream.sqlite")
+    checkpoint = etl.Checkpoint(str(tmp_path / "checkpoint.json"))
+    stats = etl.StageStats()
+    etl.stream_load_pharmacies(stream_session, PHARMACIES_PATH, stats, checkpoint, chunk_size=3)
+    etl.stream_load_users(stream_session, USERS_PATH, stats, checkpoint, chunk_size=3)
+
+    assert snapshot(stream_session) == snapshot(bulk_session)
+
+
+def test_stream_load_resumes_from_checkpoint(make_session, tmp_path, monkeypatch):
+    session = make_session()
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    stats = etl.StageStats()
+    etl.stream_load_pharmacies(session, PHARMACIES_PATH, stats, etl.Checkpoint(checkpoint_path))
+
+    load_user_chunk = etl.load_user_chunk
+    calls = []
+
+    def crash_on_third_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError("crash")
+        load_user_chunk(*args, **kwargs)
+
+    monkeypatch.setattr(etl, "load_user_chunk", crash_on_third_chunk)
+    with pytest.raises(RuntimeError):
+        etl.stream_load_users(session, USERS_PATH, stats, etl.Checkpoint(checkpoint_path), chunk_size=4)
+    session.rollback()
+    assert len(session.execute(select(User.id)).all()) == 8
+
+    calls.clear()
+    monkeypatch.setattr(etl, "load_user_chunk", lambda *args, **kwargs: (calls.append(1), load_user_chunk(*args, **kwargs)))
+    etl.stream_load_users(session, USERS_PATH, stats, etl.Checkpoint(checkpoint_path), chunk_size=4)
+
+    assert len(calls) == 3
+    assert len(session.execute(select(User.id)).all()) == 20
+    assert len(session.execute(select(Transaction.id)).all()) == 100
+
+
+def test_incremental_load_applies_only_changed_records(make_session, tmp_path):
+    pharmacies = json.load(open(PHARMACIES_PATH, encoding="utf-8"))
+    users = json.load(open(USERS_PATH, encoding="utf-8"))
+    pharmacies_path = tmp_path / "pharmacies.json"
+    users_path = tmp_path / "users.json"
+    pharmacies_path.write_text(json.dumps(pharmacies))
+    users_path.write_text(json.dumps(users))
+
+    session = make_session()
+    for _ in range(2):
+        diff = etl.DiffSummary()
+        etl.bulk_load_pharmacies(session, str(pharmacies_path), etl.StageStats(), diff=diff)
+        etl.bulk_load_users(session, str(users_path), etl.StageStats(), diff=diff)
+        session.commit()
+    assert diff.counts == {"pharmacies": {"unchanged": 20}, "users": {"unchanged": 20}, "purchases": {"added": 0}}
+    assert len(session.execute(select(OpeningHour.id)).all()) == 98
+
+    pharmacies[1]["openingHours"] = "Sat 10:00 - 11:00"
+    pharmacies[1]["masks"][0]["price"] = 1.5
+    users[0]["purchaseHistories"].append({
+        "pharmacyName": pharmacies[1]["name"],
+        "maskName": pharmacies[1]["masks"][0]["name"],
+        "transactionAmount": 3.0,
+        "transactionDate": "2021-02-01 10:00:00"
+    })
+    pharmacies_path.write_text(json.dumps(pharmacies))
+    users_path.write_text(json.dumps(users))
+
+    diff = etl.DiffSummary()
+    etl.stream_load_pharmacies(session, str(pharmacies_path), etl.StageStats(),
+                               etl.Checkpoint(str(tmp_path / "checkpoint.json")), diff=diff)
+    etl.stream_load_users(session, str(users_path), etl.StageStats(),
+                          etl.Checkpoint(str(tmp_path / "checkpoint.json")), diff=diff)
+
+    assert diff.counts == {
+        "pharmacies": {"unchanged": 19, "changed": 1},
+        "users": {"changed": 1, "unchanged": 19},
+        "purchases": {"added": 1},
+    }
+    pharmacy = session.scalars(select(Pharmacy).filter_by(name=pharmacies[1]["name"])).one()
+    assert [(h.day_of_week, h.start_time.hour) for h in pharmacy.opening_hours] == [("Sat", 10)]
+    assert [pm.price_cents for pm in pharmacy.masks] == [150]
+    assert len(session.execute(select(OpeningHour.id)).all()) == 98 - 5 + 1
+    assert len(session.execute(select(Transaction.id)).all()) == 101
+
+
+def test_parallel_transform_matches_serial_load(make_session):
+    serial_session = make_session("serial.sqlite")
+    etl.bulk_load_pharmacies(serial_session, PHARMACIES_PATH, etl.StageStats())
+    etl.bulk_load_users(serial_session, USERS_PATH, etl.StageStats())
+    serial_session.commit()
+
+    parallel_session = make_session("parallel.sqlite")
+    etl.bulk_load_pharmacies(parallel_session, PHARMACIES_PATH, etl.StageStats(), batch_size=3, workers=2)
+    etl.bulk_load_users(parallel_session, USERS_PATH, etl.StageStats(), batch_size=3, workers=2)
+    parallel_session.commit()
+
+    assert snapshot(parallel_session) == snapshot(serial_session)
+
+
+def test_transform_rejects_invalid_records():
+    valid = {
+        "name": "Valid", "cashBalance": 1.0,
+        "purchaseHistories": [{
+            "pharmacyName": "P", "maskName": "M", "transactionAmount": 2.0,
+            "transactionDate": "2021-01-04 15:18:51"
+        }]
+    }
+    record = etl.transform_user(valid)
+    assert record.purchases[0][3].day == 4
+    assert etl.transform_user({**valid, "cashBalance": "1.0"}) is None
+    assert etl.transform_user({**valid, "purchaseHistories": [{"pharmacyName": "P"}]}) is None
+
+    stats = etl.StageStats()
+    chunks = [([valid, {"name": ""}], None)]
+    assert [len(records) for records, _ in etl.transform_chunks(chunks, etl.transform_user, stats)] == [1]
+    assert stats.invalid == 1
+    assert etl.transform_pharmacy({"name": "P", "cashBalance": 1, "openingHours": "Mon - Xyz 08:00 - 10:00", "masks": []}) is None
+
+
+def test_daily_sales_rollup_matches_transactions(make_session):
+    """
+    Summing daily_sales over any day range gives the same totals as aggregating the raw transactions.
+    """
+    from datetime import date, datetime
+    from sqlalchemy import func
+    from app.api.summary import summarize_sales
+    from app.rollups import rebuild_daily_sales
+
+    session = make_session()
+    etl.bulk_load_pharmacies(session, PHARMACIES_PATH, etl.StageStats())
+    etl.bulk_load_users(session, USERS_PATH, etl.StageStats())
+    etl.backfill_transaction_quantities(session)
+    rebuild_daily_sales(session)
+    session.commit()
+
+    for start_day, end_day in [(date(2021, 1, 1), date(2021, 1, 31)), (date(2000, 1, 1), date(2030, 1, 1))]:
+        raw = session.execute(
+            select(
+                func.count(Transaction.id),
+                func.sum(Transaction.quantity),
+                func.sum(Transaction.transaction_amount_cents)
+            )
+            .where(Transaction.transaction_date.between(
+                datetime.combine(start_day, datetime.min.time()), datetime.combine(end_day, datetime.max.time())
+            ))
+        ).one()
+
+        summary = summarize_sales(session, start_day, end_day)
+        assert summary["total_transactions"] == raw[0] > 0
+        assert summary["total_masks_sold"] == raw[1]
+        assert summary["total_value"] == raw[2] / 100
+
+
+def test_user_spend_index_matches_group_by(make_session, monkeypatch):
+    """
+    The in-memory spend index ranks users exactly like the GROUP BY over raw transactions.
+    """
+    from datetime import date, datetime
+    from app.api import users
+    from app.rollups import rebuild_rollups
+
+    session = make_session()
+    etl.bulk_load_pharmacies(session, PHARMACIES_PATH, etl.StageStats())
+    etl.bulk_load_users(session, USERS_PATH, etl.StageStats())
+    rebuild_rollups(session)
+    session.commit()
+    monkeypatch.setattr(users, "spend_index", users.UserSpendIndex())
+
+    for start_day, end_day in [(date(2021, 1, 1), date(2021, 1, 7)), (date(2021, 1, 1), date(2021, 1, 31)),
+                               (date(2000, 1, 1), date(2030, 1, 1))]:
+        for limit in (1, 5, 100):
+            expected = users.rank_top_users(
+                session, limit, datetime.combine(start_day, datetime.min.time()),
+                datetime.combine(end_day, datetime.max.time()).replace(microsecond=0)
+            )
+            assert users.rank_top_users_from_index(session, limit, start_day, end_day, None, False).body == expected
+
+
+def test_backfill_transaction_quantities(make_session):
+    """
+    Feed transactions get quantity and unit_price_cents with amount == quantity * unit price; set values are kept.
+    """
+    session = make_session()
+    etl.bulk_load_pharmacies(session, PHARMACIES_PATH, etl.StageStats())
+    etl.bulk_load_users(session, USERS_PATH, etl.StageStats())
+    first = session.scalars(select(Transaction).order_by(Transaction.id)).first()
+    first.quantity, first.unit_price_cents = 3, first.transaction_amount_cents // 3
+    session.flush()
+
+    etl.backfill_transaction_quantities(session)
+    session.expire_all()
+
+    transactions = session.scalars(select(Transaction).order_by(Transaction.id)).all()
+    assert transactions[0].quantity == 3
+    for transaction in transactions[1:]:
+        assert transaction.quantity >= 1
+        assert transaction.quantity * transaction.unit_price_cents == transaction.transaction_amount_cents
+
+
+def test_etl_run_bumps_data_versions(tmp_path, monkeypatch):
+    from app.cache import SCOPES
+    from app.models import DataVersion
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'versions.sqlite'}")
+    SessionLocal = sessionmaker(bind=engine)
+    monkeypatch.setattr(etl, "engine", engine)
+    monkeypatch.setattr(etl, "SessionLocal", SessionLocal)
+
+    def versions():
+        with SessionLocal() as session:
+            return dict(session.execute(select(DataVersion.scope, DataVersion.version)).all())
+
+    etl.main(["--pharmacies", PHARMACIES_PATH, "--users", USERS_PATH])
+    assert versions() == dict.fromkeys(SCOPES, 1)
+    etl.main(["--bulk", "--pharmacies", PHARMACIES_PATH, "--users", USERS_PATH])
+    assert versions() == dict.fromkeys(SCOPES, 2)
+    engine.dispose()
+
+
+def test_datagen_is_reproducible_and_loadable(make_session, tmp_path):
+    from app import datagen
+    from app.utils.time_parser import parse_opening_hours
+
+    first = datagen.generate(tmp_path / "a", 40, 60, 500, seed=7)
+    second = datagen.generate(tmp_path / "b", 40, 60, 500, seed=7)
+    other = datagen.generate(tmp_path / "c", 40, 60, 500, seed=8)
+    for a, b, c in zip(first, second, other):
+        assert open(a, "rb").read() == open(b, "rb").read() != open(c, "rb").read()
+
+    pharmacies = json.load(open(first[0]))
+    users = json.load(open(first[1]))
+    assert len(pharmacies) == 40 and len(users) == 60
+    assert sum(len(user["purchaseHistories"]) for user in users) == 500
+    hours = [pharmacy["openingHours"] for pharmacy in pharmacies]
+    assert all(parse_opening_hours(spec) for spec in hours)
+    assert any("Thur" in spec for spec in hours)
+    assert any(entry["is_overnight"] for spec in hours for entry in parse_opening_hours(spec))
+
+    session = make_session()
+    stats = etl.StageStats()
+    etl.bulk_load_pharmacies(session, first[0], stats)
+    etl.bulk_load_users(session, first[1], stats)
+    assert stats.rows["transactions"] == 500
+
+    for option in ("--pharmacies", "--users", "--days"):
+        with pytest.raises(SystemExit):
+            datagen.parse_args([option, "0"])
+    assert datagen.parse_args(["--purchases", "0"]).purchases == 0
+
+
+def test_json_stream_rejects_malformed_items_without_reading_ahead(tmp_path):
+    from app.utils.json_stream import iter_json_array
+
+    items = [{"name": "Café \"A\" \\", "amount": -12.5e3, "flags": [True, False, None]}] * 3
+    path = tmp_path / "ok.json"
+    path.write_text(json.dumps(items, indent=2), encoding="utf-8")
+    for block_size in range(1, 40):
+        assert [item for item, _ in iter_json_array(path, block_size=block_size)] == items
+
+    malformed = tmp_path / "malformed.json"
+    malformed.write_text('[{"a": 1}, {"a": tru x}, ' + '{"a": 2}, ' * 100_000 + "{}]")
+    with pytest.raises(ValueError, match="Invalid JSON at byte 17"):
+        next(item for item, _ in iter_json_array(malformed, block_size=16) if item != {"a": 1})
+
+    missing_comma = tmp_path / "missing_comma.json"
+    missing_comma.write_text('[{"a": 1} {"a": 2}]')
+    with pytest.raises(ValueError, match="Expected ',' or ']' at byte 10"):
+        list(iter_json_array(missing_comma, block_size=4))
+
+    oversized = tmp_path / "oversized.json"
+    oversized.write_text('[{"a": "' + "x" * 1000 + '"}]')
+    with pytest.raises(ValueError, match="exceeds 100 characters"):
+        list(iter_json_array(oversized, block_size=16, max_item_size=100))
+
+
+def test_add_transactions_matches_rollup_rebuild(make_session):
+    """
+    Adding only the transactions appended since a run to the rollups gives the same rows as a full rebuild.
+    """
+    from datetime import timedelta
+    from sqlalchemy import func, insert
+    from app.models import DailySales, UserDailySpend
+    from app.rollups import add_transactions, rebuild_rollups
+
+    session = make_session()
+    etl.bulk_load_pharmacies(session, PHARMACIES_PATH, etl.StageStats())
+    etl.bulk_load_users(session, USERS_PATH, etl.StageStats())
+    etl.backfill_transaction_quantities(session)
+    rebuild_rollups(session)
+
+    last_id = session.scalar(select(func.max(Transaction.id)))
+    session.execute(insert(Transaction), [
+        {"user_id": t.user_id, "pharmacy_id": t.pharmacy_id, "mask_id": t.mask_id, "quantity": t.quantity,
+         "transaction_amount_cents": t.transaction_amount_cents + 1,
+         "transaction_date": t.transaction_date + timedelta(days=t.id % 3 * 400)}
+        for t in session.scalars(select(Transaction).where(Transaction.id <= 30))
+    ])
+    new_ids = session.scalars(select(Transaction.id).where(Transaction.id > last_id)).all()
+    add_transactions(session, new_ids, batch_size=7)
+
+    def rollups():
+        return (
+            sorted(session.execute(select(DailySales.day, DailySales.pharmacy_id, DailySales.mask_id,
+                                          DailySales.transaction_count, DailySales.quantity,
+                                          DailySales.total_value_cents)).all()),
+            sorted(session.execute(select(UserDailySpend.day, UserDailySpend.user_id,
+                                          UserDailySpend.total_amount_cents)).all()),
+        )
+
+    incremental = rollups()
+    rebuild_rollups(session)
+    assert incremental == rollups()
+
+
+def test_incremental_etl_run_only_refreshes_what_changed(tmp_path, monkeypatch):
+    from sqlalchemy import event
+    from app.cache import SCOPES
+    from app.models import DataVersion, DailySales, OpeningInterval, UserDailySpend
+    from app.rollups import rebuild_rollups
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'incremental.sqlite'}")
+    SessionLocal = sessionmaker(bind=engine)
+    monkeypatch.setattr(etl, "engine", engine)
+    monkeypatch.setattr(etl, "SessionLocal", SessionLocal)
+    users = json.load(open(USERS_PATH, encoding="utf-8"))
+    users_path = tmp_path / "users.json"
+    users_path.write_text(json.dumps(users))
+    argv = ["--incremental", "--pharmacies", PHARMACIES_PATH, "--users", str(users_path)]
+    etl.main(argv)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    etl.main(argv)
+    writes = [statement for statement in statements
+              if statement.startswith(("INSERT", "UPDATE", "DELETE"))
+              and any(table in statement for table in ("daily_sales", "user_daily_spend", "opening_intervals", "data_versions"))]
+    assert writes == []
+
+    def state():
+        with SessionLocal() as session:
+            return (
+                dict(session.execute(select(DataVersion.scope, DataVersion.version)).all()),
+                sorted(session.execute(select(DailySales.day, DailySales.pharmacy_id, DailySales.mask_id,
+                                              DailySales.transaction_count, DailySales.quantity,
+                                              DailySales.total_value_cents)).all()),
+                sorted(session.execute(select(UserDailySpend.day, UserDailySpend.user_id,
+                                              UserDailySpend.total_amount_cents)).all()),
+                len(session.execute(select(OpeningInterval.id)).all()),
+            )
+
+    assert state()[0] == dict.fromkeys(SCOPES, 1)
+
+    users[0]["purchaseHistories"].append(dict(users[0]["purchaseHistories"][0], transactionDate="2021-02-01 10:00:00"))
+    users_path.write_text(json.dumps(users))
+    etl.main(argv)
+    versions, sales, spend, intervals = state()
+    assert versions == {"catalog": 1, "balances": 2, "sales": 2}
+
+    with SessionLocal() as session:
+        rebuild_rollups(session)
+        session.commit()
+    assert state()[1:] == (sales, spend, intervals)
+    engine.dispose()
+
+
+def test_stream_incremental_run_refreshes_after_a_failed_refresh(tmp_path, monkeypatch):
+    """
+    A stream run that dies after committing its chunks keeps its checkpoint, so the next run rebuilds the
+    derived tables instead of finding every record unchanged.
+    """
+    from sqlalchemy import func
+    from app.models import DailySales
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'refresh.sqlite'}")
+    SessionLocal = sessionmaker(bind=engine)
+    monkeypatch.setattr(etl, "engine", engine)
+    monkeypatch.setattr(etl, "SessionLocal", SessionLocal)
+    users = json.load(open(USERS_PATH, encoding="utf-8"))
+    users_path = tmp_path / "users.json"
+    users_path.write_text(json.dumps(users))
+    checkpoint_path = tmp_path / "checkpoint.json"
+    argv = ["--stream", "--incremental", "--checkpoint", str(checkpoint_path),
+            "--pharmacies", PHARMACIES_PATH, "--users", str(users_path)]
+    etl.main(argv)
+    assert not checkpoint_path.exists()
+
+    users[0]["purchaseHistories"].append(dict(users[0]["purchaseHistories"][0], transactionDate="2021-02-01 10:00:00"))
+    users_path.write_text(json.dumps(users))
+
+    def crash(session, diff):
+        raise RuntimeError("crash")
+
+    refresh_changed = etl.refresh_changed
+    monkeypatch.setattr(etl, "refresh_changed", crash)
+    with pytest.raises(RuntimeError):
+        etl.main(argv)
+    assert checkpoint_path.exists()
+
+    monkeypatch.setattr(etl, "refresh_changed", refresh_changed)
+    etl.main(argv)
+    assert not checkpoint_path.exists()
+    with SessionLocal() as session:
+        assert session.scalar(select(func.sum(DailySales.transaction_count))) == 101
+        assert session.scalar(select(func.count(Transaction.id)).where(Transaction.quantity.is_(None))) == 0
+    engine.dispose()